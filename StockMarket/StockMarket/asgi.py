@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'StockMarket.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, the live rates stream wraps the Django app
+from finance.live import LiveRatesApp
+
+application = LiveRatesApp(django_application)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'finance.instrumentation.timing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +56,8 @@ ROOT_URLCONF = 'StockMarket.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates timing renders for finance.instrumentation
+        'BACKEND': 'finance.instrumentation.TimedTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,6 +84,9 @@ DATABASES = {
     }
 }
 
+# PRAGMA name -> value run on every new SQLite connection, see finance.db
+SQLITE_PRAGMAS = {}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -101,6 +107,11 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# manage.py test hashes the passwords of its throwaway users with MD5, see finance.testing
+
+TEST_RUNNER = 'finance.testing.FastHasherTestRunner'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -124,3 +135,134 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Quote cache in front of the IEX cloud API
+# BACKEND may name an alias from CACHES to share quotes between worker processes
+
+QUOTE_CACHE = {
+    'TTL': 5,
+    'STALE_TTL': 30,
+    'MAX_ENTRIES': 2048,
+    'BACKEND': None,
+}
+
+
+# Rendered portfolio pages, reused until the user trades or QUOTE_CACHE['TTL'] passes
+# With several worker processes BACKEND must name a cache they share, e.g. memcached or redis,
+# so that a trade in one of them invalidates the page everywhere
+
+PORTFOLIO_CACHE = {
+    'ENABLED': True,
+    'BACKEND': 'default',
+}
+
+
+# Local directory of listed symbols, written by manage.py refresh_symbols
+# Quotes for symbols missing from it are refused without calling the provider
+
+SYMBOL_DIRECTORY = {
+    'PATH': os.environ.get('SYMBOL_DIRECTORY_PATH', str(BASE_DIR / 'symbols.csv')),
+    'CHECK_INTERVAL': 60,
+}
+
+
+# Per user rate limits of the quote bound views and the quote provider quota shared by everyone.
+# Requests over their limit are served cached quotes, set BACKEND to a cache shared by the worker
+# processes for the limits to hold across them. Rates are "<count>/<s|m|h|d>".
+
+FINANCE_RATE_LIMITS = {
+    'ENABLED': True,
+    'BACKEND': None,
+    'RATES': {
+        'quote': '60/m',
+        'buy': '20/m',
+        'sell': '20/m',
+        'orders': '10/m',
+    },
+    'USER_RATES': {},
+    'UPSTREAM_RATE': os.environ.get('QUOTE_UPSTREAM_RATE') or None,
+    'DEGRADED_MAX_AGE': 300,
+}
+
+
+# Background refresh of held symbols by manage.py refresh_quotes
+
+QUOTE_REFRESH = {
+    'INTERVAL': 4,
+    'CLOSED_INTERVAL': 300,
+    'BATCH_SIZE': 100,
+}
+
+# Quote providers used by finance.helpers.lookup, picked with the QUOTE_PROVIDER environment variable:
+# 'iex' for live quotes, 'replay' to serve a capture made with manage.py record_quotes and
+# 'simulator' for a deterministic offline market, e.g. for load tests
+
+QUOTE_PROVIDERS = {
+    'iex': {
+        'BACKEND': 'finance.providers.IEXProvider',
+        'OPTIONS': {
+            'BASE_URL': os.environ.get('IEX_BASE_URL', 'https://cloud-sse.iexapis.com/stable'),
+            'API_KEY': os.environ.get('IEX_API_KEY', ''),
+            'POOL_SIZE': 10,
+            'CONNECT_TIMEOUT': 3.05,
+            'READ_TIMEOUT': 5,
+            'MAX_RETRIES': 2,
+            'BACKOFF': 0.1,
+            'RETRY_RATIO': 0.1,
+            'FAILURE_THRESHOLD': 5,
+            'RESET_TIMEOUT': 30,
+        },
+    },
+    'replay': {
+        'BACKEND': 'finance.providers.ReplayProvider',
+        'OPTIONS': {
+            'PATH': os.environ.get('QUOTE_REPLAY_PATH', str(BASE_DIR / 'quotes.jsonl')),
+            'SPEED': 1.0,
+            'LOOP': True,
+        },
+    },
+    'simulator': {
+        'BACKEND': 'finance.providers.SimulatorProvider',
+        'OPTIONS': {
+            'SYMBOLS': int(os.environ.get('QUOTE_SIMULATOR_SYMBOLS', 5000)),
+            'SEED': int(os.environ.get('QUOTE_SIMULATOR_SEED', 0)),
+            'START_PRICE': 100,
+            'VOLATILITY': 0.01,
+            'TICK': 1.0,
+        },
+    },
+}
+
+QUOTE_PROVIDER = QUOTE_PROVIDERS[os.environ.get('QUOTE_PROVIDER', 'iex')]
+
+
+# Cost of the shares sold when computing realized P&L: 'fifo' consumes the oldest lots
+# first, 'average' uses the average cost of the holding
+
+FINANCE_LOT_METHOD = 'fifo'
+
+
+# Serve quote, buy, sell and index as async views, for deployments behind StockMarket.asgi
+
+FINANCE_ASYNC_VIEWS = os.environ.get('FINANCE_ASYNC_VIEWS', '') == '1'
+
+
+# Live rates streamed as server-sent events by StockMarket.asgi
+
+LIVE_RATES = {
+    'PATH': '/live/',
+    'INTERVAL': 1.0,
+    'HEARTBEAT': 15,
+    'MAX_SYMBOLS': 50,
+}
+
+
+# Per request timings of upstream calls, queries and rendering, reported in Server-Timing
+# headers and as Prometheus metrics on /metrics/
+
+FINANCE_INSTRUMENTATION = {
+    'ENABLED': os.environ.get('FINANCE_INSTRUMENTATION', '') == '1',
+    'SERVER_TIMING': True,
+    'METRICS_IPS': ['127.0.0.1', '::1'],
+}
@@ -0,0 +1,40 @@
+"""
+Performance settings for StockMarket.
+
+Select with DJANGO_SETTINGS_MODULE=StockMarket.settings_performance. On top of
+the development settings, requests of logged in users read their session from
+a cache instead of the database and load the user's Cash row with the user:
+
+    PERFORMANCE_SESSION_ENGINE=cached_db  write through to the database, survives cache restarts (default)
+    PERFORMANCE_SESSION_ENGINE=cache      cache only, sessions are lost when evicted
+
+With several worker processes SESSION_CACHE_BACKEND and SESSION_CACHE_LOCATION
+must name a cache they share, e.g. memcached, or a logout in one process
+leaves the session alive in the others.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import os
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get('PERFORMANCE_SESSION_ENGINE', 'cached_db')
+
+SESSION_CACHE_ALIAS = 'sessions'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': os.environ.get('SESSION_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', 'sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# Users logged in with the default backend keep their session, without the Cash row prefetched
+AUTHENTICATION_BACKENDS = [
+    'finance.auth.CashModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
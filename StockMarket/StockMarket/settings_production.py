@@ -0,0 +1,62 @@
+"""
+Production settings for StockMarket.
+
+Select with DJANGO_SETTINGS_MODULE=StockMarket.settings_production and pick the
+database with STOCKMARKET_DB:
+
+    sqlite    single node, WAL journal on a local file (default)
+    postgres  multi node, configured through the POSTGRES_* variables
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, os
+
+DEBUG = os.environ.get('DJANGO_DEBUG', '') == '1'
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', SECRET_KEY)  # noqa: F405
+
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
+
+
+# Database
+# Connections are kept open between requests instead of reconnecting for each one
+
+CONN_MAX_AGE = int(os.environ.get('DJANGO_CONN_MAX_AGE', 600))
+
+if os.environ.get('STOCKMARKET_DB', 'sqlite') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'stockmarket'),
+            'USER': os.environ.get('POSTGRES_USER', 'stockmarket'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before giving up
+                'timeout': 20,
+            },
+        }
+    }
+
+    # WAL lets readers carry on while a trade is being written
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 20000,
+        'temp_store': 'MEMORY',
+        'cache_size': -20000,
+        'mmap_size': 268435456,
+    }
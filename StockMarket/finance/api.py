@@ -0,0 +1,448 @@
+import hashlib
+import json
+import math
+from functools import wraps
+
+from django.contrib.auth import authenticate
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+
+from . import symbols as symbol_directory
+from . import trading
+from .exports import export_options, export_response
+from .forms import AddBalanceForm, BuyForm, LimitOrderForm, PriceAlertForm
+from .helpers import lookup, lookup_many
+from .lots import position_costs, unrealized_pnl
+from .models import ApiToken, LimitOrder, PriceAlert
+from .money import price
+from .orders import place_orders
+from .portfolio import positions, valuate
+from .ratelimit import rate_limited
+from .snapshots import history
+from .trading import BatchRejected, TradeError
+
+# Version 1 of the JSON API, for clients that want data rather than pages.
+# Requests authenticate with an "Authorization: Token <key>" header obtained from token/.
+
+COMPACT_JSON = {"separators": (",", ":")}
+
+MAX_BATCH_SYMBOLS = 100
+MAX_BATCH_ORDERS = 1000
+LEDGER_PAGE_SIZE = 50
+HISTORY_POINTS = 200
+MAX_HISTORY_POINTS = 2000
+MAX_LEDGER_PAGE_SIZE = 500
+SYMBOL_SUGGESTIONS = 10
+MAX_SYMBOL_SUGGESTIONS = 50
+
+
+def api_response(request, data, status=200, etag=False):
+    """Compact JSON response, answering 304 when etag is set and the client has this body already."""
+    response = JsonResponse(data, status=status, json_dumps_params=COMPACT_JSON)
+    if etag:
+        response["ETag"] = quote_etag(hashlib.md5(response.content).hexdigest())
+        return get_conditional_response(request, etag=response["ETag"], response=response)
+    return response
+
+
+def api_error(message, status=400, **extra):
+    return JsonResponse({"error": message, **extra}, status=status, json_dumps_params=COMPACT_JSON)
+
+
+def api_rate_limited(request, retry_after):
+    response = api_error("Too many requests", 429, retry_after=math.ceil(retry_after))
+    response["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+
+def token_required(view):
+    """Authenticate the request from its API token instead of the session."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        scheme, _, key = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+        if scheme.lower() != "token" or not key:
+            return api_error("Authentication credentials were not provided", 401)
+
+        token = ApiToken.objects.select_related("my_user__cash").filter(key=key.strip(), my_user__is_active=True).first()
+        if token is None:
+            return api_error("Invalid token", 401)
+
+        request.user = token.my_user
+        return view(request, *args, **kwargs)
+    return csrf_exempt(wrapper)
+
+
+def request_data(request):
+    """Body of the request as a dict, from JSON or form encoding, None if it is malformed."""
+    if request.content_type != "application/json":
+        return request.POST
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def query_datetime(request, name):
+    """Aware datetime of the ISO 8601 ?name= parameter, None when absent, ValueError when malformed."""
+    if name not in request.GET:
+        return None
+    value = parse_datetime(request.GET[name])
+    if value is None:
+        raise ValueError(f"Invalid {name}")
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def quote_data(stock_data):
+    return {"symbol": stock_data["symbol"], "name": stock_data["name"], "price": stock_data["price"]}
+
+
+def purchase_data(purchase):
+    return {
+        "id": purchase.id,
+        "symbol": purchase.stock,
+        "shares": purchase.shares,
+        "price": purchase.price,
+        "realized_pnl": purchase.realized_pnl,
+        "at": purchase.bought_at,
+        # Stands for older trades compacted into the ledger archive
+        "checkpoint": purchase.checkpoint,
+    }
+
+
+@csrf_exempt
+@require_POST
+def obtain_token(request):
+    """Exchange a username and password for the user's API token."""
+    data = request_data(request)
+    if data is None:
+        return api_error("Malformed request body")
+
+    user = authenticate(request, username=data.get("username"), password=data.get("password"))
+    if user is None:
+        return api_error("Username OR password is incorrect", 401)
+
+    return api_response(request, {"token": ApiToken.for_user(user).key})
+
+
+@token_required
+@require_GET
+@rate_limited("quote", limited_response=api_rate_limited)
+def quote(request, symbol):
+    stock_data = lookup(symbol)
+    if not stock_data:
+        return api_error("Invalid Symbol !!", 404)
+    return api_response(request, quote_data(stock_data), etag=True)
+
+
+@token_required
+@require_GET
+def symbols(request):
+    """Directory entries matching ?q=, a symbol or company name prefix, for autocompletion."""
+    try:
+        limit = min(int(request.GET.get("limit", SYMBOL_SUGGESTIONS)), MAX_SYMBOL_SUGGESTIONS)
+    except ValueError:
+        return api_error("Invalid Input !!")
+    return api_response(request, {"symbols": symbol_directory.search(request.GET.get("q", ""), limit)}, etag=True)
+
+
+@token_required
+@require_GET
+@rate_limited("quote", limited_response=api_rate_limited)
+def quotes(request):
+    """Quotes of every symbol in ?symbols=AAPL,MSFT, null for unknown ones."""
+    symbols = list(dict.fromkeys(
+        symbol.strip().upper() for symbol in request.GET.get("symbols", "").split(",") if symbol.strip()
+    ))
+    if not symbols or len(symbols) > MAX_BATCH_SYMBOLS:
+        return api_error(f"Provide between 1 and {MAX_BATCH_SYMBOLS} symbols")
+
+    found = lookup_many(symbols)
+    return api_response(request, {
+        "quotes": {symbol: quote_data(found[symbol]) if found.get(symbol) else None for symbol in symbols}
+    }, etag=True)
+
+
+def trade(request, execute):
+    data = request_data(request)
+    if data is None:
+        return api_error("Malformed request body")
+
+    form = BuyForm(data)
+    if not form.is_valid():
+        return api_error("Invalid Input !!", fields=form.errors.get_json_data())
+
+    stock_data = lookup(form.cleaned_data["symbol"])
+    if not stock_data:
+        return api_error("Invalid Symbol !!", 404)
+
+    try:
+        purchase = execute(request.user, form.cleaned_data["symbol"], form.cleaned_data["shares"], stock_data["price"])
+    except TradeError as e:
+        return api_error(str(e), 409)
+
+    request.user.cash.refresh_from_db(fields=["in_hand_money"])
+    return api_response(request, {
+        "purchase": purchase_data(purchase),
+        "cash": request.user.cash.in_hand_money,
+    }, status=201)
+
+
+@token_required
+@require_POST
+@rate_limited("buy", limited_response=api_rate_limited)
+def buy(request):
+    return trade(request, trading.buy)
+
+
+@token_required
+@require_POST
+@rate_limited("sell", limited_response=api_rate_limited)
+def sell(request):
+    return trade(request, trading.sell)
+
+
+def order_results(results):
+    return [
+        {"index": result["index"], "status": result["status"], "error": result["error"],
+         "purchase": purchase_data(result["purchase"]) if result["purchase"] else None}
+        for result in results
+    ]
+
+
+@token_required
+@require_POST
+@rate_limited("orders", limited_response=api_rate_limited, degrade=False)
+def orders(request):
+    """Execute {"orders": [{"side", "symbol", "shares"}], "mode": "all_or_nothing" | "best_effort"} at once."""
+    data = request_data(request)
+    if data is None:
+        return api_error("Malformed request body")
+
+    raw_orders, mode = data.get("orders"), data.get("mode", "all_or_nothing")
+    if not isinstance(raw_orders, list) or not 1 <= len(raw_orders) <= MAX_BATCH_ORDERS:
+        return api_error(f"Provide between 1 and {MAX_BATCH_ORDERS} orders")
+    if mode not in ("all_or_nothing", "best_effort"):
+        return api_error("Mode must be all_or_nothing or best_effort")
+
+    try:
+        results = place_orders(request.user, raw_orders, all_or_nothing=mode == "all_or_nothing")
+    except BatchRejected as e:
+        return api_error(str(e), 409, results=order_results(e.results))
+
+    request.user.cash.refresh_from_db(fields=["in_hand_money"])
+    return api_response(request, {
+        "filled": sum(result["status"] == "filled" for result in results),
+        "rejected": sum(result["status"] == "rejected" for result in results),
+        "results": order_results(results),
+        "cash": request.user.cash.in_hand_money,
+    }, status=201)
+
+
+def limit_order_data(order):
+    return {
+        "id": order.id,
+        "side": order.side,
+        "symbol": order.stock,
+        "shares": order.shares,
+        "limit_price": order.limit_price,
+        "status": order.status,
+        "error": order.error or None,
+        "purchase": order.purchase_id,
+        "at": order.created_at,
+        "closed_at": order.closed_at,
+    }
+
+
+def alert_data(alert):
+    return {
+        "id": alert.id,
+        "symbol": alert.stock,
+        "direction": alert.direction,
+        "price": alert.price,
+        "triggered_at": alert.triggered_at,
+        "triggered_price": alert.triggered_price,
+        "at": alert.created_at,
+    }
+
+
+@token_required
+@require_http_methods(["GET", "POST"])
+def limit_orders(request):
+    """Orders of the user with ?status= (open by default) on GET, place {side, symbol, shares, limit_price} on POST."""
+    if request.method == "GET":
+        orders = request.user.limit_orders.filter(status=request.GET.get("status", LimitOrder.OPEN)).order_by("-id")
+        return api_response(request, {"results": [limit_order_data(order) for order in orders[:MAX_LEDGER_PAGE_SIZE]]})
+
+    data = request_data(request)
+    if data is None:
+        return api_error("Malformed request body")
+
+    form = LimitOrderForm(data)
+    if not form.is_valid():
+        return api_error("Invalid Input !!", fields=form.errors.get_json_data())
+    if not lookup(form.cleaned_data["symbol"]):
+        return api_error("Invalid Symbol !!", 404)
+
+    order = LimitOrder.objects.create(
+        my_user=request.user,
+        side=form.cleaned_data["side"],
+        stock=form.cleaned_data["symbol"].upper(),
+        shares=form.cleaned_data["shares"],
+        limit_price=price(form.cleaned_data["limit_price"]),
+    )
+    return api_response(request, limit_order_data(order), status=201)
+
+
+@token_required
+@require_http_methods(["DELETE"])
+def cancel_limit_order(request, order_id):
+    cancelled = request.user.limit_orders.filter(id=order_id, status=LimitOrder.OPEN).update(
+        status=LimitOrder.CANCELLED, closed_at=timezone.now(),
+    )
+    if not cancelled:
+        return api_error("No open order with this id", 404)
+    return api_response(request, limit_order_data(request.user.limit_orders.get(id=order_id)))
+
+
+@token_required
+@require_http_methods(["GET", "POST"])
+def alerts(request):
+    """Alerts of the user on GET, set {symbol, direction, price} on POST."""
+    if request.method == "GET":
+        price_alerts = request.user.price_alerts.order_by("-id")[:MAX_LEDGER_PAGE_SIZE]
+        return api_response(request, {"results": [alert_data(alert) for alert in price_alerts]})
+
+    data = request_data(request)
+    if data is None:
+        return api_error("Malformed request body")
+
+    form = PriceAlertForm(data)
+    if not form.is_valid():
+        return api_error("Invalid Input !!", fields=form.errors.get_json_data())
+    if not lookup(form.cleaned_data["symbol"]):
+        return api_error("Invalid Symbol !!", 404)
+
+    alert = PriceAlert.objects.create(
+        my_user=request.user,
+        stock=form.cleaned_data["symbol"].upper(),
+        direction=form.cleaned_data["direction"],
+        price=price(form.cleaned_data["price"]),
+    )
+    return api_response(request, alert_data(alert), status=201)
+
+
+@token_required
+@require_http_methods(["DELETE"])
+def delete_alert(request, alert_id):
+    deleted, _ = request.user.price_alerts.filter(id=alert_id).delete()
+    if not deleted:
+        return api_error("No alert with this id", 404)
+    return HttpResponse(status=204)
+
+
+@token_required
+@require_http_methods(["GET", "POST"])
+def balance(request):
+    """Cash in hand on GET, add {"amount": n} to it on POST."""
+    if request.method == "POST":
+        data = request_data(request)
+        if data is None:
+            return api_error("Malformed request body")
+
+        form = AddBalanceForm({"add_balance": data.get("amount")})
+        if not form.is_valid():
+            return api_error("Invalid amount entered !!", fields=form.errors.get_json_data())
+
+        try:
+            trading.deposit(request.user, form.cleaned_data["add_balance"])
+        except TradeError as e:
+            return api_error(str(e), 409)
+
+    request.user.cash.refresh_from_db(fields=["in_hand_money"])
+    return api_response(request, {"cash": request.user.cash.in_hand_money})
+
+
+@token_required
+@require_GET
+def portfolio(request):
+    cash, holdings = positions(request.user)
+    quotes = lookup_many([holding["stock"] for holding in holdings])
+    rows, total = valuate(cash, holdings, quotes)
+    pnl, unrealized = unrealized_pnl(
+        position_costs([request.user.id])[request.user.id],
+        {symbol: quote["price"] for symbol, quote in quotes.items() if quote},
+    )
+    return api_response(request, {
+        "cash": cash,
+        "total": total,
+        "realized_pnl": request.user.cash.realized_profit,
+        "unrealized_pnl": unrealized,
+        "holdings": [
+            {"symbol": row["stock"], "name": row["name"], "shares": row["total_shares"],
+             "price": row["price"], "value": row["value"], "unrealized_pnl": pnl.get(row["stock"])}
+            for row in rows
+        ],
+    }, etag=True)
+
+
+@token_required
+@require_GET
+def portfolio_history(request):
+    """Value and P&L of the portfolio over ?since=&until= (ISO 8601), downsampled to ?points=n."""
+    try:
+        points = min(int(request.GET.get("points", HISTORY_POINTS)), MAX_HISTORY_POINTS)
+        since, until = query_datetime(request, "since"), query_datetime(request, "until")
+    except ValueError:
+        return api_error("Invalid Input !!")
+    if points < 1:
+        return api_error("Invalid Input !!")
+
+    return api_response(request, {
+        "history": [
+            {"at": taken_at, "cash": cash, "holdings": holdings_value, "total": cash + holdings_value, "pnl": pnl}
+            for taken_at, cash, holdings_value, pnl in history(request.user, since, until, points)
+        ],
+    }, etag=True)
+
+
+@token_required
+@require_GET
+def ledger(request):
+    """Trades of the user, newest first, paginated with ?cursor=<next>&limit=n."""
+    try:
+        limit = min(int(request.GET.get("limit", LEDGER_PAGE_SIZE)), MAX_LEDGER_PAGE_SIZE)
+        cursor = int(request.GET["cursor"]) if "cursor" in request.GET else None
+    except ValueError:
+        return api_error("Invalid Input !!")
+    if limit < 1:
+        return api_error("Invalid Input !!")
+
+    # Keyset pagination on id, so every page costs the same however deep it is
+    purchases = request.user.purchases.order_by("-id")
+    if cursor is not None:
+        purchases = purchases.filter(id__lt=cursor)
+    page = list(purchases[:limit + 1])
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    return api_response(request, {
+        "results": [purchase_data(purchase) for purchase in page],
+        "next": page[-1].id if has_more else None,
+    })
+
+
+@token_required
+@require_GET
+def ledger_export(request):
+    """Every trade of the user, oldest first, streamed as ?format=csv|json from ?since= to ?until=, gzipped with ?gzip=1."""
+    try:
+        options = export_options(request.GET)
+    except ValueError:
+        return api_error("Invalid Input !!")
+    return export_response(request.user, **options)
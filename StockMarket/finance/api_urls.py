@@ -0,0 +1,22 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path('token/', api.obtain_token, name='api_token'),
+    path('quote/<str:symbol>/', api.quote, name='api_quote'),
+    path('quotes/', api.quotes, name='api_quotes'),
+    path('symbols/', api.symbols, name='api_symbols'),
+    path('buy/', api.buy, name='api_buy'),
+    path('sell/', api.sell, name='api_sell'),
+    path('orders/', api.orders, name='api_orders'),
+    path('limit-orders/', api.limit_orders, name='api_limit_orders'),
+    path('limit-orders/<int:order_id>/', api.cancel_limit_order, name='api_cancel_limit_order'),
+    path('alerts/', api.alerts, name='api_alerts'),
+    path('alerts/<int:alert_id>/', api.delete_alert, name='api_delete_alert'),
+    path('balance/', api.balance, name='api_balance'),
+    path('portfolio/', api.portfolio, name='api_portfolio'),
+    path('portfolio/history/', api.portfolio_history, name='api_portfolio_history'),
+    path('ledger/', api.ledger, name='api_ledger'),
+    path('ledger/export/', api.ledger_export, name='api_ledger_export'),
+]
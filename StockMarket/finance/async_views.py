@@ -0,0 +1,170 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseRedirect
+from django.shortcuts import render
+from django.urls import reverse
+
+from .forms import QuoteForm, BuyForm
+from .helpers import alookup, alookup_many, usd
+from .pages import cached_response, conditional, get_portfolio_pages
+from .portfolio import page_context, positions
+from .ratelimit import rate_limited
+from .symbols import is_known
+from . import trading
+from .trading import TradeError
+
+# Async versions of the quote bound views in views.py.
+# Quotes are awaited on the event loop so a worker can have many of them in flight,
+# while every ORM access and template render runs through sync_to_async.
+
+arender = sync_to_async(render)
+
+
+def async_login_required(view):
+    """login_required for coroutine views, resolving request.user off the event loop."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path(), 'login')
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+@rate_limited("quote", methods=("POST",))
+async def quote(request):
+    """Get stock information and its live rates"""
+    form = QuoteForm(request.POST or None)
+
+    if request.method == "POST" and form.is_valid():
+        stock_data = await alookup(form.cleaned_data["symbol"])
+
+        # Ensure it is valid symbol
+        if not stock_data:
+            return await arender(request, "finance/quote.html", {
+                "form": form,
+                "message": "Invalid Symbol !!"
+            })
+
+        return await arender(request, "finance/quoted.html", {
+            "name": stock_data["name"],
+            "symbol": stock_data["symbol"],
+            "price": usd(stock_data["price"]),
+        })
+
+    return await arender(request, "finance/quote.html", {
+        "form": form
+    })
+
+
+@async_login_required
+@rate_limited("buy", methods=("POST",))
+async def buy(request):
+    """Buy shares of stock"""
+    form = BuyForm(request.POST or None)
+
+    if request.method == "POST" and form.is_valid():
+        stock_symbol = form.cleaned_data["symbol"]
+        total_shares = form.cleaned_data["shares"]
+
+        stock_data = await alookup(stock_symbol)
+
+        # Ensure it is valid symbol
+        if not stock_data:
+            return await arender(request, "finance/buy.html", {
+                "form": form,
+                "message": "Invalid Symbol !!"
+            })
+
+        try:
+            await sync_to_async(trading.buy)(request.user, stock_symbol, total_shares, stock_data["price"])
+        except TradeError as e:
+            return await arender(request, "finance/buy.html", {
+                "form": form,
+                "message": str(e)
+            })
+
+        messages.success(request, str(total_shares) + " shares of " + stock_symbol + " was bought !!")
+        return HttpResponseRedirect(reverse("index"))
+
+    return await arender(request, "finance/buy.html", {
+        "form": form
+    })
+
+
+@sync_to_async
+def owned_shares(user, stock_symbol):
+    """Total number of shares of the stock the user holds, None if they never had it."""
+    return user.holdings.filter(stock=stock_symbol).values_list('shares', flat=True).first()
+
+
+@sync_to_async
+def owned_stocks(user):
+    return list(user.holdings.filter(shares__gt=0).values_list('stock', flat=True))
+
+
+@async_login_required
+@rate_limited("sell", methods=("POST",))
+async def sell(request):
+    """Sell shares of stock"""
+    if request.method != "POST":
+        return await arender(request, "finance/sell.html", {
+            "stocks": await owned_stocks(request.user)
+        })
+
+    stock_symbol = request.POST.get("symbol")
+    total_shares = request.POST.get("shares")
+
+    # Ensure quote symbol and a positive number of shares were submitted
+    if not stock_symbol:
+        message = "Must Provide Symbol !!"
+    elif not total_shares:
+        message = "Missing Shares !!"
+    elif not total_shares.isnumeric() or int(total_shares) < 1:
+        message = "Invalid Input !!"
+    elif not is_known(stock_symbol):
+        message = "Invalid Symbol !!"
+    else:
+        message = None
+    if message:
+        return await arender(request, "finance/sell.html", {"message": message})
+
+    total_shares = int(total_shares)
+    shares_held = await owned_shares(request.user, stock_symbol)
+
+    # Ensure user has the given stock and enough shares of it
+    if shares_held is None:
+        return await arender(request, "finance/sell.html", {"message": "You don't have this stock !!"})
+    if total_shares > shares_held:
+        return await arender(request, "finance/sell.html", {"message": "Too many shares !!"})
+
+    stock_data = await alookup(stock_symbol)
+    if not stock_data:
+        return await arender(request, "finance/sell.html", {"message": "Invalid Symbol !!"})
+
+    try:
+        await sync_to_async(trading.sell)(request.user, stock_symbol, total_shares, stock_data["price"])
+    except TradeError as e:
+        return await arender(request, "finance/sell.html", {"message": str(e)})
+
+    messages.success(request, str(total_shares) + " shares of " + stock_symbol + " was sold !!")
+    return HttpResponseRedirect(reverse("index"))
+
+
+@async_login_required
+async def index(request):
+    pages = get_portfolio_pages()
+    slot, page = await sync_to_async(pages.lookup)(request)
+    if page is not None:
+        return cached_response(request, page)
+
+    cash, holdings = await sync_to_async(positions)(request.user)
+    quotes = await alookup_many([holding["stock"] for holding in holdings])
+
+    response = await arender(request, "finance/index.html", page_context(cash, holdings, quotes))
+    etag = await sync_to_async(pages.store)(slot, response.content)
+    return conditional(request, response, etag)
@@ -0,0 +1,16 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class CashModelBackend(ModelBackend):
+    """ModelBackend fetching the Cash row of the user along with them, once per request."""
+
+    def get_user(self, user_id):
+        # request.user.cash then costs no query of its own
+        try:
+            user = UserModel._default_manager.select_related('cash').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,516 @@
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+import requests
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection
+from django.http import JsonResponse
+from django.test import AsyncClient, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import async_views, views
+from .api import purchase_data
+from .holdings import rebuild_holdings
+from .ledger import compact_ledger
+from .models import Cash, Purchase
+from .providers import SimulatorProvider
+from .testing import FAST_PASSWORD_HASHERS, STUB_TEMPLATES_SETTINGS, stub_quotes
+from .triggers import TriggerBook
+
+# Benchmarks hammer the views far beyond any per user rate limit
+UNLIMITED = {"ENABLED": False}
+
+# Settings of the performance profile compared with the current ones by measure_queries()
+PERFORMANCE_PROFILE = "StockMarket.settings_performance"
+PROFILE_SETTINGS = ("SESSION_ENGINE", "SESSION_CACHE_ALIAS", "CACHES", "AUTHENTICATION_BACKENDS")
+
+
+@contextmanager
+def throwaway_database():
+    """Run the block against a new test database, destroyed afterwards, so the real one is never touched."""
+    # A file rather than an in-memory SQLite database, so that server threads share it without table locks
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+        test_settings["NAME"] = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3")
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def compare_sync_async(requests=200, workers=4, concurrency=100, latency=0.2):
+    """Requests/sec of the sync and async quote view against a slow upstream.
+
+    The sync view is served by a pool of workers threads, as a WSGI server
+    would, while the async view gets concurrency requests in flight on one
+    event loop.
+    """
+    symbols = [f"S{i}" for i in range(requests)]
+    factory = RequestFactory()
+    user = User(username="benchmark")
+
+    def make_request(symbol):
+        request = factory.post("/quote/", {"symbol": symbol})
+        request.user = user
+        return request
+
+    results = {}
+    with override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS, FINANCE_RATE_LIMITS=UNLIMITED), stub_quotes(symbols, latency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            responses = list(pool.map(lambda symbol: views.quote(make_request(symbol)), symbols))
+        results["sync"] = _summary(responses, time.perf_counter() - started, workers=workers)
+
+        async def drive():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(symbol):
+                async with semaphore:
+                    return await async_views.quote(make_request(symbol))
+
+            return await asyncio.gather(*(one(symbol) for symbol in symbols))
+
+        started = time.perf_counter()
+        responses = asyncio.run(drive())
+        results["async"] = _summary(responses, time.perf_counter() - started, concurrency=concurrency)
+
+    return results
+
+
+def _summary(responses, elapsed, **extra):
+    return {
+        "requests": len(responses),
+        "errors": sum(response.status_code != 200 for response in responses),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(responses) / elapsed, 1),
+        **extra,
+    }
+
+
+# Load and latency benchmarks of the finance views
+
+ENDPOINTS = ("index", "quote", "buy", "sell", "add_balance")
+
+
+def seed(users=100, rows=100, symbols=20, password="benchmark"):
+    """Create users bench0..benchN-1 with rows ledger rows each, spread over symbols S0..S<symbols-1>."""
+    hashed = make_password(password)
+    User.objects.bulk_create([User(username=f"bench{i}", password=hashed) for i in range(users)])
+    created = list(User.objects.filter(username__startswith="bench").order_by("id").values_list("id", flat=True))
+
+    # bulk_create skips the post_save signal creating the Cash row, and trading must never run out of money
+    Cash.objects.bulk_create([Cash(my_user_id=user_id, in_hand_money=Decimal(10 ** 9)) for user_id in created])
+
+    purchases = (
+        Purchase(my_user_id=user_id, stock=f"S{(n + row) % symbols}", shares=10, price=Decimal(100))
+        for n, user_id in enumerate(created) for row in range(rows)
+    )
+    batch = []
+    for purchase in purchases:
+        batch.append(purchase)
+        if len(batch) == 5000:
+            Purchase.objects.bulk_create(batch)
+            batch = []
+    Purchase.objects.bulk_create(batch)
+    rebuild_holdings(created)
+    return created
+
+
+class Workload:
+    """Requests of each endpoint, cycling over the seeded users and symbols."""
+
+    def __init__(self, user_ids, symbols):
+        self.user_ids = user_ids
+        self.symbols = [f"S{i}" for i in range(symbols)]
+
+    def request(self, endpoint, n):
+        """Return (user_id, method, path, data) of the n-th request to endpoint."""
+        user_id = self.user_ids[n % len(self.user_ids)]
+        symbol = self.symbols[n % len(self.symbols)]
+        if endpoint == "index":
+            return user_id, "get", reverse("index"), None
+        if endpoint == "add_balance":
+            return user_id, "post", reverse("add_balance"), {"add_balance": 10}
+        return user_id, "post", reverse(endpoint), {"symbol": symbol, "shares": 1}
+
+
+class ClientDriver:
+    """Serves requests through the Django test client, i.e. in process through the WSGI handler."""
+
+    name = "client"
+    is_async = False
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self._local = threading.local()
+
+    def client(self, user_id):
+        clients = self._local.__dict__.setdefault("clients", {})
+        if user_id not in clients:
+            clients[user_id] = Client()
+            clients[user_id].cookies[settings.SESSION_COOKIE_NAME] = self.sessions[user_id]
+        return clients[user_id]
+
+    def send(self, user_id, method, path, data):
+        return getattr(self.client(user_id), method)(path, data).status_code
+
+    def close(self):
+        pass
+
+
+class AsyncClientDriver(ClientDriver):
+    """Serves requests through Django's ASGI handler on one event loop."""
+
+    name = "asgi"
+    is_async = True
+
+    def client(self, user_id):
+        clients = self._local.__dict__.setdefault("clients", {})
+        if user_id not in clients:
+            clients[user_id] = AsyncClient()
+            clients[user_id].cookies[settings.SESSION_COOKIE_NAME] = self.sessions[user_id]
+        return clients[user_id]
+
+    async def send(self, user_id, method, path, data):
+        response = await getattr(self.client(user_id), method)(path, data)
+        return response.status_code
+
+
+class BenchmarkWSGIHandler(WSGIHandler):
+    """WSGI handler skipping CSRF checks, as the test client does."""
+
+    def get_response(self, request):
+        request._dont_enforce_csrf_checks = True
+        return super().get_response(request)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class WSGIServerDriver:
+    """Serves requests over HTTP from a threaded WSGI server, as runserver does."""
+
+    name = "wsgi"
+    is_async = False
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self._local = threading.local()
+        self.server = ThreadedWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+        self.server.set_app(BenchmarkWSGIHandler())
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def send(self, user_id, method, path, data):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        response = self._local.session.request(
+            method, self.base_url + path, data=data, allow_redirects=False,
+            cookies={settings.SESSION_COOKIE_NAME: self.sessions[user_id]},
+        )
+        return response.status_code
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DRIVERS = {driver.name: driver for driver in (ClientDriver, AsyncClientDriver, WSGIServerDriver)}
+
+
+def login_sessions(user_ids):
+    """Session cookie of every user, logged in once up front so that logging in is not measured."""
+    client = Client()
+    sessions = {}
+    for user in User.objects.filter(id__in=user_ids):
+        client.force_login(user)
+        sessions[user.id] = client.cookies[settings.SESSION_COOKIE_NAME].value
+        client.cookies.clear()
+    return sessions
+
+
+def percentile(ordered, fraction):
+    """Nearest rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def run_benchmark(users=100, rows=100, symbols=20, requests=200, concurrency=4, latency=0.0,
+                  driver="client", endpoints=ENDPOINTS, probes=20):
+    """Seed the database then measure every endpoint, returning the results as a JSON-able dict.
+
+    Latency and throughput come from requests run concurrency at a time. Queries
+    per request and peak memory are measured in a separate sequential pass of
+    probes requests through the test client, so that tracing costs nothing to
+    the timed run.
+    """
+    with override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS):
+        user_ids = seed(users, rows, symbols)
+    workload = Workload(user_ids, symbols)
+    sessions = login_sessions(user_ids)
+    results = {
+        "settings": {
+            "users": users, "rows": rows, "symbols": symbols, "requests": requests,
+            "concurrency": concurrency, "latency": latency, "driver": driver,
+            "async_views": settings.FINANCE_ASYNC_VIEWS,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+        },
+        "endpoints": {},
+    }
+
+    hosts = [*settings.ALLOWED_HOSTS, "testserver", "127.0.0.1"]
+    with override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS, ALLOWED_HOSTS=hosts, FINANCE_RATE_LIMITS=UNLIMITED), \
+            stub_quotes(workload.symbols, latency):
+        for endpoint in endpoints:
+            measured = _probe(ClientDriver(sessions), workload, endpoint, probes)
+            selected = DRIVERS[driver](sessions)
+            try:
+                measured.update(_timed_run(selected, workload, endpoint, requests, concurrency))
+            finally:
+                selected.close()
+            results["endpoints"][endpoint] = measured
+
+    return results
+
+
+def measure_queries(users=10, rows=20, symbols=20, probes=20, endpoints=ENDPOINTS, profile=PERFORMANCE_PROFILE):
+    """Mean queries per request of each endpoint with the current settings and with those of profile.
+
+    Returns {endpoint: {"current": queries, "profile": queries}}, the session
+    lookup and the fetch of the user included.
+    """
+    with override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS):
+        user_ids = seed(users, rows, symbols)
+    workload = Workload(user_ids, symbols)
+    module = importlib.import_module(profile)
+    profiles = {"current": {}, "profile": {name: getattr(module, name) for name in PROFILE_SETTINGS}}
+
+    hosts = [*settings.ALLOWED_HOSTS, "testserver", "127.0.0.1"]
+    results = {endpoint: {} for endpoint in endpoints}
+    for name, overrides in profiles.items():
+        with override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS, ALLOWED_HOSTS=hosts,
+                               FINANCE_RATE_LIMITS=UNLIMITED, **overrides), stub_quotes(workload.symbols):
+            # Neither profile may start with the other one's sessions or pages cached
+            for backend in caches.all():
+                backend.clear()
+            sessions = login_sessions(user_ids)
+            for endpoint in endpoints:
+                results[endpoint][name] = _probe(ClientDriver(sessions), workload, endpoint, probes)["queries"]
+    return results
+
+
+def _probe(driver, workload, endpoint, probes):
+    queries = []
+    tracemalloc.start()
+    try:
+        for n in range(probes):
+            with CaptureQueriesContext(connection) as captured:
+                driver.send(*workload.request(endpoint, n))
+            queries.append(len(captured))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "queries": round(sum(queries) / len(queries), 2) if queries else None,
+        "max_queries": max(queries, default=None),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def _timed_run(driver, workload, endpoint, count, concurrency):
+    def timed(n):
+        started = time.perf_counter()
+        try:
+            ok = driver.send(*workload.request(endpoint, n)) < 400
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    async def atimed(n, semaphore):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await driver.send(*workload.request(endpoint, n)) < 400
+            except Exception:
+                ok = False
+            return time.perf_counter() - started, ok
+
+    async def adrive():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(atimed(n, semaphore) for n in range(count)))
+
+    started = time.perf_counter()
+    if driver.is_async:
+        samples = asyncio.run(adrive())
+    elif concurrency == 1:
+        # Stay on this thread and its database connection
+        samples = [timed(n) for n in range(count)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(timed, range(count)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    return {
+        "requests": count,
+        "errors": sum(not sample[1] for sample in samples),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "requests_per_second": round(count / elapsed, 1),
+    }
+
+
+def compare_results(baseline, current):
+    """Relative change of every metric of every endpoint between two runs, e.g. {"index": {"p95_ms": 0.12}}."""
+    changes = {}
+    for endpoint, metrics in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint, {})
+        changes[endpoint] = {
+            name: round((value - before[name]) / before[name], 3)
+            for name, value in metrics.items()
+            if isinstance(value, (int, float)) and before.get(name)
+        }
+    return changes
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def benchmark_triggers(orders=100000, symbols=1000, ticks=1000, seed=0):
+    """Seconds per tick of evaluating orders open triggers against a simulated feed, without filling anything.
+
+    Like limit orders, triggers fire within 10% below or above each symbol's
+    starting price, so ticks cross some of them as prices wander.
+    """
+    feed = SimulatorProvider(symbols=symbols, seed=seed, tick=0)
+    rng = random.Random(seed)
+    book = TriggerBook()
+    triggers = []
+    for n in range(orders):
+        rising = rng.random() < 0.5
+        move = rng.uniform(0, 0.1)
+        trigger_price = Decimal(str(round(100 * (1 + move if rising else 1 - move), 2)))
+        triggers.append((feed.symbols[n % symbols], trigger_price, rising, "order", n))
+    book.extend(triggers)
+
+    elapsed, fired = [], 0
+    for _ in range(ticks):
+        feed.advance()
+        symbol = feed.symbols[rng.randrange(symbols)]
+        tick_price = feed.quote(symbol)["price"]
+        started = time.perf_counter()
+        fired += len(book.crossed(symbol, tick_price))
+        elapsed.append(time.perf_counter() - started)
+
+    elapsed.sort()
+    return {
+        "orders": orders,
+        "symbols": symbols,
+        "ticks": ticks,
+        "fired": fired,
+        "mean_us": round(sum(elapsed) / ticks * 1e6, 1),
+        "p99_us": round(percentile(elapsed, 0.99) * 1e6, 1),
+        "max_us": round(elapsed[-1] * 1e6, 1),
+    }
+
+
+def _peak_memory(consume):
+    """(peak bytes traced, seconds) while calling consume()."""
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        consume()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak, elapsed
+
+
+def benchmark_export(sizes=(1000, 10000, 100000), fmt="csv", gzip=False, naive=True, archived=0.5):
+    """Peak memory and time of exporting ledgers of each size through the export view.
+
+    The oldest archived fraction of each ledger is compacted into the ledger
+    archive first, so that the export reads both. With naive, also those of
+    building the live ledger as one JSON response, the way it would be without
+    streaming, which grow with the ledger when the streamed ones stay flat.
+    """
+    factory = RequestFactory()
+    results = {"settings": {"format": fmt, "gzip": gzip, "archived": archived}, "sizes": {}}
+    old = timezone.now() - timedelta(days=365)
+    for size in sizes:
+        user = User.objects.create_user(f"export{size}")
+        batch = []
+        for n in range(size):
+            # Every symbol is bought then sold in turn, so compacted positions close and fold away entirely
+            shares = 10 if n // 20 % 2 == 0 else -10
+            batch.append(Purchase(my_user=user, stock=f"S{n % 20}", shares=shares, price=Decimal(100)))
+            if len(batch) == 5000:
+                Purchase.objects.bulk_create(batch)
+                batch = []
+        Purchase.objects.bulk_create(batch)
+
+        ids = list(user.purchases.order_by("id").values_list("id", flat=True)[:int(size * archived) // 40 * 40])
+        if ids:
+            user.purchases.filter(id__lte=ids[-1]).update(bought_at=old)
+            compact_ledger(old + timedelta(days=1), user_ids=[user.id])
+
+        request = factory.get(reverse("export"), {"format": fmt, "gzip": "1" if gzip else ""})
+        request.user = user
+        written = []
+
+        def stream():
+            written.append(sum(len(block) for block in views.export(request).streaming_content))
+
+        peak, elapsed = _peak_memory(stream)
+        measured = {
+            "archived_rows": sum(user.ledger_archives.values_list("rows", flat=True)),
+            "bytes": written[0],
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(size / elapsed) if elapsed else None,
+            "peak_memory_kb": round(peak / 1024, 1),
+        }
+        if naive:
+            def whole():
+                JsonResponse({"results": [purchase_data(purchase) for purchase in user.purchases.all()]})
+
+            peak, elapsed = _peak_memory(whole)
+            measured["naive_seconds"] = round(elapsed, 3)
+            measured["naive_peak_memory_kb"] = round(peak / 1024, 1)
+        results["sizes"][size] = measured
+    return results
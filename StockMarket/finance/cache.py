@@ -0,0 +1,331 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .instrumentation import record_cache_lookup
+
+DEFAULTS = {
+    # Seconds a quote is served without contacting the upstream
+    "TTL": 5,
+    # Seconds past TTL a quote may still be served while it is refreshed in the background
+    "STALE_TTL": 30,
+    # Maximum number of symbols kept in the in-process LRU
+    "MAX_ENTRIES": 2048,
+    # Optional alias from settings.CACHES shared between worker processes
+    "BACKEND": None,
+    "KEY_PREFIX": "quote:",
+}
+
+FRESH, STALE, MISSING = "fresh", "stale", "missing"
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+class _Flight:
+    """A single upstream fetch that concurrent callers, threads or coroutines, wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    def finish(self, result):
+        with self._lock:
+            self.result = result
+            self.done.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+    def wait(self):
+        self.done.wait()
+        return self.result
+
+    async def wait_async(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.done.is_set():
+                return self.result
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        return await future
+
+
+class QuoteCache:
+    """Two tier quote cache with stale-while-revalidate and single-flight fetches.
+
+    Lookups first hit an in-process LRU, then the optional shared Django cache
+    backend and only then the upstream. Concurrent misses for the same symbol
+    are coalesced so that exactly one upstream fetch is made for them.
+    """
+
+    def __init__(self, ttl=5, stale_ttl=30, max_entries=2048, backend=None, key_prefix="quote:"):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.backend = caches[backend] if backend else None
+        self.key_prefix = key_prefix
+
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("hits", "stale_hits", "misses", "coalesced", "fetches", "errors"), 0)
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, "QUOTE_CACHE", {})}
+        return cls(
+            ttl=options["TTL"],
+            stale_ttl=options["STALE_TTL"],
+            max_entries=options["MAX_ENTRIES"],
+            backend=options["BACKEND"],
+            key_prefix=options["KEY_PREFIX"],
+        )
+
+    def get(self, symbol, fetch):
+        """Return the quote for symbol, calling fetch(symbol) only when needed."""
+        key = symbol.upper()
+        state, quote = self._classify(key)
+
+        # Stale but usable quote, serve it and refresh it in the background
+        if state == STALE:
+            leading, _ = self._claim([key])
+            if leading:
+                thread = threading.Thread(target=self._run, args=(leading, self._single(symbol, fetch)), daemon=True)
+                thread.start()
+        if state != MISSING:
+            return quote
+
+        leading, waiting = self._claim([key])
+        if leading:
+            self._run(leading, self._single(symbol, fetch))
+            return leading[key].result
+        return waiting[key].wait()
+
+    def get_many(self, symbols, fetch_many):
+        """Return {SYMBOL: quote} for symbols, fetching all misses with one fetch_many(keys) call."""
+        results, missing, stale = self._classify_many(symbols)
+
+        # Join fetches other callers already have in flight and lead the rest
+        leading, waiting = self._claim(missing)
+        if leading:
+            self._run(leading, fetch_many)
+        for key, flight in {**leading, **waiting}.items():
+            results[key] = flight.wait()
+
+        # Refresh every stale quote with a single background batch
+        leading, _ = self._claim(stale)
+        if leading:
+            thread = threading.Thread(target=self._run, args=(leading, fetch_many), daemon=True)
+            thread.start()
+
+        return results
+
+    async def aget(self, symbol, afetch):
+        """Async get(), with afetch(symbol) a coroutine function."""
+        results = await self.aget_many([symbol], self._asingle(symbol, afetch))
+        return results[symbol.upper()]
+
+    async def aget_many(self, symbols, afetch_many):
+        """Async get_many(), with afetch_many(keys) a coroutine function."""
+        results, missing, stale = self._classify_many(symbols)
+
+        leading, waiting = self._claim(missing)
+        if leading:
+            await self._arun(leading, afetch_many)
+        for key, flight in {**leading, **waiting}.items():
+            results[key] = await flight.wait_async()
+
+        leading, _ = self._claim(stale)
+        if leading:
+            asyncio.ensure_future(self._arun(leading, afetch_many))
+
+        return results
+
+    def peek(self, symbol):
+        """Return the cached quote and its age in seconds without any upstream I/O."""
+        entry = self._read(symbol.upper())
+        if entry is None:
+            return None, None
+        return entry[0], time.time() - entry[1]
+
+    def set(self, symbol, quote, fetched_at=None):
+        """Store a quote fetched elsewhere, e.g. by a batch request."""
+        entry = (quote, fetched_at if fetched_at is not None else time.time())
+        self._store(symbol.upper(), entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def stats(self):
+        """Snapshot of the hit/miss/coalesced counters and the LRU size."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _classify(self, key):
+        """Return (FRESH|STALE|MISSING, cached quote) for key and count the lookup."""
+        entry = self._read(key)
+        age = time.time() - entry[1] if entry is not None else None
+
+        if age is not None and age < self.ttl:
+            self._count("hits")
+            record_cache_lookup(True)
+            return FRESH, entry[0]
+        if age is not None and age < self.ttl + self.stale_ttl:
+            self._count("stale_hits")
+            record_cache_lookup(True)
+            return STALE, entry[0]
+        self._count("misses")
+        record_cache_lookup(False)
+        return MISSING, None
+
+    def _classify_many(self, symbols):
+        """Return ({key: quote} servable now, missing keys, stale keys)."""
+        results, missing, stale = {}, [], []
+        seen = set()
+        for symbol in symbols:
+            key = symbol.upper()
+            if key in seen:
+                continue
+            seen.add(key)
+
+            state, quote = self._classify(key)
+            if state == MISSING:
+                missing.append(key)
+                continue
+            results[key] = quote
+            if state == STALE:
+                stale.append(key)
+        return results, missing, stale
+
+    def _read(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        # Local quotes are served while fresh, past that the shared tier may have
+        # a newer one, e.g. written by the refresh_quotes worker
+        if self.backend is None or (entry is not None and time.time() - entry[1] < self.ttl):
+            return entry
+
+        shared = self.backend.get(self.key_prefix + key)
+        if shared is not None and (entry is None or shared[1] > entry[1]):
+            self._remember(key, shared)
+            return shared
+        return entry
+
+    def _store(self, key, entry):
+        self._remember(key, entry)
+        if self.backend is not None:
+            self.backend.set(self.key_prefix + key, entry, timeout=self.ttl + self.stale_ttl)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _claim(self, keys):
+        """Split keys into ({key: flight} we must fetch, {key: flight} others are fetching)."""
+        leading, waiting = {}, {}
+        with self._lock:
+            for key in keys:
+                flight = self._inflight.get(key)
+                if flight is not None:
+                    self._counters["coalesced"] += 1
+                    waiting[key] = flight
+                else:
+                    leading[key] = self._inflight[key] = _Flight()
+        return leading, waiting
+
+    def _run(self, flights, fetch_many):
+        quotes = {}
+        try:
+            self._count("fetches")
+            quotes = fetch_many(list(flights))
+        finally:
+            self._finish(flights, quotes)
+
+    async def _arun(self, flights, afetch_many):
+        quotes = {}
+        try:
+            self._count("fetches")
+            quotes = await afetch_many(list(flights))
+        finally:
+            self._finish(flights, quotes)
+
+    def _finish(self, flights, quotes):
+        """Store what was fetched and wake up everybody waiting on flights."""
+        fetched_at = time.time()
+        for key in flights:
+            quote = quotes.get(key)
+            if quote is None:
+                self._count("errors")
+            else:
+                self._store(key, (quote, fetched_at))
+
+        with self._lock:
+            for key in flights:
+                del self._inflight[key]
+        for key, flight in flights.items():
+            flight.finish(quotes.get(key))
+
+    @staticmethod
+    def _single(symbol, fetch):
+        return lambda keys: {keys[0]: fetch(symbol)}
+
+    @staticmethod
+    def _asingle(symbol, afetch):
+        async def afetch_many(keys):
+            return {key: await afetch(symbol) for key in keys}
+        return afetch_many
+
+
+_quote_cache = None
+_quote_cache_lock = threading.Lock()
+
+
+def get_quote_cache():
+    """Return the process wide quote cache configured by settings.QUOTE_CACHE."""
+    global _quote_cache
+    if _quote_cache is None:
+        with _quote_cache_lock:
+            if _quote_cache is None:
+                _quote_cache = QuoteCache.from_settings()
+    return _quote_cache
+
+
+def set_quote_cache(cache):
+    """Swap the process wide quote cache, e.g. for an uncached one in benchmarks."""
+    global _quote_cache
+    _quote_cache = cache
+
+
+@receiver(setting_changed)
+def reset_quote_cache(setting, **kwargs):
+    global _quote_cache
+    if setting in ("QUOTE_CACHE", "CACHES"):
+        _quote_cache = None
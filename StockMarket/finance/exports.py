@@ -0,0 +1,126 @@
+import csv
+import json
+import zlib
+from datetime import datetime, time
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .ledger import full_ledger
+
+# Streaming exports of the trade history of a user.
+# Rows are read from the archive and the live ledger a chunk at a time, then
+# encoded and optionally gzipped as they go, so an export holds a few chunks
+# in memory whether the ledger has a hundred rows or millions.
+
+HEADER = ("id", "symbol", "shares", "price", "at", "realized_pnl")
+
+FORMATS = {"csv": "text/csv", "json": "application/json"}
+
+# Ledger rows fetched per query
+CHUNK_SIZE = 2000
+
+# Bytes gathered before handing them to the server, rather than a write per row
+BUFFER_SIZE = 64 * 1024
+
+
+class _Echo:
+    """File-like object returning what is written to it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def trade_rows(user_id, since=None, until=None, chunk_size=CHUNK_SIZE):
+    """Yield the (id, stock, shares, price, bought_at, realized_pnl) trades of the user from since to until, in id order."""
+    return full_ledger(user_id, since=since, until=until, chunk_size=chunk_size)
+
+
+def csv_chunks(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for purchase_id, stock, shares, unit_price, bought_at, realized_pnl in rows:
+        yield writer.writerow((purchase_id, stock, shares, unit_price, bought_at.isoformat() if bought_at else "",
+                               "" if realized_pnl is None else realized_pnl))
+
+
+def json_chunks(rows):
+    yield '{"results":['
+    separator = ""
+    for purchase_id, stock, shares, unit_price, bought_at, realized_pnl in rows:
+        yield separator + json.dumps({
+            "id": purchase_id,
+            "symbol": stock,
+            "shares": shares,
+            "price": None if unit_price is None else str(unit_price),
+            "at": bought_at.isoformat() if bought_at else None,
+            "realized_pnl": None if realized_pnl is None else str(realized_pnl),
+        }, separators=(",", ":"))
+        separator = ","
+    yield "]}"
+
+
+def buffered(chunks, size=BUFFER_SIZE):
+    """Join str chunks into UTF-8 encoded blocks of about size bytes."""
+    pending, length = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(pending).encode()
+            pending, length = [], 0
+    if pending:
+        yield "".join(pending).encode()
+
+
+def gzipped(blocks, level=6):
+    """Gzip a stream of bytes blocks as it goes."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(user_id, fmt="csv", since=None, until=None, gzip=False, chunk_size=CHUNK_SIZE):
+    """Bytes blocks of the trades of the user from since to until, in fmt, gzipped or not."""
+    encode = csv_chunks if fmt == "csv" else json_chunks
+    blocks = buffered(encode(trade_rows(user_id, since, until, chunk_size)))
+    return gzipped(blocks) if gzip else blocks
+
+
+def parse_moment(value, name):
+    """Aware datetime of an ISO 8601 date or time, dates being their midnight, ValueError when malformed."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid {name}")
+        moment = datetime.combine(day, time())
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def export_options(query):
+    """Keyword arguments of export_response() from ?format=csv|json&since=&until=&gzip=1, ValueError when invalid."""
+    fmt = query.get("format", "csv")
+    if fmt not in FORMATS:
+        raise ValueError("Invalid format")
+    return {
+        "fmt": fmt,
+        "since": parse_moment(query["since"], "since") if query.get("since") else None,
+        "until": parse_moment(query["until"], "until") if query.get("until") else None,
+        "gzip": query.get("gzip", "") in ("1", "true", "yes"),
+    }
+
+
+def export_response(user, fmt="csv", since=None, until=None, gzip=False):
+    """Streamed download of the trades of user made from since, inclusive, to until, exclusive."""
+    filename = f"{user.get_username()}-trades.{fmt}" + (".gz" if gzip else "")
+    response = StreamingHttpResponse(
+        export_chunks(user.pk, fmt, since, until, gzip),
+        content_type="application/gzip" if gzip else FORMATS[fmt],
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
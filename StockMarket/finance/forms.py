@@ -1,8 +1,19 @@
-from StockMarket.finance.views import add_balance
+from decimal import Decimal
+
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django import forms
 
+from .money import MAX_MONEY
+from .symbols import is_known
+
+
+def validate_symbol(value):
+    # Orders and alerts on symbols that aren't listed would never fire
+    if not is_known(value):
+        raise ValidationError("Invalid Symbol !!")
+
 class CreateUserForm(UserCreationForm):
     class Meta:
         model = User
@@ -20,6 +31,17 @@ class BuyForm(forms.Form):
     required_css_class = 'bold'
 
 class AddBalanceForm(forms.Form):
-    add_balance = forms.IntegerField(label="Add Balance", min_value=1)
+    add_balance = forms.IntegerField(label="Add Balance", min_value=1, max_value=int(MAX_MONEY))
     error_css_class = 'error'
-    required_css_class = 'bold'
\ No newline at end of file
+    required_css_class = 'bold'
+
+class LimitOrderForm(forms.Form):
+    side = forms.ChoiceField(choices=[("buy", "Buy"), ("sell", "Sell")])
+    symbol = forms.CharField(label="Symbol", max_length=5, validators=[validate_symbol])
+    shares = forms.IntegerField(label="Shares", min_value=1)
+    limit_price = forms.DecimalField(label="Limit Price", max_digits=14, decimal_places=4, min_value=Decimal("0.0001"))
+
+class PriceAlertForm(forms.Form):
+    symbol = forms.CharField(label="Symbol", max_length=5, validators=[validate_symbol])
+    direction = forms.ChoiceField(choices=[("above", "Above"), ("below", "Below")])
+    price = forms.DecimalField(label="Price", max_digits=14, decimal_places=4, min_value=Decimal("0.0001"))
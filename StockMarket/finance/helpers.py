@@ -1,31 +1,122 @@
-import requests
-import urllib.parse
-
-import json
+from .cache import get_quote_cache
+from .instrumentation import timed_upstream
+from .money import money
+from .providers import QuoteProviderError, get_provider
+from .ratelimit import degraded, get_rate_limiter
+from .symbols import is_known, split_known
 
 def lookup(symbol):
     """Look up quote for the stock symbol."""
 
-    # Contact API
+    # Symbols missing from the symbol directory are rejected without any I/O
+    if not is_known(symbol):
+        return None
+
+    # Rate limited requests only get what is cached
+    state = degraded()
+    if state is not None:
+        return cached_quote(symbol, state)
+
+    # Serve from the quote cache, only contacting the API on a miss
+    quote = get_quote_cache().get(symbol, fetch_quote)
+    return quote if quote is not None else cached_quote(symbol)
+
+def lookup_many(symbols):
+    """Look up quotes for several stock symbols, keyed by upper cased symbol."""
+    known, unknown = split_known(symbols)
+
+    state = degraded()
+    if state is not None:
+        quotes = {symbol.upper(): cached_quote(symbol, state) for symbol in known}
+    else:
+        # Cached quotes are served directly, all misses go out in batch requests
+        quotes = with_cached_fallback(get_quote_cache().get_many(known, fetch_quotes))
+    quotes.update(dict.fromkeys(unknown))
+    return quotes
+
+async def alookup(symbol):
+    """Async lookup() for async views."""
+    if not is_known(symbol):
+        return None
+
+    state = degraded()
+    if state is not None:
+        return cached_quote(symbol, state)
+
+    quote = await get_quote_cache().aget(symbol, afetch_quote)
+    return quote if quote is not None else cached_quote(symbol)
+
+async def alookup_many(symbols):
+    """Async lookup_many() for async views."""
+    known, unknown = split_known(symbols)
+
+    state = degraded()
+    if state is not None:
+        quotes = {symbol.upper(): cached_quote(symbol, state) for symbol in known}
+    else:
+        quotes = with_cached_fallback(await get_quote_cache().aget_many(known, afetch_quotes))
+    quotes.update(dict.fromkeys(unknown))
+    return quotes
+
+def cached_quote(symbol, state=None):
+    """Last quote cached for symbol, however stale, as long as it isn't older than DEGRADED_MAX_AGE.
+
+    Used when the provider can't or mustn't be asked, a miss is recorded in state.
+    """
+    quote, age = get_quote_cache().peek(symbol)
+    if quote is None or age > get_rate_limiter().degraded_max_age:
+        if state is not None:
+            state.missed = True
+        return None
+    return quote
+
+def with_cached_fallback(quotes):
+    # Symbols the provider didn't quote, e.g. as it is failing or out of quota, keep their last price
+    for symbol, quote in quotes.items():
+        if quote is None:
+            quotes[symbol] = cached_quote(symbol)
+    return quotes
+
+def fetch_quote(symbol):
+    """Fetch a fresh quote for the stock symbol from the quote provider."""
+
+    # Every call spends the upstream quota shared by all users
+    if not get_rate_limiter().take_upstream():
+        return None
     try:
-        api_key = 'pk_b6325ccbf1ff4cad8d7ba10082b31cd1';
-        response = requests.get(f"https://cloud-sse.iexapis.com/stable/stock/{urllib.parse.quote_plus(symbol)}/quote?token={api_key}")
-        response.raise_for_status()
-    except requests.RequestException:
+        with timed_upstream():
+            return get_provider().quote(symbol)
+    except QuoteProviderError:
         return None
 
-    # Parsing API response  
-    # and Getting stock information such as Stock's Name, Price & Symbol
+def fetch_quotes(symbols):
+    """Fetch fresh quotes for many stock symbols with as few provider calls as possible."""
+    if not get_rate_limiter().take_upstream(len(symbols)):
+        return {}
+    try:
+        with timed_upstream():
+            return get_provider().quotes(symbols)
+    except QuoteProviderError:
+        return {}
+
+async def afetch_quote(symbol):
+    if not get_rate_limiter().take_upstream():
+        return None
     try:
-        quote = response.json()
-        return {
-            "name": quote["companyName"],
-            "price": float(quote["latestPrice"]),
-            "symbol": quote["symbol"].upper()
-        }
-    except (KeyError, TypeError, ValueError):
+        with timed_upstream():
+            return await get_provider().aquote(symbol)
+    except QuoteProviderError:
         return None
 
+async def afetch_quotes(symbols):
+    if not get_rate_limiter().take_upstream(len(symbols)):
+        return {}
+    try:
+        with timed_upstream():
+            return await get_provider().aquotes(symbols)
+    except QuoteProviderError:
+        return {}
+
 def usd(value):
     """Format value as USD."""
-    return f"${value:,.2f}"
\ No newline at end of file
+    return f"${money(value):,.2f}"
@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import Holding, Purchase
+
+# Rebuilding and checking the Holding table against the Purchase ledger
+
+
+def replay(purchases):
+    """Fold (user_id, stock, shares, price, basis) ledger rows, ordered by user, stock and id,
+    into {(user_id, stock): [shares, cost_basis]}."""
+    positions = {}
+    for user_id, stock, shares, price, basis in purchases:
+        position = positions.setdefault((user_id, stock), [0, Decimal(0)])
+        if shares >= 0:
+            position[1] += shares * price if basis is None else basis
+        elif position[0] > 0:
+            # Selling releases the average cost of the shares sold
+            position[1] += position[1] * shares / position[0]
+        else:
+            position[1] = Decimal(0)
+        position[0] += shares
+    return positions
+
+
+def ledger(user_ids=None):
+    purchases = Purchase.objects.exclude(stock=None).exclude(shares=None)
+    if user_ids is not None:
+        purchases = purchases.filter(my_user_id__in=user_ids)
+    return (purchases.order_by('my_user_id', 'stock', 'id')
+            .values_list('my_user_id', 'stock', 'shares', 'price', 'basis')
+            .iterator(chunk_size=2000))
+
+
+def rebuild_holdings(user_ids=None, batch_size=1000):
+    """Recreate holdings from the ledger, for every user or only the given ones."""
+    positions = replay(ledger(user_ids))
+    holdings = [
+        Holding(my_user_id=user_id, stock=stock, shares=shares, cost_basis=cost_basis)
+        for (user_id, stock), (shares, cost_basis) in positions.items()
+    ]
+
+    with transaction.atomic():
+        existing = Holding.objects.all()
+        if user_ids is not None:
+            existing = existing.filter(my_user_id__in=user_ids)
+        existing.delete()
+        Holding.objects.bulk_create(holdings, batch_size=batch_size)
+    return len(holdings)
+
+
+def find_mismatches(user_ids=None):
+    """Return [(user_id, stock, shares in ledger, shares in holdings)] that disagree."""
+    purchases = Purchase.objects.exclude(stock=None)
+    holdings = Holding.objects.all()
+    if user_ids is not None:
+        purchases = purchases.filter(my_user_id__in=user_ids)
+        holdings = holdings.filter(my_user_id__in=user_ids)
+
+    expected = {
+        (row['my_user_id'], row['stock']): row['total_shares'] or 0
+        for row in purchases.values('my_user_id', 'stock').annotate(total_shares=Sum('shares'))
+    }
+    actual = {(row[0], row[1]): row[2] for row in holdings.values_list('my_user_id', 'stock', 'shares')}
+
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys()):
+        ledger_shares, held_shares = expected.get(key, 0), actual.get(key, 0)
+        if ledger_shares != held_shares:
+            mismatches.append((key[0], key[1], ledger_shares, held_shares))
+    return mismatches
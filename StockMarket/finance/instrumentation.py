@@ -0,0 +1,298 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.template.backends.django import DjangoTemplates
+from django.utils.decorators import sync_and_async_middleware
+
+# Per request breakdown of where the time goes: quote upstream, ORM queries and template rendering.
+# Timings are collected in a context variable, so they follow a request into sync_to_async
+# threads, and every hook is a single lookup returning None when nothing is being measured.
+
+DEFAULTS = {
+    # Measure requests at all, when False the middleware removes itself
+    "ENABLED": False,
+    # Add a Server-Timing header to every response
+    "SERVER_TIMING": True,
+    # Client addresses allowed to scrape the metrics endpoint
+    "METRICS_IPS": ["127.0.0.1", "::1"],
+}
+
+# Upper bounds in seconds of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Lookups counted by QuoteCache.stats(), by result label
+QUOTE_CACHE_RESULTS = (("hit", "hits"), ("stale_hit", "stale_hits"), ("miss", "misses"))
+
+_current = ContextVar("finance_request_timings", default=None)
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, "FINANCE_INSTRUMENTATION", {})}
+
+
+class RequestTimings:
+    """Counters of one request, times in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstream_calls = 0
+        self.upstream_time = 0.0
+        self.cache_hits = 0
+        self.cache_lookups = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.total_time = None
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    @property
+    def cache_hit_ratio(self):
+        return self.cache_hits / self.cache_lookups if self.cache_lookups else None
+
+    def server_timing(self):
+        """Value of the Server-Timing header, durations in milliseconds."""
+        upstream = f'upstream;dur={self.upstream_time * 1000:.2f};desc="{self.upstream_calls} calls'
+        if self.cache_lookups:
+            upstream += f', {self.cache_hit_ratio:.0%} cached'
+        return ", ".join((
+            upstream + '"',
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f'render;dur={self.render_time * 1000:.2f}',
+            f'total;dur={self.total_time * 1000:.2f}',
+        ))
+
+
+@contextmanager
+def timed_upstream():
+    """Count the quote provider call made in the block."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.upstream_calls += 1
+        timings.upstream_time += time.perf_counter() - started
+
+
+def record_cache_lookup(hit):
+    timings = _current.get()
+    if timings is not None:
+        timings.cache_lookups += 1
+        timings.cache_hits += hit
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper adding every query to the current request."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db_time += time.perf_counter() - started
+
+
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedTemplates(DjangoTemplates):
+    """Django template backend adding render time to the current request."""
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timings.render_time += time.perf_counter() - started
+
+
+class Metrics:
+    """Prometheus style counters of the measured requests, labelled by view."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.views = {}
+
+    def record(self, view, method, status, timings):
+        with self._lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            totals = self.views.get(view)
+            if totals is None:
+                totals = self.views[view] = {
+                    "count": 0, "seconds": 0.0, "buckets": [0] * len(DURATION_BUCKETS),
+                    "upstream_calls": 0, "upstream_seconds": 0.0, "cache_hits": 0, "cache_lookups": 0,
+                    "queries": 0, "db_seconds": 0.0, "render_seconds": 0.0,
+                }
+            totals["count"] += 1
+            totals["seconds"] += timings.total_time
+            bucket = bisect_left(DURATION_BUCKETS, timings.total_time)
+            if bucket < len(DURATION_BUCKETS):
+                totals["buckets"][bucket] += 1
+            totals["upstream_calls"] += timings.upstream_calls
+            totals["upstream_seconds"] += timings.upstream_time
+            totals["cache_hits"] += timings.cache_hits
+            totals["cache_lookups"] += timings.cache_lookups
+            totals["queries"] += timings.queries
+            totals["db_seconds"] += timings.db_time
+            totals["render_seconds"] += timings.render_time
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format."""
+        with self._lock:
+            requests = dict(self.requests)
+            views = {view: {**totals, "buckets": list(totals["buckets"])} for view, totals in self.views.items()}
+
+        lines = [
+            "# HELP finance_requests_total Requests served, by view, method and status.",
+            "# TYPE finance_requests_total counter",
+        ]
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append(f'finance_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP finance_request_duration_seconds Time spent serving requests.",
+            "# TYPE finance_request_duration_seconds histogram",
+        ]
+        for view, totals in sorted(views.items()):
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, totals["buckets"]):
+                cumulative += count
+                lines.append(f'finance_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+            lines.append(f'finance_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {totals["count"]}')
+            lines.append(f'finance_request_duration_seconds_sum{{view="{view}"}} {totals["seconds"]:.6f}')
+            lines.append(f'finance_request_duration_seconds_count{{view="{view}"}} {totals["count"]}')
+
+        for name, key, kind, help_text in (
+            ("finance_upstream_calls_total", "upstream_calls", "counter", "Quote provider calls."),
+            ("finance_upstream_seconds_total", "upstream_seconds", "counter", "Time spent waiting on the quote provider."),
+            ("finance_quote_cache_hits_total", "cache_hits", "counter", "Quote lookups served from the cache."),
+            ("finance_quote_cache_lookups_total", "cache_lookups", "counter", "Quote lookups."),
+            ("finance_db_queries_total", "queries", "counter", "Database queries."),
+            ("finance_db_seconds_total", "db_seconds", "counter", "Time spent in database queries."),
+            ("finance_render_seconds_total", "render_seconds", "counter", "Time spent rendering templates."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for view, totals in sorted(views.items()):
+                value = totals[key]
+                lines.append(f'{name}{{view="{view}"}} {value:.6f}' if isinstance(value, float) else
+                             f'{name}{{view="{view}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def render_quote_cache(stats):
+    """Process wide QuoteCache.stats() in the Prometheus text exposition format."""
+    lines = [
+        "# HELP finance_quote_cache_results_total Quote cache lookups of this process, by result.",
+        "# TYPE finance_quote_cache_results_total counter",
+    ]
+    lines += [f'finance_quote_cache_results_total{{result="{label}"}} {stats[key]}' for label, key in QUOTE_CACHE_RESULTS]
+    for name, key, kind, help_text in (
+        ("finance_quote_cache_coalesced_total", "coalesced", "counter", "Misses that waited on a fetch already in flight."),
+        ("finance_quote_cache_fetches_total", "fetches", "counter", "Upstream fetches made by the quote cache."),
+        ("finance_quote_cache_errors_total", "errors", "counter", "Upstream fetches of the quote cache that failed."),
+        ("finance_quote_cache_entries", "entries", "gauge", "Quotes held by the in-process quote cache."),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {stats[key]}"]
+    return "\n".join(lines) + "\n"
+
+
+@sync_and_async_middleware
+def timing_middleware(get_response):
+    """Measure every request and report it in Server-Timing and the metrics endpoint."""
+    options = get_options()
+    if not options["ENABLED"]:
+        raise MiddlewareNotUsed
+
+    # Time queries on connections already open and on every one opened from now on
+    connection_created.connect(install_query_timer, dispatch_uid="finance_install_query_timer")
+    for connection in connections.all():
+        install_query_timer(None, connection)
+
+    def finish(request, response, timings):
+        timings.finish()
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"
+        metrics.record(view, request.method, response.status_code, timings)
+        if options["SERVER_TIMING"]:
+            response["Server-Timing"] = timings.server_timing()
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = RequestTimings()
+            token = _current.set(timings)
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            return finish(request, response, timings)
+    else:
+        def middleware(request):
+            timings = RequestTimings()
+            token = _current.set(timings)
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            return finish(request, response, timings)
+
+    return middleware
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, only answering local clients while instrumentation is enabled."""
+    options = get_options()
+    if not options["ENABLED"] or request.META.get("REMOTE_ADDR") not in options["METRICS_IPS"]:
+        raise Http404
+    # Imported here as finance.cache reports its lookups to this module
+    from .cache import get_quote_cache
+
+    body = metrics.render() + render_quote_cache(get_quote_cache().stats())
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,255 @@
+import json
+import zlib
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+from heapq import heappop, heappush, heapreplace, merge
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils.dateparse import parse_datetime
+
+from .holdings import replay
+from .models import Cash, Holding, LedgerArchive, Purchase
+from .money import PRICE_STEP, price
+
+# Compaction of the Purchase ledger.
+# The rows of a position older than a cutoff are replaced by checkpoint rows, one per
+# FIFO lot they leave open, which reuse the ids of the rows they stand for so that
+# every replay in id order still sees them first. Between them the checkpoints carry
+# the average cost and the realized P&L of the rows folded, and those rows are moved
+# to a LedgerArchive, so the archive and the trades still live replay to the same
+# holdings as the checkpoints and the trades still live.
+
+ROW_FIELDS = ('id', 'stock', 'shares', 'price', 'bought_at', 'realized_pnl', 'basis', 'checkpoint')
+
+# Ids deleted per statement, below the SQLite bound on query parameters
+DELETE_CHUNK_SIZE = 500
+
+# Rows per LedgerArchive, which is decompressed as a whole when read
+ARCHIVE_ROWS = 20000
+
+
+def _encode_value(value):
+    # Unlike DjangoJSONEncoder, keep the microseconds of the times
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} can't be archived")
+
+
+def encode_rows(rows):
+    """Compress (id, stock, shares, price, bought_at, realized_pnl) rows into JSON lines."""
+    lines = (json.dumps(list(row), default=_encode_value, separators=(",", ":")) for row in rows)
+    return zlib.compress("\n".join(lines).encode(), 9)
+
+
+def decode_rows(data, chunk_size=65536):
+    """Yield the rows of encode_rows(), decompressing at most chunk_size bytes of them at a time."""
+    data = memoryview(data)
+    decompressor = zlib.decompressobj()
+    pending = b""
+    for start in range(0, len(data), chunk_size):
+        compressed = data[start:start + chunk_size]
+        # JSON lines compress tenfold and more, the output is bounded rather than the input
+        while compressed:
+            pending += decompressor.decompress(compressed, chunk_size)
+            compressed = decompressor.unconsumed_tail
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield _parse_row(line)
+    pending += decompressor.flush()
+    if pending:
+        yield _parse_row(pending)
+
+
+def _parse_row(line):
+    purchase_id, stock, shares, unit_price, bought_at, realized_pnl = json.loads(line)
+    return (
+        purchase_id, stock, shares, Decimal(unit_price) if unit_price is not None else None,
+        parse_datetime(bought_at) if bought_at else None,
+        Decimal(realized_pnl) if realized_pnl is not None else None,
+    )
+
+
+def fold(rows):
+    """Return the checkpoint Purchases standing for the ROW_FIELDS rows of one position, in id order.
+
+    There is one per FIFO lot left open, with the lot's shares, price and time, the
+    average cost basis of the position split between them and the realized P&L of
+    the rows on the first one. A position closed with some P&L gets a single row
+    of no shares, one closed without any gets none.
+    """
+    lots = deque()
+    held, basis, gains = 0, Decimal(0), Decimal(0)
+    for _, _, shares, unit_price, bought_at, realized_pnl, row_basis, _ in rows:
+        gains += realized_pnl or 0
+        if shares >= 0:
+            if shares:
+                lots.append([shares, unit_price, bought_at])
+            held += shares
+            basis += shares * unit_price if row_basis is None else row_basis
+            continue
+
+        # Sales take the oldest shares and release their average cost
+        sold = remaining = -shares
+        while remaining and lots:
+            taken = min(lots[0][0], remaining)
+            lots[0][0] -= taken
+            remaining -= taken
+            if not lots[0][0]:
+                lots.popleft()
+        basis = basis - basis * sold / held if held > sold else Decimal(0)
+        held -= sold
+
+    checkpoints = []
+    basis = left = basis.quantize(PRICE_STEP)
+    for index, (shares, unit_price, bought_at) in enumerate(lots):
+        share = (basis * shares / held).quantize(PRICE_STEP) if index < len(lots) - 1 and held > 0 else left
+        left -= share
+        checkpoints.append(Purchase(
+            stock=rows[0][1], shares=shares, price=unit_price, bought_at=bought_at, basis=share, checkpoint=True,
+        ))
+    if not checkpoints and gains:
+        checkpoints.append(Purchase(
+            stock=rows[0][1], shares=0, price=price(0), bought_at=rows[-1][4], basis=Decimal(0), checkpoint=True,
+        ))
+    if checkpoints:
+        checkpoints[0].realized_pnl = gains
+    return checkpoints
+
+
+def compact_user(user_id, before):
+    """Compact the ledger rows of the user older than before, returning (rows folded, checkpoints written)."""
+    with transaction.atomic():
+        # Serialize compactions of the same user, trades don't need the rows folded
+        list(Cash.objects.select_for_update().filter(my_user_id=user_id).values_list('id'))
+
+        purchases = Purchase.objects.filter(my_user_id=user_id).exclude(stock=None).exclude(shares=None)
+        # Only a prefix of each position is folded, rows older than a newer one stay
+        newer = dict(purchases.filter(bought_at__gte=before).values('stock')
+                     .annotate(first_id=Min('id')).values_list('stock', 'first_id'))
+
+        positions = {}
+        for row in purchases.exclude(bought_at__gte=before).order_by('stock', 'id').values_list(*ROW_FIELDS):
+            if row[1] not in newer or row[0] < newer[row[1]]:
+                positions.setdefault(row[1], []).append(row)
+
+        folded, checkpoints = [], []
+        for rows in positions.values():
+            replacement = fold(rows)
+            # A position of open lots only can't get any shorter
+            if len(replacement) >= len(rows):
+                continue
+            for checkpoint, row in zip(replacement, rows):
+                checkpoint.id, checkpoint.my_user_id = row[0], user_id
+            folded += rows
+            checkpoints += replacement
+        if not folded:
+            return 0, 0
+
+        trades = sorted(row[:6] for row in folded if not row[7])
+        for start in range(0, len(trades), ARCHIVE_ROWS):
+            chunk = trades[start:start + ARCHIVE_ROWS]
+            LedgerArchive.objects.create(
+                my_user_id=user_id, rows=len(chunk), first_id=chunk[0][0], last_id=chunk[-1][0],
+                first_at=min(row[4] for row in chunk), last_at=max(row[4] for row in chunk),
+                data=encode_rows(chunk),
+            )
+
+        ids = [row[0] for row in folded]
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+            Purchase.objects.filter(id__in=ids[start:start + DELETE_CHUNK_SIZE]).delete()
+        # bought_at is set on insert, the time of the lot is restored right after
+        times = [checkpoint.bought_at for checkpoint in checkpoints]
+        Purchase.objects.bulk_create(checkpoints)
+        for checkpoint, bought_at in zip(checkpoints, times):
+            checkpoint.bought_at = bought_at
+        Purchase.objects.bulk_update(checkpoints, ['bought_at'])
+    return len(folded), len(checkpoints)
+
+
+def compact_ledger(before, user_ids=None):
+    """Compact the ledger of every user, or the given ones, up to before.
+
+    Returns {"users", "rows", "checkpoints"} of what was compacted.
+    """
+    candidates = Purchase.objects.filter(bought_at__lt=before)
+    if user_ids is not None:
+        candidates = candidates.filter(my_user_id__in=user_ids)
+
+    report = {"users": 0, "rows": 0, "checkpoints": 0}
+    for user_id in list(candidates.order_by('my_user_id').values_list('my_user_id', flat=True).distinct()):
+        rows, checkpoints = compact_user(user_id, before)
+        if rows:
+            report["users"] += 1
+            report["rows"] += rows
+            report["checkpoints"] += checkpoints
+    return report
+
+
+def archived_rows(user_id, since=None, until=None):
+    """Yield the archived (id, stock, shares, price, bought_at, realized_pnl) rows of the user in id order.
+
+    Archives are only read once the rows before them are out, so only those
+    whose ids overlap are held at once. Those of a run never overlap each other,
+    but a position left alone by one run may be folded by a later one. Archives
+    entirely outside since to until aren't read at all.
+    """
+    archives = LedgerArchive.objects.filter(my_user_id=user_id)
+    if since is not None:
+        archives = archives.exclude(last_at__lt=since)
+    if until is not None:
+        archives = archives.exclude(first_at__gte=until)
+    pending = deque(archives.order_by('first_id').values_list('id', 'first_id'))
+
+    # (next row, archive id, its remaining rows) of every archive being read
+    reading = []
+    while pending or reading:
+        while pending and (not reading or pending[0][1] <= reading[0][0][0]):
+            archive_id, _ = pending.popleft()
+            rows = decode_rows(LedgerArchive.objects.values_list('data', flat=True).get(id=archive_id))
+            row = next(rows, None)
+            if row is not None:
+                heappush(reading, (row, archive_id, rows))
+        if not reading:
+            continue
+        row, archive_id, rows = reading[0]
+        if (since is None or row[4] >= since) and (until is None or row[4] < until):
+            yield row
+        following = next(rows, None)
+        if following is None:
+            heappop(reading)
+        else:
+            heapreplace(reading, (following, archive_id, rows))
+
+
+def full_ledger(user_id, since=None, until=None, chunk_size=2000):
+    """Yield every trade of the user, archived or live, made from since to until (exclusive), in id order, without checkpoints."""
+    live = Purchase.objects.filter(my_user_id=user_id, checkpoint=False)
+    if since is not None:
+        live = live.filter(bought_at__gte=since)
+    if until is not None:
+        live = live.filter(bought_at__lt=until)
+    live = live.order_by('id').values_list(*ROW_FIELDS[:6]).iterator(chunk_size=chunk_size)
+
+    return merge(archived_rows(user_id, since, until), live)
+
+
+def find_archive_mismatches(user_ids=None):
+    """[(user_id, stock, shares from the full ledger, shares held)] of the users that disagree, all of them by default."""
+    if user_ids is None:
+        user_ids = Holding.objects.order_by('my_user_id').values_list('my_user_id', flat=True).distinct()
+    mismatches = []
+    for user_id in user_ids:
+        positions = replay(
+            (user_id, stock, shares, unit_price, None)
+            for _, stock, shares, unit_price, _, _ in full_ledger(user_id) if stock is not None and shares is not None
+        )
+        held = dict(Holding.objects.filter(my_user_id=user_id).values_list('stock', 'shares'))
+        for stock in sorted({stock for _, stock in positions} | held.keys()):
+            replayed = positions.get((user_id, stock), (0,))[0]
+            if replayed != held.get(stock, 0):
+                mismatches.append((user_id, stock, replayed, held.get(stock, 0)))
+    return mismatches
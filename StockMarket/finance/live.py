@@ -0,0 +1,223 @@
+import asyncio
+import json
+import re
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .helpers import lookup_many
+
+
+DEFAULTS = {
+    # URL the live rates stream is served on
+    "PATH": "/live/",
+    # Seconds between two polls of the quote provider
+    "INTERVAL": 1.0,
+    # Seconds between keep-alive comments on idle streams
+    "HEARTBEAT": 15,
+    # Most symbols a single client may subscribe to
+    "MAX_SYMBOLS": 50,
+}
+
+SYMBOL_RE = re.compile(r"^[A-Z.\-]{1,5}$")
+
+
+def live_options(options=None):
+    """DEFAULTS overridden by settings.LIVE_RATES, then by options."""
+    return {**DEFAULTS, **getattr(settings, "LIVE_RATES", {}), **(options or {})}
+
+
+class Subscription:
+    """Ticks waiting to be sent to one client.
+
+    Only the latest tick per symbol is kept, so a slow client gets conflated
+    prices instead of an ever growing queue.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self.pending = {}
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def push(self, tick):
+        if tick["symbol"] in self.pending:
+            self.dropped += 1
+        self.pending[tick["symbol"]] = tick
+        self._ready.set()
+
+    async def next(self, timeout=None):
+        """Wait for ticks and return them, or an empty list on timeout."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        ticks, self.pending = list(self.pending.values()), {}
+        return ticks
+
+
+class TickHub:
+    """Fans out one shared upstream poll to every subscriber.
+
+    A single task polls the provider for the union of all subscribed symbols,
+    so the upstream sees one batch request per interval no matter how many
+    clients are connected.
+    """
+
+    def __init__(self, interval=1.0, fetch_many=lookup_many):
+        self.interval = interval
+        self.fetch_many = fetch_many
+        self.subscribers = defaultdict(set)
+        self.latest = {}
+        self._task = None
+
+    def subscribe(self, symbols):
+        subscription = Subscription(symbols)
+        for symbol in subscription.symbols:
+            self.subscribers[symbol].add(subscription)
+            # New subscribers get the last known price straight away
+            if symbol in self.latest:
+                subscription.push(self.latest[symbol])
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._poll())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for symbol in subscription.symbols:
+            subscribers = self.subscribers.get(symbol)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[symbol]
+                self.latest.pop(symbol, None)
+
+    def publish(self, quotes):
+        """Push every changed quote to the subscribers of its symbol."""
+        for symbol, quote in quotes.items():
+            if quote is None or symbol not in self.subscribers:
+                continue
+            previous = self.latest.get(symbol)
+            if previous is not None and previous["price"] == quote["price"]:
+                continue
+            tick = {"symbol": symbol, "name": quote["name"], "price": quote["price"]}
+            self.latest[symbol] = tick
+            for subscription in self.subscribers[symbol]:
+                subscription.push(tick)
+
+    async def _poll(self):
+        loop = asyncio.get_event_loop()
+        while self.subscribers:
+            symbols = list(self.subscribers)
+            try:
+                quotes = await loop.run_in_executor(None, self.fetch_many, symbols)
+            except Exception:
+                quotes = {}
+            self.publish(quotes)
+            await asyncio.sleep(self.interval)
+
+
+class LiveRatesApp:
+    """ASGI app streaming live rates as server-sent events, delegating everything else to Django.
+
+    Clients subscribe with GET <PATH>?symbols=AAPL,MSFT and must be logged in.
+    """
+
+    def __init__(self, django_app, options=None):
+        self.django_app = django_app
+        self.options = live_options(options)
+        self.hub = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.options["PATH"]:
+            return await self.django_app(scope, receive, send)
+
+        if self.hub is None:
+            self.hub = TickHub(interval=self.options["INTERVAL"])
+
+        if scope["method"] != "GET":
+            return await self._reply(send, 405, b"Method not allowed")
+
+        if not await self.is_authenticated(scope):
+            return await self._reply(send, 401, b"Login required")
+
+        query = parse_qs(scope.get("query_string", b"").decode())
+        symbols = {
+            symbol.strip().upper()
+            for value in query.get("symbols", [])
+            for symbol in value.split(",") if symbol.strip()
+        }
+
+        # Ensure the subscription is valid
+        if not symbols or len(symbols) > self.options["MAX_SYMBOLS"]:
+            return await self._reply(send, 400, b"Provide between 1 and %d symbols" % self.options["MAX_SYMBOLS"])
+        if not all(SYMBOL_RE.match(symbol) for symbol in symbols):
+            return await self._reply(send, 400, b"Invalid Symbol !!")
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+
+        subscription = self.hub.subscribe(symbols)
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        try:
+            while not disconnected.done():
+                ticks = asyncio.ensure_future(subscription.next(self.options["HEARTBEAT"]))
+                await asyncio.wait({ticks, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    ticks.cancel()
+                    break
+
+                body = b"".join(
+                    b"event: tick\ndata: %s\n\n" % json.dumps(tick, cls=DjangoJSONEncoder).encode()
+                    for tick in ticks.result()
+                ) or b": keep-alive\n\n"
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            self.hub.unsubscribe(subscription)
+            disconnected.cancel()
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def is_authenticated(self, scope):
+        """Check the Django session cookie sent with the request for a logged in user."""
+        cookies = SimpleCookie()
+        for name, value in scope.get("headers", []):
+            if name == b"cookie":
+                cookies.load(value.decode("latin-1"))
+
+        morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+        if morsel is None:
+            return False
+
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore(morsel.value)
+        return await sync_to_async(session.get)(SESSION_KEY) is not None
+
+    async def _wait_for_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def _reply(self, send, status, body):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,166 @@
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Cash, Holding, Lot, Purchase
+from .money import money, price, to_decimal
+
+# Lot accounting behind realized and unrealized P&L.
+# Purchases open lots, sales consume them oldest first, so a trade only touches the
+# lots it consumes. settings.FINANCE_LOT_METHOD picks whether the cost of the shares
+# sold is that of the lots consumed ("fifo") or the average cost of the holding ("average").
+
+FIFO, AVERAGE = "fifo", "average"
+
+# Open lots read at once while consuming them
+LOT_CHUNK_SIZE = 16
+
+
+def lot_method():
+    return getattr(settings, "FINANCE_LOT_METHOD", FIFO)
+
+
+def take(lots, shares, unit_price):
+    """Consume shares from lots, oldest first, returning the cost of the shares taken.
+
+    Lots are mutated in place. Shares no lot covers, e.g. in a ledger older than
+    lot tracking, are costed at unit_price, so they realize nothing.
+    """
+    cost, unit_price = Decimal(0), to_decimal(unit_price)
+    for lot in lots:
+        if not shares:
+            break
+        taken = min(lot.shares, shares)
+        cost += taken * lot.price
+        lot.shares -= taken
+        shares -= taken
+    return cost + shares * unit_price
+
+
+def close_lots(user, stock, shares, unit_price):
+    """Consume shares of the user's open lots of stock and return their cost, reading only the lots touched."""
+    lots, last_id, remaining = [], 0, shares
+    while remaining:
+        chunk = list(
+            Lot.objects.select_for_update()
+            .filter(my_user=user, stock=stock, id__gt=last_id)
+            .order_by('id')[:LOT_CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        lots += chunk
+        last_id = chunk[-1].id
+        remaining -= min(remaining, sum(lot.shares for lot in chunk))
+
+    cost = take(lots, shares, unit_price)
+
+    emptied = [lot.id for lot in lots if not lot.shares]
+    if emptied:
+        Lot.objects.filter(id__in=emptied).delete()
+    for lot in lots:
+        if lot.shares:
+            # Only the last lot touched can be partly consumed
+            Lot.objects.filter(id=lot.id).update(shares=lot.shares)
+            break
+    return cost
+
+
+def realized(shares, unit_price, cost):
+    return money(shares * to_decimal(unit_price) - cost)
+
+
+def position_costs(user_ids, method=None):
+    """{user_id: [(stock, shares, cost of the shares)]} of the open positions of users, under method."""
+    positions = defaultdict(list)
+    if (method or lot_method()) == AVERAGE:
+        rows = (Holding.objects.filter(my_user_id__in=user_ids, shares__gt=0)
+                .values_list('my_user_id', 'stock', 'shares', 'cost_basis'))
+    else:
+        rows = (Lot.objects.filter(my_user_id__in=user_ids)
+                .values('my_user_id', 'stock')
+                .annotate(total_shares=Sum('shares'), cost=Sum(F('shares') * F('price')))
+                .values_list('my_user_id', 'stock', 'total_shares', 'cost'))
+    for user_id, stock, shares, cost in rows:
+        positions[user_id].append((stock, shares, price(cost)))
+    return positions
+
+
+def unrealized_pnl(positions, prices):
+    """Return ({stock: unrealized P&L}, total) of [(stock, shares, cost)] at prices {SYMBOL: price}.
+
+    Positions without a price are left out.
+    """
+    pnl = {
+        stock: money(shares * prices[stock.upper()] - cost)
+        for stock, shares, cost in positions if prices.get(stock.upper()) is not None
+    }
+    return pnl, sum(pnl.values(), Decimal(0))
+
+
+def replay_lots(user_ids=None, batch_size=1000):
+    """Rebuild lots, the realized P&L of every sale and Cash.realized_profit from the ledger.
+
+    Returns the number of users replayed.
+    """
+    method = lot_method()
+    purchases = Purchase.objects.exclude(stock=None).exclude(shares=None).exclude(shares=0)
+    checkpoints = Purchase.objects.filter(checkpoint=True)
+    cash_rows = Cash.objects.all()
+    if user_ids is not None:
+        purchases = purchases.filter(my_user_id__in=user_ids)
+        checkpoints = checkpoints.filter(my_user_id__in=user_ids)
+        cash_rows = cash_rows.filter(my_user_id__in=user_ids)
+
+    open_lots = defaultdict(deque)
+    average = defaultdict(lambda: [0, Decimal(0)])
+    realized_by_user = defaultdict(Decimal)
+    sales = []
+    # Gains of the sales compacted into checkpoints, which can't be replayed
+    for user_id, gains in checkpoints.values('my_user_id').annotate(gains=Sum('realized_pnl')).values_list('my_user_id', 'gains'):
+        realized_by_user[user_id] += gains or 0
+
+    rows = (purchases.order_by('my_user_id', 'stock', 'id')
+            .values_list('id', 'my_user_id', 'stock', 'shares', 'price', 'bought_at', 'basis')
+            .iterator(chunk_size=2000))
+    for purchase_id, user_id, stock, shares, unit_price, bought_at, basis in rows:
+        key = (user_id, stock)
+        held = average[key]
+        if shares > 0:
+            open_lots[key].append(Lot(my_user_id=user_id, stock=stock, shares=shares, price=unit_price, opened_at=bought_at or timezone.now()))
+            held[0] += shares
+            held[1] += shares * unit_price if basis is None else basis
+            continue
+
+        sold = -shares
+        lots = open_lots[key]
+        cost = take(lots, sold, unit_price)
+        while lots and not lots[0].shares:
+            lots.popleft()
+        # Selling releases the average cost of the shares sold
+        released = held[1] * sold / held[0] if held[0] > 0 else sold * unit_price
+        held[0] -= sold
+        held[1] = held[1] - released if held[0] > 0 else Decimal(0)
+        if method == AVERAGE:
+            cost = released
+
+        gain = realized(sold, unit_price, cost)
+        sales.append(Purchase(id=purchase_id, realized_pnl=gain))
+        realized_by_user[user_id] += gain
+
+    with transaction.atomic():
+        existing = Lot.objects.all()
+        if user_ids is not None:
+            existing = existing.filter(my_user_id__in=user_ids)
+        existing.delete()
+        Lot.objects.bulk_create([lot for lots in open_lots.values() for lot in lots], batch_size=batch_size)
+        Purchase.objects.bulk_update(sales, ['realized_pnl'], batch_size=batch_size)
+
+        cash_rows = list(cash_rows.only('id', 'my_user_id', 'realized_profit'))
+        for cash in cash_rows:
+            cash.realized_profit = realized_by_user.get(cash.my_user_id, Decimal(0))
+        Cash.objects.bulk_update(cash_rows, ['realized_profit'], batch_size=batch_size)
+    return len(cash_rows)
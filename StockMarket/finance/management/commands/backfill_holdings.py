@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from finance.holdings import rebuild_holdings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Holding table from the Purchase ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only rebuild holdings of this user id, may be repeated")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_holdings(user_ids=options["users"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} holdings"))
@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.benchmarks import DRIVERS, ENDPOINTS, compare_results, run_benchmark, save_results, throwaway_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency, throughput, queries and memory of the finance views against a stub quote provider. "
+        "Runs on a throwaway test database, so the real one is never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--rows", type=int, default=100, help="Ledger rows seeded per user")
+        parser.add_argument("--symbols", type=int, default=20)
+        parser.add_argument("--requests", type=int, default=200, help="Timed requests per endpoint")
+        parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once")
+        parser.add_argument("--latency", type=float, default=0.0, help="Simulated upstream latency in seconds")
+        parser.add_argument("--driver", choices=sorted(DRIVERS), default="client")
+        parser.add_argument("--endpoint", action="append", choices=ENDPOINTS, dest="endpoints",
+                            help="Endpoint to measure, may be repeated, all of them by default")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--baseline", help="Results of a previous run to compare with")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline: {e}")
+
+        with throwaway_database():
+            results = run_benchmark(
+                users=options["users"],
+                rows=options["rows"],
+                symbols=options["symbols"],
+                requests=options["requests"],
+                concurrency=options["concurrency"],
+                latency=options["latency"],
+                driver=options["driver"],
+                endpoints=options["endpoints"] or ENDPOINTS,
+            )
+
+        if options["output"]:
+            save_results(results, options["output"])
+
+        changes = compare_results(baseline, results) if baseline else {}
+        self.stdout.write(f"{'endpoint':<12}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'errors':>8}{'queries':>9}{'peak kB':>10}")
+        for endpoint, result in results["endpoints"].items():
+            self.stdout.write(
+                f"{endpoint:<12}{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}"
+                f"{result['requests_per_second']:>9}{result['errors']:>8}{result['queries']:>9}{result['peak_memory_kb']:>10}"
+            )
+            if endpoint in changes:
+                self.stdout.write("  vs baseline: " + ", ".join(
+                    f"{name} {change:+.1%}" for name, change in sorted(changes[endpoint].items())
+                ))
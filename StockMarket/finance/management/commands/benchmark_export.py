@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from finance.benchmarks import benchmark_export, throwaway_database
+from finance.exports import FORMATS
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the peak memory of streaming ledgers of growing sizes out of the export view. "
+        "Runs on a throwaway test database, so the real one is never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, action="append", dest="sizes",
+                            help="Ledger rows of one export, may be repeated, 1000, 10000 and 100000 by default")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--archived", type=float, default=0.5,
+                            help="Fraction of each ledger compacted into the archive before exporting it")
+        parser.add_argument("--no-naive", action="store_false", dest="naive",
+                            help="Skip measuring the export built as a single response")
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            results = benchmark_export(
+                sizes=options["sizes"] or (1000, 10000, 100000),
+                fmt=options["format"],
+                gzip=options["gzip"],
+                naive=options["naive"],
+                archived=options["archived"],
+            )
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from finance.benchmarks import ENDPOINTS, PERFORMANCE_PROFILE, measure_queries, throwaway_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the queries per request of the finance views with the current settings and with a settings profile. "
+        "Runs on a throwaway test database, so the real one is never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--rows", type=int, default=20, help="Ledger rows seeded per user")
+        parser.add_argument("--probes", type=int, default=20, help="Requests per endpoint")
+        parser.add_argument("--profile", default=PERFORMANCE_PROFILE, help="Settings module to compare with")
+        parser.add_argument("--endpoint", action="append", choices=ENDPOINTS, dest="endpoints",
+                            help="Endpoint to measure, may be repeated, all of them by default")
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            results = measure_queries(
+                users=options["users"],
+                rows=options["rows"],
+                probes=options["probes"],
+                endpoints=options["endpoints"] or ENDPOINTS,
+                profile=options["profile"],
+            )
+
+        self.stdout.write(f"{'endpoint':<12}{'current':>9}{'profile':>9}")
+        for endpoint, queries in results.items():
+            self.stdout.write(f"{endpoint:<12}{queries['current']:>9}{queries['profile']:>9}")
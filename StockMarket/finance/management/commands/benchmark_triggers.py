@@ -0,0 +1,21 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from finance.benchmarks import benchmark_triggers
+
+
+class Command(BaseCommand):
+    help = "Measure how long the trigger engine takes to evaluate a tick against many open orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument("--symbols", type=int, default=1000)
+        parser.add_argument("--ticks", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = benchmark_triggers(
+            orders=options["orders"], symbols=options["symbols"], ticks=options["ticks"], seed=options["seed"],
+        )
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.holdings import find_mismatches, rebuild_holdings
+
+
+class Command(BaseCommand):
+    help = "Check that every Holding matches the sum of the Purchase ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only check holdings of this user id, may be repeated")
+        parser.add_argument("--fix", action="store_true", help="Rebuild holdings of users that don't match")
+
+    def handle(self, *args, **options):
+        mismatches = find_mismatches(user_ids=options["users"])
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("Holdings match the ledger"))
+            return
+
+        for user_id, stock, ledger_shares, held_shares in mismatches:
+            self.stdout.write(f"user {user_id} {stock}: ledger has {ledger_shares} shares, holding has {held_shares}")
+
+        if not options["fix"]:
+            raise CommandError(f"{len(mismatches)} holdings don't match the ledger")
+
+        user_ids = sorted({mismatch[0] for mismatch in mismatches})
+        rebuild_holdings(user_ids=user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt holdings of {len(user_ids)} users"))
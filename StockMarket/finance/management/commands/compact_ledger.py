@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from finance.ledger import compact_ledger, find_archive_mismatches
+
+
+class Command(BaseCommand):
+    help = "Fold ledger rows older than --days into checkpoint rows and move them to the compressed ledger archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=90, help="Only compact rows older than this many days")
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only compact the ledger of this user id, may be repeated")
+        parser.add_argument("--verify", action="store_true",
+                            help="Check that the archive and the live ledger still replay to the holdings")
+
+    def handle(self, *args, **options):
+        if options["days"] < 0:
+            raise CommandError("--days can't be negative")
+        before = timezone.now() - timedelta(days=options["days"])
+        report = compact_ledger(before, user_ids=options["users"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {report['rows']} rows of {report['users']} users into {report['checkpoints']} checkpoints"
+        ))
+
+        if options["verify"]:
+            mismatches = find_archive_mismatches(options["users"])
+            for user_id, stock, replayed, held in mismatches:
+                self.stdout.write(f"user {user_id} {stock}: ledger has {replayed} shares, holding has {held}")
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} positions disagree with the ledger")
+            self.stdout.write(self.style.SUCCESS("Archive and ledger agree with the holdings"))
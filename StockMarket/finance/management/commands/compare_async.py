@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from finance.benchmarks import compare_sync_async
+
+
+class Command(BaseCommand):
+    help = "Compare requests/sec of the sync and async quote views against a simulated slow upstream"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=4, help="Threads serving the sync view")
+        parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight for the async view")
+        parser.add_argument("--latency", type=float, default=0.2, help="Simulated upstream latency in seconds")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        results = compare_sync_async(
+            requests=options["requests"],
+            workers=options["workers"],
+            concurrency=options["concurrency"],
+            latency=options["latency"],
+        )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:>5}: {result['requests_per_second']:>8} req/s "
+                f"({result['requests']} requests in {result['seconds']}s, {result['errors']} errors)"
+            )
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.exports import FORMATS, export_chunks, parse_moment
+
+
+class Command(BaseCommand):
+    help = "Write the trades of a user, archived or live, as CSV or JSON in id order"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--output", help="File to write, standard output by default")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--since", help="Only trades made from this ISO 8601 date or time")
+        parser.add_argument("--until", help="Only trades made before this ISO 8601 date or time")
+        parser.add_argument("--gzip", action="store_true", help="Compress the output, requires --output")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options["username"]).first()
+        if user is None:
+            raise CommandError(f"No user {options['username']}")
+        if options["gzip"] and not options["output"]:
+            raise CommandError("--gzip requires --output")
+        try:
+            since = parse_moment(options["since"], "--since") if options["since"] else None
+            until = parse_moment(options["until"], "--until") if options["until"] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # Rows are streamed, nothing but the current chunk of each source is held in memory
+        blocks = export_chunks(user.id, options["format"], since, until, options["gzip"])
+        if not options["output"]:
+            for block in blocks:
+                self.stdout.write(block.decode(), ending="")
+            return
+        with open(options["output"], "wb") as f:
+            for block in blocks:
+                f.write(block)
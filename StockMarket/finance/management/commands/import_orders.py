@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.orders import place_orders, read_csv
+from finance.trading import BatchRejected
+
+
+class Command(BaseCommand):
+    help = "Execute the orders of a CSV file with side, symbol and shares columns for a user in one transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("path", help="CSV file of orders")
+        parser.add_argument("--best-effort", action="store_true",
+                            help="Execute every order that can be executed instead of rejecting the whole file")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']}")
+
+        try:
+            with open(options["path"], newline="") as f:
+                raw_orders = read_csv(f)
+        except OSError as e:
+            raise CommandError(f"Cannot read orders: {e}")
+
+        started = time.perf_counter()
+        try:
+            results = place_orders(user, raw_orders, all_or_nothing=not options["best_effort"])
+        except BatchRejected as e:
+            self.report_rejected(e.results)
+            raise CommandError(f"{e}, nothing was executed")
+
+        rejected = [result for result in results if result["status"] == "rejected"]
+        self.report_rejected(rejected)
+        self.stdout.write(self.style.SUCCESS(
+            f"Filled {len(results) - len(rejected)} of {len(results)} orders in {time.perf_counter() - started:.2f}s"
+        ))
+
+    def report_rejected(self, results):
+        for result in results:
+            if result["status"] == "rejected":
+                # Line 1 of the file is the header
+                self.stdout.write(f"line {result['index'] + 2}: {result['error']}")
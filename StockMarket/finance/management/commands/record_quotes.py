@@ -0,0 +1,43 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from finance.providers import QuoteProviderError, get_provider
+
+
+class Command(BaseCommand):
+    help = "Capture quotes from the configured provider into a file ReplayProvider can serve"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="File to write the frames to")
+        parser.add_argument("symbols", nargs="+", help="Symbols to record")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds between two frames")
+        parser.add_argument("--frames", type=int, default=60, help="Number of frames to record")
+
+    def handle(self, *args, **options):
+        provider = get_provider()
+        symbols = [symbol.upper() for symbol in options["symbols"]]
+        started = time.monotonic()
+
+        with open(options["output"], "w") as f:
+            for frame in range(options["frames"]):
+                if frame:
+                    time.sleep(options["interval"])
+                at = time.monotonic() - started
+                try:
+                    quotes = provider.quotes(symbols)
+                except QuoteProviderError as e:
+                    raise CommandError(f"Provider failed after {frame} frames: {e}")
+
+                f.write(json.dumps({
+                    "at": round(at, 3),
+                    "quotes": {
+                        symbol: {"name": quote["name"], "price": quote["price"]}
+                        for symbol, quote in quotes.items() if quote
+                    },
+                }, cls=DjangoJSONEncoder) + "\n")
+                f.flush()
+
+        self.stdout.write(f"Recorded {options['frames']} frames of {len(symbols)} symbols to {options['output']}")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from finance.refresher import QuoteRefresher
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep quotes of every held symbol fresh in the quote cache. "
+        "Set QUOTE_CACHE['BACKEND'] to a cache shared with the web workers so they see the refreshed quotes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="Seconds between refreshes while the market is open")
+        parser.add_argument("--closed-interval", type=float, help="Seconds between refreshes while it is closed")
+        parser.add_argument("--batch-size", type=int, help="Symbols per provider call")
+        parser.add_argument("--once", action="store_true", help="Run a single refresh and exit")
+
+    def handle(self, *args, **options):
+        refresher = QuoteRefresher.from_settings(
+            interval=options["interval"],
+            closed_interval=options["closed_interval"],
+            batch_size=options["batch_size"],
+        )
+        refresher.run(cycles=1 if options["once"] else None, report=self.report)
+
+    def report(self, result):
+        lag = "n/a" if result["lag"] is None else f"{result['lag']:.1f}s"
+        self.stdout.write(
+            f"refreshed {result['refreshed']}/{result['symbols']} symbols "
+            f"in batches of {result['batches']} in {result['duration']:.3f}s, lag {lag}"
+        )
+        self.stdout.flush()
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.providers import QuoteProviderError, get_provider
+from finance.symbols import SymbolDirectory, write_directory
+
+
+class Command(BaseCommand):
+    help = "Rewrite the symbol directory from the quote provider's reference data or from a CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="source", help="CSV file of symbol, name and exchange to use instead")
+        parser.add_argument("--output", help="Directory file to write, SYMBOL_DIRECTORY['PATH'] by default")
+
+    def handle(self, *args, **options):
+        output = options["output"] or getattr(settings, "SYMBOL_DIRECTORY", {}).get("PATH")
+        if not output:
+            raise CommandError("Set SYMBOL_DIRECTORY['PATH'] or pass --output")
+
+        if options["source"]:
+            try:
+                directory = SymbolDirectory.load(options["source"])
+            except (OSError, KeyError) as e:
+                raise CommandError(f"Can't read {options['source']}: {e}")
+            rows = [directory.entry(position) for position in range(len(directory))]
+        else:
+            try:
+                rows = get_provider().list_symbols()
+            except NotImplementedError:
+                raise CommandError("The quote provider has no reference data, pass --from")
+            except QuoteProviderError as e:
+                raise CommandError(f"Provider failed: {e}")
+
+        # An empty listing is more likely an upstream glitch than a delisting of everything
+        if not rows:
+            raise CommandError("No symbols found, keeping the current directory")
+
+        self.stdout.write(f"Wrote {write_directory(output, rows)} symbols to {output}")
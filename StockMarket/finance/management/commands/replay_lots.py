@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from finance.lots import lot_method, replay_lots
+
+
+class Command(BaseCommand):
+    help = "Rebuild lots and realized P&L from the Purchase ledger, e.g. for trades made before lots were tracked"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only replay the ledger of this user id, may be repeated")
+        parser.add_argument("--batch-size", type=int, default=500, help="Users replayed per transaction")
+
+    def handle(self, *args, **options):
+        user_ids = options["users"] or list(User.objects.order_by('id').values_list('id', flat=True))
+        replayed = 0
+        for start in range(0, len(user_ids), options["batch_size"]):
+            replayed += replay_lots(user_ids[start:start + options["batch_size"]])
+        self.stdout.write(self.style.SUCCESS(f"Replayed the ledger of {replayed} users with {lot_method()} lots"))
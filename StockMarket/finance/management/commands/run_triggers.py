@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from finance.triggers import RELOAD_INTERVAL, TriggerEngine
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill limit orders and fire price alerts as quotes cross them. "
+        "Run it with QUOTE_PROVIDER=simulator for a local simulated price feed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between two quote polls")
+        parser.add_argument("--batch-size", type=int, default=100, help="Symbols per quote lookup")
+        parser.add_argument("--reload-interval", type=float, default=RELOAD_INTERVAL,
+                            help="Seconds between two full reloads of the open orders and alerts")
+        parser.add_argument("--once", action="store_true", help="Run a single cycle and exit")
+
+    def handle(self, *args, **options):
+        engine = TriggerEngine(interval=options["interval"], batch_size=options["batch_size"],
+                               reload_interval=options["reload_interval"])
+        engine.run(cycles=1 if options["once"] else None, report=self.report)
+
+    def report(self, fired, open_triggers):
+        for order in fired["orders"]:
+            self.stdout.write(f"order {order.id} {order.status}: {order.side} {order.shares} {order.stock}"
+                              + (f" ({order.error})" if order.error else ""))
+        if fired["alerts"]:
+            self.stdout.write(f"{len(fired['alerts'])} alerts fired")
+        self.stdout.flush()
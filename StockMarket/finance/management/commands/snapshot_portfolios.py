@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from finance.snapshots import snapshot_portfolios
+
+
+class Command(BaseCommand):
+    help = "Record the value and P&L of every portfolio, meant to run periodically e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Users valued per transaction")
+
+    def handle(self, *args, **options):
+        written = snapshot_portfolios(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Recorded {written} portfolio snapshots"))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Holding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.CharField(max_length=5)),
+                ('shares', models.IntegerField(default=0)),
+                ('cost_basis', models.FloatField(default=0)),
+                ('my_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holdings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('my_user', 'stock'), name='unique_holding_per_stock')],
+            },
+        ),
+    ]
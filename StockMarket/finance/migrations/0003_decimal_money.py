@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:49
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+
+def round_money(apps, schema_editor):
+    """Round values carried over from the float/integer columns to the new decimal places."""
+    steps = {'cash': ('in_hand_money', 'net_profit'), 'holding': ('cost_basis',), 'purchase': ('price',)}
+    for model_name, fields in steps.items():
+        model = apps.get_model('finance', model_name)
+        places = {name: Decimal(1).scaleb(-model._meta.get_field(name).decimal_places) for name in fields}
+
+        changed = []
+        for row in model.objects.only('pk', *fields).iterator(chunk_size=2000):
+            for name, step in places.items():
+                value = getattr(row, name)
+                if value is not None:
+                    setattr(row, name, Decimal(str(value)).quantize(step, rounding=ROUND_HALF_UP))
+            changed.append(row)
+            if len(changed) >= 2000:
+                model.objects.bulk_update(changed, fields)
+                changed = []
+        if changed:
+            model.objects.bulk_update(changed, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_holding'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cash',
+            name='in_hand_money',
+            field=models.DecimalField(decimal_places=2, default=10000, max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='cash',
+            name='net_profit',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='holding',
+            name='cost_basis',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='purchase',
+            name='price',
+            field=models.DecimalField(decimal_places=4, max_digits=14, null=True),
+        ),
+        migrations.RunPython(round_money, migrations.RunPython.noop),
+    ]
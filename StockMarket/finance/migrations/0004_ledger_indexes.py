@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0003_decimal_money'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['my_user', 'stock'], name='purchase_user_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['my_user', 'bought_at'], name='purchase_user_time_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0005_api_token'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('cash', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('holdings_value', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('pnl', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('my_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['my_user', 'taken_at'], name='snapshot_user_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0006_portfolio_snapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cash',
+            name='realized_profit',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='realized_pnl',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.CharField(max_length=5)),
+                ('shares', models.IntegerField()),
+                ('price', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('opened_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('my_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['my_user', 'stock', 'id'], name='lot_position_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0007_lots'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LimitOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('buy', 'Buy'), ('sell', 'Sell')], max_length=4)),
+                ('stock', models.CharField(max_length=5)),
+                ('shares', models.IntegerField()),
+                ('limit_price', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('filled', 'Filled'), ('rejected', 'Rejected'), ('cancelled', 'Cancelled')], default='open', max_length=9)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, max_length=100)),
+                ('my_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='limit_orders', to=settings.AUTH_USER_MODEL)),
+                ('purchase', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='limit_order', to='finance.purchase')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='limit_order_status_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.CharField(max_length=5)),
+                ('direction', models.CharField(choices=[('above', 'Above'), ('below', 'Below')], max_length=5)),
+                ('price', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('triggered_at', models.DateTimeField(blank=True, null=True)),
+                ('triggered_price', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('my_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_alerts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['triggered_at', 'id'], name='price_alert_open_idx')],
+            },
+        ),
+    ]
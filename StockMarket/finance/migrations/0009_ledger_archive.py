@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0008_limit_orders_and_alerts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='basis',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='checkpoint',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='LedgerArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rows', models.PositiveIntegerField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('data', models.BinaryField()),
+                ('my_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_archives', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['my_user', 'first_id'], name='ledger_archive_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0009_ledger_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgerarchive',
+            name='first_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerarchive',
+            name='last_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0010_ledger_archive_times'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='limitorder',
+            index=models.Index(fields=['status', 'created_at'], name='limit_order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricealert',
+            index=models.Index(fields=['triggered_at', 'created_at'], name='price_alert_created_idx'),
+        ),
+    ]
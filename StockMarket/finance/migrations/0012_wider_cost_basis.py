@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0011_trigger_sync_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='holding',
+            name='cost_basis',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=16),
+        ),
+        migrations.AlterField(
+            model_name='purchase',
+            name='basis',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=16, null=True),
+        ),
+    ]
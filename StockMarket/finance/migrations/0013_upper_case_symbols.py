@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:20
+
+from django.db import migrations
+from django.db.models.functions import Upper
+
+
+def upper_case_symbols(apps, schema_editor):
+    """Upper case the symbols of trades submitted in lower case, merging the holdings they split."""
+    for model_name in ('purchase', 'lot'):
+        model = apps.get_model('finance', model_name)
+        model.objects.exclude(stock=Upper('stock')).update(stock=Upper('stock'))
+
+    Holding = apps.get_model('finance', 'holding')
+    for holding in Holding.objects.exclude(stock=Upper('stock')):
+        merged = Holding.objects.filter(my_user_id=holding.my_user_id, stock=holding.stock.upper()).first()
+        if merged is None:
+            holding.stock = holding.stock.upper()
+            holding.save(update_fields=['stock'])
+            continue
+        merged.shares += holding.shares
+        merged.cost_basis += holding.cost_basis
+        merged.save(update_fields=['shares', 'cost_basis'])
+        holding.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0012_wider_cost_basis'),
+    ]
+
+    operations = [
+        migrations.RunPython(upper_case_symbols, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:40
+
+from decimal import Decimal
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_holdings(apps, schema_editor):
+    """Build the holdings of users who traded before Holding existed, replaying their ledger at average cost."""
+    Holding = apps.get_model('finance', 'holding')
+    Purchase = apps.get_model('finance', 'purchase')
+
+    held = Holding.objects.values('my_user_id')
+    rows = (Purchase.objects.exclude(stock=None).exclude(shares=None).exclude(my_user_id__in=held)
+            .order_by('my_user_id', 'stock', 'id')
+            .values_list('my_user_id', 'stock', 'shares', 'price', 'basis')
+            .iterator(chunk_size=2000))
+
+    positions = {}
+    for user_id, stock, shares, price, basis in rows:
+        position = positions.setdefault((user_id, stock), [0, Decimal(0)])
+        if shares >= 0:
+            position[1] += shares * price if basis is None else basis
+        elif position[0] > 0:
+            position[1] += position[1] * shares / position[0]
+        else:
+            position[1] = Decimal(0)
+        position[0] += shares
+
+    Holding.objects.bulk_create([
+        Holding(my_user_id=user_id, stock=stock, shares=shares, cost_basis=cost_basis.quantize(Decimal('0.0001')))
+        for (user_id, stock), (shares, cost_basis) in positions.items()
+    ], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0013_upper_case_symbols'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_holdings, migrations.RunPython.noop),
+    ]
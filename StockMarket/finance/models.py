@@ -1,5 +1,11 @@
 #from django.conf import settings
-from django.db import models
+import secrets
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .money import BASIS_DIGITS, MAX_MONEY, MONEY_DIGITS, PRICE_DIGITS, to_decimal
 
 from django.contrib.auth.models import User
 
@@ -10,8 +16,10 @@ from django.dispatch import receiver
 class Cash(models.Model):
     # By default related name will be cash
     my_user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="cash")
-    in_hand_money = models.IntegerField(default=10000)
-    net_profit = models.IntegerField(default=0)
+    in_hand_money = models.DecimalField(max_digits=MONEY_DIGITS, decimal_places=2, default=10000)
+    net_profit = models.DecimalField(max_digits=MONEY_DIGITS, decimal_places=2, default=0)
+    # Gains and losses locked in by sales, net_profit adds the unrealized ones
+    realized_profit = models.DecimalField(max_digits=MONEY_DIGITS, decimal_places=2, default=0)
 
     def __str__(self):
         return f"Currently, the {self.my_user.username} has cash = {self.in_hand_money} in hand and net profit/loss = {self.net_profit}"
@@ -28,9 +36,214 @@ class Purchase(models.Model):
     my_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="purchases")
     stock = models.CharField(max_length=5, null=True)
     shares = models.IntegerField(null=True)
-    price = models.FloatField(null=True)
+    price = models.DecimalField(max_digits=PRICE_DIGITS, decimal_places=4, null=True)
     bought_at = models.DateTimeField(auto_now_add=True, null=True)
+    # Gain or loss of a sale against the cost of the shares sold, None for purchases
+    realized_pnl = models.DecimalField(max_digits=MONEY_DIGITS, decimal_places=2, null=True, blank=True)
+    # Row standing for older rows compacted into the ledger archive, see finance.ledger
+    checkpoint = models.BooleanField(default=False)
+    # Average cost a checkpoint adds to the holding, shares * price for every other row
+    basis = models.DecimalField(max_digits=BASIS_DIGITS, decimal_places=4, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Every portfolio and sell query filters the ledger on user and stock
+            models.Index(fields=['my_user', 'stock'], name='purchase_user_stock_idx'),
+            # Statements and history read the ledger of a user in time order
+            models.Index(fields=['my_user', 'bought_at'], name='purchase_user_time_idx'),
+        ]
 
     # Adding a Test Case 
     def is_valid_purchase(self):
         return self.shares > 0 and self.price > 0 and (len(self.stock) > 0 and len(self.stock) <= 5)
+
+class LedgerArchive(models.Model):
+    """Purchase rows of a user compacted away, as zlib compressed JSON lines ordered by id."""
+    my_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ledger_archives")
+    created_at = models.DateTimeField(auto_now_add=True)
+    rows = models.PositiveIntegerField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    # Times of the oldest and newest rows, None in archives written before they were recorded
+    first_at = models.DateTimeField(null=True)
+    last_at = models.DateTimeField(null=True)
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['my_user', 'first_id'], name='ledger_archive_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.rows} archived ledger rows of {self.my_user.username}"
+
+class Holding(models.Model):
+    """Current position of a user in a stock, kept in step with the Purchase ledger."""
+    my_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="holdings")
+    stock = models.CharField(max_length=5)
+    shares = models.IntegerField(default=0)
+    # Total amount paid for the shares currently held, at average cost
+    cost_basis = models.DecimalField(max_digits=BASIS_DIGITS, decimal_places=4, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['my_user', 'stock'], name='unique_holding_per_stock'),
+        ]
+
+    def __str__(self):
+        return f"{self.my_user.username} holds {self.shares} shares of {self.stock}"
+
+    @classmethod
+    def apply(cls, purchase):
+        """Fold a new ledger row into the user's holding with a single conditional UPDATE.
+
+        Returns False, changing nothing, when a sale is for more shares than are held
+        or a purchase would take the cost basis past MAX_MONEY.
+        Called by finance.trading within the transaction inserting the purchase.
+        """
+        if purchase.shares < 0:
+            return cls.release(purchase) is not None
+
+        cost = purchase.shares * to_decimal(purchase.price)
+        if cost > MAX_MONEY:
+            return False
+        holdings = cls.objects.filter(my_user_id=purchase.my_user_id, stock=purchase.stock)
+        fitting = holdings.filter(cost_basis__lte=MAX_MONEY - cost)
+
+        cost_basis = F('cost_basis') + cost
+        if fitting.update(shares=F('shares') + purchase.shares, cost_basis=cost_basis):
+            return True
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    my_user_id=purchase.my_user_id,
+                    stock=purchase.stock,
+                    shares=purchase.shares,
+                    cost_basis=cost,
+                )
+        except IntegrityError:
+            # The holding exists, its basis being too large, or somebody else created it in the meantime
+            return bool(fitting.update(shares=F('shares') + purchase.shares, cost_basis=cost_basis))
+        return True
+
+    @classmethod
+    def release(cls, purchase):
+        """Take the shares of a sale out of the user's holding, returning the average cost they release.
+
+        Returns None, changing nothing, when the sale is for more shares than are held.
+        Must run in a transaction, the holding stays locked until it ends.
+        """
+        sold = -purchase.shares
+        holdings = cls.objects.filter(my_user_id=purchase.my_user_id, stock=purchase.stock)
+        held = holdings.select_for_update().filter(shares__gte=sold).values_list('shares', 'cost_basis').first()
+        if held is None:
+            return None
+
+        # The basis is divided here rather than in SQL, where SQLite divides whole numbers as integers
+        shares, cost_basis = held
+        released = cost_basis * sold / shares
+        holdings.update(shares=shares - sold, cost_basis=cost_basis - released)
+        return released
+
+class Lot(models.Model):
+    """Shares of a stock bought together and not sold yet, consumed oldest first by sales."""
+    my_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lots")
+    stock = models.CharField(max_length=5)
+    shares = models.IntegerField()
+    price = models.DecimalField(max_digits=PRICE_DIGITS, decimal_places=4)
+    opened_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Sales walk the open lots of one position in id order
+            models.Index(fields=['my_user', 'stock', 'id'], name='lot_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.shares} shares of {self.stock} bought by {self.my_user.username} at {self.price}"
+
+class ApiToken(models.Model):
+    """Key authenticating a user on the JSON API."""
+    my_user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="api_token")
+    key = models.CharField(max_length=40, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"API token of {self.my_user.username}"
+
+    @classmethod
+    def for_user(cls, user):
+        token, _ = cls.objects.get_or_create(my_user=user, defaults={"key": secrets.token_hex(20)})
+        return token
+
+class PortfolioSnapshot(models.Model):
+    """Value of a user's portfolio at a point in time, appended by the snapshot_portfolios job."""
+    my_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="snapshots")
+    taken_at = models.DateTimeField()
+    cash = models.DecimalField(max_digits=MONEY_DIGITS, decimal_places=2)
+    # Market value of the holdings, at cost for the ones that couldn't be priced
+    holdings_value = models.DecimalField(max_digits=MONEY_DIGITS, decimal_places=2)
+    pnl = models.DecimalField(max_digits=MONEY_DIGITS, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['my_user', 'taken_at'], name='snapshot_user_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.my_user.username} had {self.total} at {self.taken_at}"
+
+    @property
+    def total(self):
+        return self.cash + self.holdings_value
+
+class LimitOrder(models.Model):
+    """Order to buy at or below, or sell at or above, limit_price, filled by the trigger engine."""
+    BUY, SELL = "buy", "sell"
+    OPEN, FILLED, REJECTED, CANCELLED = "open", "filled", "rejected", "cancelled"
+
+    my_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="limit_orders")
+    side = models.CharField(max_length=4, choices=[(BUY, "Buy"), (SELL, "Sell")])
+    stock = models.CharField(max_length=5)
+    shares = models.IntegerField()
+    limit_price = models.DecimalField(max_digits=PRICE_DIGITS, decimal_places=4)
+    status = models.CharField(max_length=9, default=OPEN, choices=[
+        (OPEN, "Open"), (FILLED, "Filled"), (REJECTED, "Rejected"), (CANCELLED, "Cancelled"),
+    ])
+    created_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    purchase = models.OneToOneField(Purchase, on_delete=models.SET_NULL, null=True, blank=True, related_name="limit_order")
+    # Why a triggered order couldn't be executed
+    error = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        indexes = [
+            # The trigger engine loads open orders, newest ones on every cycle
+            models.Index(fields=['status', 'id'], name='limit_order_status_idx'),
+            models.Index(fields=['status', 'created_at'], name='limit_order_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.side} {self.shares} {self.stock} at {self.limit_price} for {self.my_user.username} ({self.status})"
+
+class PriceAlert(models.Model):
+    """Notice for a user once a stock trades above or below a price."""
+    ABOVE, BELOW = "above", "below"
+
+    my_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="price_alerts")
+    stock = models.CharField(max_length=5)
+    direction = models.CharField(max_length=5, choices=[(ABOVE, "Above"), (BELOW, "Below")])
+    price = models.DecimalField(max_digits=PRICE_DIGITS, decimal_places=4)
+    created_at = models.DateTimeField(auto_now_add=True)
+    triggered_at = models.DateTimeField(null=True, blank=True)
+    triggered_price = models.DecimalField(max_digits=PRICE_DIGITS, decimal_places=4, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['triggered_at', 'id'], name='price_alert_open_idx'),
+            models.Index(fields=['triggered_at', 'created_at'], name='price_alert_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.stock} {self.direction} {self.price} for {self.my_user.username}"
@@ -0,0 +1,32 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+# Money is handled as Decimal everywhere: cash and totals in cents, share prices
+# with the four decimal places quote providers report.
+
+CENT = Decimal("0.01")
+PRICE_STEP = Decimal("0.0001")
+
+# Field sizes shared by the models and their migrations
+MONEY_DIGITS = 14
+PRICE_DIGITS = 14
+# Cost bases keep two more decimal places than cash for the same whole amounts
+BASIS_DIGITS = MONEY_DIGITS + 2
+# Largest amount of cash, or cost basis, the fields above can store
+MAX_MONEY = Decimal(10) ** (MONEY_DIGITS - 2) - CENT
+
+
+def to_decimal(value):
+    """Exact Decimal for value, going through str() so floats don't bring binary noise along."""
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def money(value):
+    """Round value to whole cents."""
+    return to_decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def price(value):
+    """Round a per share price to PRICE_STEP."""
+    return to_decimal(value).quantize(PRICE_STEP, rounding=ROUND_HALF_UP)
@@ -0,0 +1,75 @@
+import csv
+
+from .helpers import lookup_many
+from .trading import BUY, SELL, BatchRejected, execute_batch
+
+# Baskets of orders, from the API or a CSV file, priced with one batched quote lookup
+# and executed by trading.execute_batch in a single transaction.
+
+
+def parse_order(data):
+    """Return ({side, symbol, shares}, None) for a raw order, or (None, error message)."""
+    if not isinstance(data, dict):
+        return None, "Invalid Input !!"
+
+    side = str(data.get("side") or "").strip().lower()
+    symbol = str(data.get("symbol") or "").strip().upper()
+    shares = data.get("shares")
+
+    if side not in (BUY, SELL):
+        return None, "Side must be buy or sell !!"
+    if not symbol:
+        return None, "Must Provide Symbol !!"
+    if len(symbol) > 5:
+        return None, "Invalid Symbol !!"
+    if shares in (None, ""):
+        return None, "Missing Shares !!"
+    if isinstance(shares, str) and shares.strip().isdigit():
+        shares = int(shares)
+    if not isinstance(shares, int) or isinstance(shares, bool) or shares < 1:
+        return None, "Invalid Input !!"
+    return {"side": side, "symbol": symbol, "shares": shares}, None
+
+
+def read_csv(f):
+    """Raw orders of a CSV file with side, symbol and shares columns."""
+    reader = csv.DictReader(f)
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+    return list(reader)
+
+
+def place_orders(user, raw_orders, all_or_nothing=True):
+    """Validate, price and execute raw orders, returning one result per order as trading.execute_batch does.
+
+    Raises trading.BatchRejected when all_or_nothing is set and any order is
+    invalid, can't be priced or can't be executed.
+    """
+    parsed, invalid = [], {}
+    for index, data in enumerate(raw_orders):
+        order, error = parse_order(data)
+        if error:
+            invalid[index] = error
+        else:
+            parsed.append((index, order))
+
+    if invalid and all_or_nothing:
+        results = [
+            {"index": index, "status": "rejected", "error": error, "purchase": None}
+            for index, error in sorted(invalid.items())
+        ]
+        raise BatchRejected(f"{len(invalid)} of {len(raw_orders)} orders are invalid", results)
+
+    # Price every symbol with one batched lookup, before the transaction starts
+    quotes = lookup_many(sorted({order["symbol"] for _, order in parsed}))
+    prices = {symbol: quote["price"] for symbol, quote in quotes.items() if quote}
+
+    executed = execute_batch(user, [order for _, order in parsed], prices, all_or_nothing=all_or_nothing)
+
+    results = [
+        {"index": index, "status": "rejected", "error": error, "purchase": None}
+        for index, error in invalid.items()
+    ]
+    for (index, _), result in zip(parsed, executed):
+        results.append({**result, "index": index})
+    results.sort(key=lambda result: result["index"])
+    return results
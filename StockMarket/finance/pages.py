@@ -0,0 +1,127 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+from .cache import get_quote_cache
+
+# Per session cache of the rendered portfolio page.
+# A page is reused while the user's holdings version and the price epoch it was
+# rendered in are both current, and only for the CSRF secret it embeds, so that
+# another browser of the same user never gets a token it can't post with. Trades and deposits bump the version, and the
+# epoch is the quote cache TTL, as quotes don't change any faster than that, so
+# a repeat view within a tick costs one cache read and no query nor rendering.
+
+DEFAULTS = {
+    # Cache rendered pages at all, ETags are sent either way
+    "ENABLED": True,
+    # Alias from settings.CACHES holding pages and versions
+    "BACKEND": "default",
+    "KEY_PREFIX": "portfolio:",
+}
+
+
+class PortfolioPages:
+    """Rendered portfolio pages keyed by user, holdings version and price epoch."""
+
+    def __init__(self, enabled=True, backend="default", key_prefix="portfolio:"):
+        self.enabled = enabled
+        self.backend = caches[backend]
+        self.key_prefix = key_prefix
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, "PORTFOLIO_CACHE", {})}
+        return cls(enabled=options["ENABLED"], backend=options["BACKEND"], key_prefix=options["KEY_PREFIX"])
+
+    def version_key(self, user_id):
+        return f"{self.key_prefix}{user_id}:version"
+
+    def lookup(self, request):
+        """Return (slot, page) for request.user and their CSRF secret.
+
+        page is the cached {etag, content} when it can be served, slot is where
+        store() keeps a freshly rendered one, None when it mustn't be cached,
+        e.g. because quotes aren't cached either or messages are waiting to be
+        shown on it.
+        """
+        ttl = get_quote_cache().ttl
+        if not self.enabled or not ttl or len(messages.get_messages(request)):
+            return None, None
+
+        user_id = request.user.pk
+        epoch = int(time.time() // ttl)
+        # get_token() makes sure there is a secret, the one rendering the page would use
+        get_token(request)
+        secret = hashlib.md5(request.META["CSRF_COOKIE"].encode()).hexdigest()
+        version_key, page_key = self.version_key(user_id), f"{self.key_prefix}{user_id}:{epoch}:{secret}"
+        found = self.backend.get_many([version_key, page_key])
+        version, page = found.get(version_key, 0), found.get(page_key)
+        if page is not None and page["version"] != version:
+            page = None
+        return (page_key, version, ttl), page
+
+    def store(self, slot, content):
+        """Cache content rendered for slot and return its ETag."""
+        etag = quote_etag(hashlib.md5(content).hexdigest())
+        if slot is not None:
+            page_key, version, ttl = slot
+            self.backend.set(page_key, {"version": version, "etag": etag, "content": content}, timeout=ttl)
+        return etag
+
+    def invalidate(self, user_id):
+        """Bump the holdings version of the user, dropping every cached page."""
+        key = self.version_key(user_id)
+        try:
+            self.backend.incr(key)
+        except ValueError:
+            # Versions start at 0, a missing one becomes 1 unless somebody beat us to it
+            if not self.backend.add(key, 1, timeout=None):
+                self.backend.incr(key)
+
+
+def conditional(request, response, etag):
+    """Tag a portfolio response with etag, answering 304 when the client has it already."""
+    response["ETag"] = etag
+    # Browsers must revalidate every time, and never share the page between users
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ("Cookie",))
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+def cached_response(request, page):
+    return conditional(request, HttpResponse(page["content"]), page["etag"])
+
+
+_pages = None
+_pages_lock = threading.Lock()
+
+
+def get_portfolio_pages():
+    """Return the process wide page cache configured by settings.PORTFOLIO_CACHE."""
+    global _pages
+    if _pages is None:
+        with _pages_lock:
+            if _pages is None:
+                _pages = PortfolioPages.from_settings()
+    return _pages
+
+
+def invalidate_portfolio(user_id):
+    get_portfolio_pages().invalidate(user_id)
+
+
+@receiver(setting_changed)
+def reset_portfolio_pages(setting, **kwargs):
+    global _pages
+    if setting in ("PORTFOLIO_CACHE", "CACHES"):
+        _pages = None
@@ -0,0 +1,41 @@
+from django.db.models import F
+
+from .helpers import usd
+
+# Portfolio valuation shared by the HTML views and the JSON API
+
+
+def positions(user):
+    """Cash in hand and [{stock, total_shares}] of the stocks the user holds, ordered by stock."""
+    holdings = user.holdings.filter(shares__gt=0)
+    return user.cash.in_hand_money, list(holdings.values('stock', total_shares=F('shares')).order_by('stock'))
+
+
+def valuate(cash, holdings, quotes):
+    """Price holdings with quotes keyed by upper cased symbol.
+
+    Returns (rows, total) where every row gains name, price and value, and total
+    is the cash plus the value of every holding that could be priced.
+    """
+    total = cash
+    rows = []
+    for holding in holdings:
+        stock_data = quotes.get(holding["stock"].upper())
+        row = {**holding, "name": None, "price": None, "value": None}
+        if stock_data:
+            row["stock"] = stock_data["symbol"]
+            row["name"] = stock_data["name"]
+            row["price"] = stock_data["price"]
+            row["value"] = holding["total_shares"] * stock_data["price"]
+            total += row["value"]
+        rows.append(row)
+    return rows, total
+
+
+def page_context(cash, holdings, quotes):
+    """Context of finance/index.html, every amount formatted as USD."""
+    rows, total = valuate(cash, holdings, quotes)
+    for row in rows:
+        if row["value"] is not None:
+            row["price"], row["sum"] = usd(row["price"]), usd(row["value"])
+    return {"total": usd(total), "cash": usd(cash), "purchases": rows}
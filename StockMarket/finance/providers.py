@@ -0,0 +1,601 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import string
+import struct
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .money import price
+
+
+class QuoteProviderError(Exception):
+    """The quote provider could not be reached or gave an unusable answer."""
+
+
+class CircuitOpenError(QuoteProviderError):
+    """The provider failed too often recently and calls are being short-circuited."""
+
+
+class CircuitBreaker:
+    """Fail fast once the upstream has failed failure_threshold times in a row.
+
+    After reset_timeout seconds a single trial call is let through, closing the
+    circuit again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Cap retries to a fraction of the calls made so retries can't amplify an outage.
+
+    Every call deposits ratio tokens, every retry withdraws a whole one and the
+    balance never grows beyond reserve.
+    """
+
+    def __init__(self, ratio=0.1, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.balance = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(self.reserve, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class BaseQuoteProvider:
+    """Interface every quote provider implements.
+
+    quote() returns {"name", "price", "symbol"} or None for an unknown symbol
+    and raises QuoteProviderError when the provider itself is failing.
+    """
+
+    def quote(self, symbol):
+        raise NotImplementedError
+
+    def quotes(self, symbols):
+        """Return {symbol: quote or None} for all symbols."""
+        return {symbol: self.quote(symbol) for symbol in symbols}
+
+    async def aquote(self, symbol):
+        """Async quote(), by default the blocking call run in a worker thread."""
+        return await sync_to_async(self.quote, thread_sensitive=False)(symbol)
+
+    async def aquotes(self, symbols):
+        """Async quotes(), by default the blocking call run in a worker thread."""
+        return await sync_to_async(self.quotes, thread_sensitive=False)(symbols)
+
+    def list_symbols(self):
+        """Reference data [{"symbol", "name", "exchange"}] of every symbol the provider quotes."""
+        raise NotImplementedError
+
+
+class IEXProvider(BaseQuoteProvider):
+    """IEX cloud API client with a pooled keep-alive session, and an httpx client per event loop for async views."""
+
+    # IEX accepts at most 100 symbols per batch request
+    batch_size = 100
+
+    def __init__(self, base_url, api_key, pool_size=10, connect_timeout=3.05, read_timeout=5,
+                 max_retries=2, backoff=0.1, retry_ratio=0.1, failure_threshold=5, reset_timeout=30,
+                 max_parallel_fetches=8, async_pool_size=100, async_transport=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.async_pool_size = async_pool_size
+        self.async_transport = async_transport
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_parallel_fetches = max_parallel_fetches
+
+        self.retry_budget = RetryBudget(ratio=retry_ratio)
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+
+        # Retries are handled by us so that they respect the budget and the breaker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # httpx clients are bound to the event loop they were created on
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def quote(self, symbol):
+        data = self._get(f"/stock/{requests.utils.quote(symbol, safe='')}/quote")
+        return parse_quote(data)
+
+    def list_symbols(self):
+        data = self._get("/ref-data/symbols")
+        if not isinstance(data, list):
+            raise QuoteProviderError("IEX returned no reference data")
+        return [
+            {"symbol": row["symbol"].upper(), "name": row.get("name") or "", "exchange": row.get("exchange") or ""}
+            for row in data if row.get("symbol")
+        ]
+
+    def quotes(self, symbols):
+        chunks = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        if len(chunks) <= 1:
+            return self._batch(symbols) if symbols else {}
+
+        quotes = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel_fetches, len(chunks))) as pool:
+            for chunk_quotes in pool.map(self._batch, chunks):
+                quotes.update(chunk_quotes)
+        return quotes
+
+    def _batch(self, symbols):
+        try:
+            data = self._get("/stock/market/batch", {"symbols": ",".join(symbols), "types": "quote"})
+        except CircuitOpenError:
+            raise
+        except QuoteProviderError:
+            # Batch endpoint is unavailable, fall back to bounded parallel single fetches
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel_fetches, len(symbols))) as pool:
+                return dict(zip(symbols, pool.map(self._quote_or_none, symbols)))
+
+        # Symbols unknown to the API are simply missing from the response
+        data = data or {}
+        return {symbol: parse_quote((data.get(symbol) or {}).get("quote")) for symbol in symbols}
+
+    def _quote_or_none(self, symbol):
+        try:
+            return self.quote(symbol)
+        except QuoteProviderError:
+            return None
+
+    async def aquote(self, symbol):
+        data = await self._aget(f"/stock/{requests.utils.quote(symbol, safe='')}/quote")
+        return parse_quote(data)
+
+    async def aquotes(self, symbols):
+        chunks = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        quotes = {}
+        for chunk_quotes in await asyncio.gather(*(self._abatch(chunk) for chunk in chunks)):
+            quotes.update(chunk_quotes)
+        return quotes
+
+    async def _abatch(self, symbols):
+        try:
+            data = await self._aget("/stock/market/batch", {"symbols": ",".join(symbols), "types": "quote"})
+        except CircuitOpenError:
+            raise
+        except QuoteProviderError:
+            # Batch endpoint is unavailable, fall back to bounded concurrent single fetches
+            semaphore = asyncio.Semaphore(self.max_parallel_fetches)
+
+            async def fetch(symbol):
+                async with semaphore:
+                    try:
+                        return await self.aquote(symbol)
+                    except QuoteProviderError:
+                        return None
+
+            return dict(zip(symbols, await asyncio.gather(*(fetch(symbol) for symbol in symbols))))
+
+        data = data or {}
+        return {symbol: parse_quote((data.get(symbol) or {}).get("quote")) for symbol in symbols}
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_connections=self.async_pool_size,
+                                    max_keepalive_connections=self.async_pool_size),
+                transport=self.async_transport,
+            )
+        return client
+
+    async def _aget(self, path, params=None):
+        """Async _get() sharing the retry budget and circuit breaker."""
+        params = {**(params or {}), "token": self.api_key}
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("IEX is failing, not calling it for now")
+
+            try:
+                response = await self._async_client().get(path, params=params)
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    self.breaker.record_success()
+                    return None
+                response.raise_for_status()
+                data = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    raise QuoteProviderError(str(e)) from e
+
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            return data
+
+    def _get(self, path, params=None):
+        """GET path and return the decoded JSON body, or None when IEX doesn't know it."""
+        params = {**(params or {}), "token": self.api_key}
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("IEX is failing, not calling it for now")
+
+            try:
+                response = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+                # Unknown symbols come back as client errors, those don't count against IEX
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    self.breaker.record_success()
+                    return None
+                response.raise_for_status()
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    raise QuoteProviderError(str(e)) from e
+
+                # Full jitter exponential backoff
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            return data
+
+
+class LocalProvider(BaseQuoteProvider):
+    """Offline provider serving fixed prices, for tests and local development."""
+
+    def __init__(self, quotes=None, latency=0):
+        self.latency = latency
+        self.prices = {}
+        self.names = {}
+        for symbol, quote in (quotes or {}).items():
+            self.set_price(symbol, quote)
+
+    def set_price(self, symbol, quote):
+        """Accept either a bare price or a {"name", "price"} dict."""
+        if not isinstance(quote, dict):
+            quote = {"price": quote}
+        symbol = symbol.upper()
+        self.prices[symbol] = price(quote["price"])
+        self.names[symbol] = quote.get("name", symbol)
+
+    def quote(self, symbol):
+        self._wait()
+        return self._lookup(symbol)
+
+    def quotes(self, symbols):
+        # A batch costs a single round trip
+        self._wait()
+        return {symbol: self._lookup(symbol) for symbol in symbols}
+
+    async def aquote(self, symbol):
+        await self._await()
+        return self._lookup(symbol)
+
+    async def aquotes(self, symbols):
+        await self._await()
+        return {symbol: self._lookup(symbol) for symbol in symbols}
+
+    def list_symbols(self):
+        return [{"symbol": symbol, "name": self.names[symbol], "exchange": ""} for symbol in self.prices]
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    async def _await(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _lookup(self, symbol):
+        symbol = symbol.upper()
+        if symbol not in self.prices:
+            return None
+        return {"name": self.names[symbol], "price": self.prices[symbol], "symbol": symbol}
+
+
+class ReplayProvider(LocalProvider):
+    """Provider replaying quotes captured by the record_quotes command.
+
+    The file holds one JSON frame per line, {"at": seconds, "quotes": {symbol: {"name", "price"}}},
+    and frames are served as the clock passes their offset, speed times faster than
+    they were recorded. A symbol keeps its last recorded quote until a later frame changes it.
+    """
+
+    def __init__(self, path, speed=1.0, loop=True, latency=0, clock=time.monotonic):
+        super().__init__(latency=latency)
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock
+        self.frames = load_frames(path)
+        self.duration = self.frames[-1][0] if self.frames else 0
+        self._lock = threading.Lock()
+        self._rewind()
+
+    def _rewind(self):
+        self.prices, self.names = {}, {}
+        self._next_frame = 0
+        self._started = self.clock()
+
+    def _advance(self):
+        with self._lock:
+            elapsed = (self.clock() - self._started) * self.speed
+            if self.loop and self.duration and elapsed > self.duration:
+                self._rewind()
+                elapsed = 0
+            while self._next_frame < len(self.frames) and self.frames[self._next_frame][0] <= elapsed:
+                for symbol, quote in self.frames[self._next_frame][1].items():
+                    self.set_price(symbol, quote)
+                self._next_frame += 1
+
+    def quote(self, symbol):
+        self._advance()
+        return super().quote(symbol)
+
+    def quotes(self, symbols):
+        self._advance()
+        return super().quotes(symbols)
+
+    async def aquote(self, symbol):
+        self._advance()
+        return await super().aquote(symbol)
+
+    async def aquotes(self, symbols):
+        self._advance()
+        return await super().aquotes(symbols)
+
+    def list_symbols(self):
+        names = {}
+        for _, quotes in self.frames:
+            for symbol, quote in quotes.items():
+                names[symbol.upper()] = quote.get("name", symbol.upper()) if isinstance(quote, dict) else symbol.upper()
+        return [{"symbol": symbol, "name": name, "exchange": ""} for symbol, name in names.items()]
+
+
+def load_frames(path):
+    """Read a capture file into [(at, {symbol: quote})] ordered by time."""
+    frames = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                frame = json.loads(line)
+                frames.append((float(frame["at"]), frame["quotes"]))
+    frames.sort(key=lambda frame: frame[0])
+    return frames
+
+
+# Steps a simulated walk can take, 2 ** 48 ticks of a millisecond are about 9000 years
+WALK_LEVELS = 48
+
+MAX_SIMULATED_PRICE = 1e6
+
+
+class _Walk:
+    """Brownian motion of one simulated symbol, derived from seeded hashes.
+
+    W(n) is found by bisecting [0, 2 ** WALK_LEVELS] with Brownian bridges,
+    each midpoint drawn from a hash of the key, the depth and the interval, so
+    it costs at most WALK_LEVELS draws however large n is and whatever was
+    read before. The last path is kept, so moving one step along only redraws
+    its last few intervals.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.lock = threading.Lock()
+        # [(low, high, W(low), W(high))] of nested intervals, widest first
+        self.path = [(0, 2 ** WALK_LEVELS, 0.0, 2 ** (WALK_LEVELS / 2) * self.normal(0, 0))]
+
+    def normal(self, depth, low):
+        """Standard normal draw of the interval starting at low at depth, by Box-Muller."""
+        digest = hashlib.blake2b(struct.pack(">QQ", depth, low), digest_size=16, key=self.key).digest()
+        first, second = struct.unpack(">QQ", digest)
+        return math.sqrt(-2 * math.log((first + 1) / 2 ** 64)) * math.cos(2 * math.pi * second / 2 ** 64)
+
+    def at(self, step):
+        path = self.path
+        while not path[-1][0] <= step <= path[-1][1]:
+            path.pop()
+        while True:
+            low, high, w_low, w_high = path[-1]
+            if step == low:
+                return w_low
+            if step == high:
+                return w_high
+            middle = (low + high) // 2
+            w_middle = (w_low + w_high) / 2 + math.sqrt(high - low) / 2 * self.normal(len(path), low)
+            path.append((low, middle, w_low, w_middle) if step < middle else (middle, high, w_middle, w_high))
+
+
+class SimulatorProvider(LocalProvider):
+    """Deterministic market of symbols following seeded random walks, for load tests and offline runs.
+
+    Every symbol walks a log-normal path derived from seed and the symbol, so
+    the price after n ticks is the same whichever symbols are asked for and when,
+    and takes about the same time to compute after a second or a year of ticks.
+    Prices move one tick every tick seconds, or only on advance() when tick is 0.
+    """
+
+    def __init__(self, symbols=1000, seed=0, start_price=100, volatility=0.01, tick=1.0,
+                 latency=0, clock=time.monotonic):
+        super().__init__(latency=latency)
+        self.symbols = simulated_symbols(symbols) if isinstance(symbols, int) else [s.upper() for s in symbols]
+        self.seed = seed
+        self.start_price = float(start_price)
+        self.volatility = volatility
+        self.tick = tick
+        self.clock = clock
+        self._started = clock()
+        self._steps = 0
+        # Guards the step counter and the creation of walks
+        self._lock = threading.Lock()
+        # symbol -> _Walk, created on first use
+        self._walks = dict.fromkeys(self.symbols)
+        # symbol -> (step, price) of the last quote
+        self._last = {}
+
+    def advance(self, steps=1):
+        """Move the market forward by steps ticks."""
+        with self._lock:
+            self._steps += steps
+
+    def current_step(self):
+        if self.tick:
+            return self._steps + int((self.clock() - self._started) / self.tick)
+        return self._steps
+
+    def _lookup(self, symbol, step=None):
+        symbol = symbol.upper()
+        if symbol not in self._walks:
+            return None
+
+        step = self.current_step() if step is None else step
+        last = self._last.get(symbol)
+        if last is None or last[0] != step:
+            walk = self._walks[symbol]
+            if walk is None:
+                with self._lock:
+                    walk = self._walks[symbol]
+                    if walk is None:
+                        key = hashlib.blake2b(f"{self.seed}:{symbol}".encode(), digest_size=32).digest()
+                        walk = self._walks[symbol] = _Walk(key)
+            # Symbols are walked in parallel, each under its own lock
+            with walk.lock:
+                exponent = self.volatility * walk.at(step)
+            # Walks left running for ages end up pinned to the bounds rather than overflowing
+            value = min(max(self.start_price * math.exp(min(exponent, 700)), 0.01), MAX_SIMULATED_PRICE)
+            last = self._last[symbol] = (step, price(round(value, 4)))
+
+        return {"name": f"{symbol} Simulated", "price": last[1], "symbol": symbol}
+
+    def quotes(self, symbols):
+        self._wait()
+        step = self.current_step()
+        return {symbol: self._lookup(symbol, step) for symbol in symbols}
+
+    async def aquotes(self, symbols):
+        await self._await()
+        step = self.current_step()
+        return {symbol: self._lookup(symbol, step) for symbol in symbols}
+
+    def list_symbols(self):
+        return [{"symbol": symbol, "name": f"{symbol} Simulated", "exchange": "SIM"} for symbol in self.symbols]
+
+
+def simulated_symbols(count):
+    """The first count symbols of AAAA, AAAB, ... so they look like tickers."""
+    letters = string.ascii_uppercase
+    return [
+        "".join(letters[i // 26 ** power % 26] for power in (3, 2, 1, 0))
+        for i in range(count)
+    ]
+
+
+def parse_quote(quote):
+    """Get stock information such as Stock's Name, Price & Symbol from an IEX quote."""
+    try:
+        return {
+            "name": quote["companyName"],
+            "price": price(quote["latestPrice"]),
+            "symbol": quote["symbol"].upper()
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def create_provider(config):
+    """Instantiate a provider from a {"BACKEND": dotted path, "OPTIONS": {...}} dict."""
+    backend = import_string(config["BACKEND"])
+    options = {name.lower(): value for name, value in config.get("OPTIONS", {}).items()}
+    return backend(**options)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """Return the process wide provider configured by settings.QUOTE_PROVIDER."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_provider(settings.QUOTE_PROVIDER)
+    return _provider
+
+
+def set_provider(provider):
+    """Swap the process wide provider, e.g. for a LocalProvider in tests."""
+    global _provider
+    _provider = provider
+
+
+@receiver(setting_changed)
+def reset_provider(setting, **kwargs):
+    global _provider
+    if setting == "QUOTE_PROVIDER":
+        _provider = None
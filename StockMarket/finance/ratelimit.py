@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Token bucket rate limits on the quote bound views and on the quote provider itself.
+# Buckets are kept as the time they are next full (GCRA), a single number per bucket,
+# in a Django cache shared by the worker processes or in memory when there is none.
+# A request over its limit still runs, but serves cached quotes instead of asking
+# the provider, and is only refused when a quote it needs isn't cached.
+
+DEFAULTS = {
+    # Limit anything at all
+    "ENABLED": True,
+    # Alias from settings.CACHES shared by the worker processes, None to count per process
+    "BACKEND": None,
+    "KEY_PREFIX": "ratelimit:",
+    # Requests per user to each scope, "<count>/<s|m|h|d>", None for no limit
+    "RATES": {},
+    # Rates replacing RATES for some users, {username: {scope: rate}}
+    "USER_RATES": {},
+    # Symbols quoted by the provider, shared by every user and process, None for no limit
+    "UPSTREAM_RATE": None,
+    # Oldest cached quote served instead of asking the provider, in seconds
+    "DEGRADED_MAX_AGE": 300,
+}
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Quotes of the request being served are only read from the cache while this is set
+_degraded = ContextVar("finance_degraded_quotes", default=None)
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, "FINANCE_RATE_LIMITS", {})}
+
+
+def parse_rate(rate):
+    """Return (count, period in seconds) of a "<count>/<s|m|h|d>" rate."""
+    count, _, period = rate.partition("/")
+    try:
+        count, seconds = int(count), PERIODS[period.strip().lower()[:1]]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate {rate!r}, expected e.g. '30/m'")
+    if count < 1:
+        raise ValueError(f"Invalid rate {rate!r}, count must be positive")
+    return count, seconds
+
+
+def gcra(full_at, now, count, period, cost=1):
+    """Spend cost tokens of a bucket of count tokens refilled every period.
+
+    full_at is when the bucket is next full, None for a full one. Returns
+    (new full_at, 0) when the tokens could be spent, (full_at, seconds to wait) otherwise.
+    """
+    # A request for more than the bucket holds waits for a full bucket
+    cost = min(cost, count)
+    interval = period / count
+    full_at = max(full_at or now, now) + interval * cost
+    # The bucket may not owe more than its size
+    excess = full_at - now - period
+    if excess > 1e-9:
+        return full_at - interval * cost, excess
+    return full_at, 0
+
+
+class MemoryBucketStore:
+    """Buckets of this process only."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, count, period, cost=1):
+        """Spend cost tokens of the bucket at key, returning 0 or the seconds until they are available."""
+        now = time.time()
+        with self._lock:
+            full_at, wait = gcra(self._buckets.get(key), now, count, period, cost)
+            self._buckets[key] = full_at
+            # Full buckets hold no information
+            if len(self._buckets) > 10000:
+                self._buckets = {key: value for key, value in self._buckets.items() if value > now}
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """Buckets in a Django cache shared between processes, falling back to memory when it fails.
+
+    Updates are a read followed by a write, so processes racing on one bucket
+    may let a few more requests through than its rate.
+    """
+
+    def __init__(self, backend, key_prefix="ratelimit:"):
+        self.backend = caches[backend]
+        self.key_prefix = key_prefix
+        self.fallback = MemoryBucketStore()
+
+    def take(self, key, count, period, cost=1):
+        now = time.time()
+        try:
+            full_at, wait = gcra(self.backend.get(self.key_prefix + key), now, count, period, cost)
+            if not wait:
+                self.backend.set(self.key_prefix + key, full_at, timeout=math.ceil(full_at - now) + 1)
+            return wait
+        except Exception:
+            logger.warning("Rate limit store unavailable, counting in memory", exc_info=True)
+            return self.fallback.take(key, count, period, cost)
+
+    def clear(self):
+        self.fallback.clear()
+
+
+class RateLimiter:
+    """Per user limits of the scopes in rates and the shared upstream limit."""
+
+    def __init__(self, store, rates=None, user_rates=None, upstream_rate=None, degraded_max_age=300, enabled=True):
+        self.store = store
+        self.enabled = enabled
+        self.degraded_max_age = degraded_max_age
+        self.rates = {scope: parse_rate(rate) for scope, rate in (rates or {}).items() if rate}
+        self.user_rates = {
+            username: {scope: parse_rate(rate) if rate else None for scope, rate in scopes.items()}
+            for username, scopes in (user_rates or {}).items()
+        }
+        self.upstream_rate = parse_rate(upstream_rate) if upstream_rate else None
+
+    @classmethod
+    def from_settings(cls):
+        options = get_options()
+        store = (CacheBucketStore(options["BACKEND"], options["KEY_PREFIX"]) if options["BACKEND"]
+                 else MemoryBucketStore())
+        return cls(store, rates=options["RATES"], user_rates=options["USER_RATES"],
+                   upstream_rate=options["UPSTREAM_RATE"], degraded_max_age=options["DEGRADED_MAX_AGE"],
+                   enabled=options["ENABLED"])
+
+    def rate(self, scope, user):
+        scopes = self.user_rates.get(user.get_username()) if user.is_authenticated else None
+        if scopes is not None and scope in scopes:
+            return scopes[scope]
+        return self.rates.get(scope)
+
+    def hit(self, scope, request):
+        """Count a request to scope, returning 0 or the seconds until the client may make it."""
+        rate = self.rate(scope, request.user) if self.enabled else None
+        if rate is None:
+            return 0
+        client = f"user:{request.user.pk}" if request.user.is_authenticated else f"ip:{request.META.get('REMOTE_ADDR')}"
+        return self.store.take(f"{scope}:{client}", *rate)
+
+    def take_upstream(self, symbols=1):
+        """Whether the provider may be asked for that many symbols now."""
+        if not self.enabled or self.upstream_rate is None:
+            return True
+        return not self.store.take("upstream", *self.upstream_rate, cost=symbols)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process wide limiter configured by settings.FINANCE_RATE_LIMITS."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter.from_settings()
+    return _limiter
+
+
+@receiver(setting_changed)
+def reset_rate_limiter(setting, **kwargs):
+    global _limiter
+    if setting in ("FINANCE_RATE_LIMITS", "CACHES"):
+        _limiter = None
+
+
+class Degraded:
+    """Quotes missed by a request limited to cached ones."""
+
+    def __init__(self):
+        self.missed = False
+
+
+def degraded():
+    """The Degraded state of the current request, None when it may call the provider."""
+    return _degraded.get()
+
+
+@contextmanager
+def cached_quotes_only():
+    state = Degraded()
+    token = _degraded.set(state)
+    try:
+        yield state
+    finally:
+        _degraded.reset(token)
+
+
+def too_many_requests(request, retry_after):
+    response = HttpResponse(f"Too many requests, try again in {math.ceil(retry_after)} seconds !!", status=429)
+    response["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+
+def rate_limited(scope, methods=None, limited_response=too_many_requests, degrade=True):
+    """Limit how often each user calls the view, per settings.FINANCE_RATE_LIMITS[scope].
+
+    Only requests with one of methods count, every one when it is None. Over
+    the limit the view runs with cached quotes only, and limited_response(request,
+    retry_after) replaces what it returned when one of them wasn't cached. Views
+    that may act on some quotes before missing another must pass degrade=False,
+    to be answered limited_response() right away.
+    """
+    def decorator(view):
+        def counts(request):
+            return methods is None or request.method in methods
+
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                retry_after = await sync_to_async(get_rate_limiter().hit)(scope, request) if counts(request) else 0
+                if not retry_after:
+                    return await view(request, *args, **kwargs)
+                if not degrade:
+                    return limited_response(request, retry_after)
+                with cached_quotes_only() as state:
+                    response = await view(request, *args, **kwargs)
+                return limited_response(request, retry_after) if state.missed else response
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                retry_after = get_rate_limiter().hit(scope, request) if counts(request) else 0
+                if not retry_after:
+                    return view(request, *args, **kwargs)
+                if not degrade:
+                    return limited_response(request, retry_after)
+                with cached_quotes_only() as state:
+                    response = view(request, *args, **kwargs)
+                return limited_response(request, retry_after) if state.missed else response
+        return wrapper
+    return decorator
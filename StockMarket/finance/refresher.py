@@ -0,0 +1,112 @@
+import logging
+import time
+from datetime import datetime, time as clock
+
+from django.conf import settings
+
+from .cache import get_quote_cache
+from .helpers import fetch_quotes
+from .models import Holding
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from pytz import timezone as ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Seconds between refreshes while the market is open, keep it below QUOTE_CACHE['TTL']
+    "INTERVAL": 4,
+    # Seconds between refreshes while the market is closed
+    "CLOSED_INTERVAL": 300,
+    # Symbols per provider call
+    "BATCH_SIZE": 100,
+}
+
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
+MARKET_OPEN = clock(9, 30)
+MARKET_CLOSE = clock(16, 0)
+
+
+def is_market_open(now=None):
+    """Whether US equity markets are in their regular session, holidays aside."""
+    now = (now or datetime.now(tz=MARKET_TIMEZONE)).astimezone(MARKET_TIMEZONE)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+class QuoteRefresher:
+    """Keeps the quote cache warm for every symbol somebody holds.
+
+    Each cycle fetches the distinct held symbols in batches and stores them in
+    the quote cache, so request paths find fresh quotes instead of calling
+    the provider themselves.
+    """
+
+    def __init__(self, interval=4, closed_interval=300, batch_size=100, cache=None, fetch_many=fetch_quotes):
+        self.interval = interval
+        self.closed_interval = closed_interval
+        self.batch_size = batch_size
+        self.cache = cache or get_quote_cache()
+        self.fetch_many = fetch_many
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        options = {**DEFAULTS, **getattr(settings, "QUOTE_REFRESH", {})}
+        return cls(
+            interval=overrides.get("interval") or options["INTERVAL"],
+            closed_interval=overrides.get("closed_interval") or options["CLOSED_INTERVAL"],
+            batch_size=overrides.get("batch_size") or options["BATCH_SIZE"],
+        )
+
+    def held_symbols(self):
+        symbols = Holding.objects.filter(shares__gt=0).values_list("stock", flat=True).distinct()
+        return sorted({symbol.upper() for symbol in symbols})
+
+    def refresh(self):
+        """Run one refresh cycle and return what it did."""
+        started = time.time()
+        symbols = self.held_symbols()
+
+        # How old the quotes being replaced were, the staleness readers could have seen
+        ages = [self.cache.peek(symbol)[1] for symbol in symbols]
+        lag = max((age for age in ages if age is not None), default=None)
+
+        batches = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        refreshed = 0
+        for batch in batches:
+            quotes = self.fetch_many(batch)
+            fetched_at = time.time()
+            for symbol, quote in quotes.items():
+                if quote is not None:
+                    self.cache.set(symbol, quote, fetched_at=fetched_at)
+                    refreshed += 1
+
+        report = {
+            "symbols": len(symbols),
+            "refreshed": refreshed,
+            "batches": [len(batch) for batch in batches],
+            "lag": lag,
+            "duration": time.time() - started,
+        }
+        logger.info(
+            "Refreshed %(refreshed)d/%(symbols)d quotes in batches of %(batches)s, took %(duration).3fs, lag %(lag)s",
+            report,
+        )
+        return report
+
+    def next_interval(self, now=None):
+        return self.interval if is_market_open(now) else self.closed_interval
+
+    def run(self, cycles=None, report=None):
+        """Refresh forever, or cycles times, sleeping between cycles according to market hours."""
+        done = 0
+        while cycles is None or done < cycles:
+            started = time.monotonic()
+            result = self.refresh()
+            if report is not None:
+                report(result)
+            done += 1
+            if cycles is not None and done >= cycles:
+                break
+            time.sleep(max(0, self.next_interval() - (time.monotonic() - started)))
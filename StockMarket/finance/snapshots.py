@@ -0,0 +1,101 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .helpers import lookup_many
+from .lots import position_costs
+from .models import Cash, Holding, PortfolioSnapshot
+from .money import money
+
+# Periodic valuation of every portfolio into PortfolioSnapshot rows, which the
+# history endpoint serves without recomputing anything
+
+
+def value_holdings(holdings, prices):
+    """Return (market value, unrealized P&L) of [(stock, shares, cost)] at prices {SYMBOL: price}.
+
+    Holdings that can't be priced are valued at cost, so they add nothing to the P&L.
+    """
+    value = pnl = Decimal(0)
+    for stock, shares, cost in holdings:
+        unit_price = prices.get(stock.upper())
+        if unit_price is None:
+            value += cost
+            continue
+        value += shares * unit_price
+        pnl += shares * unit_price - cost
+    return money(value), money(pnl)
+
+
+def snapshot_portfolios(batch_size=500, now=None):
+    """Append a snapshot of every user's portfolio and bring Cash.net_profit up to date.
+
+    The P&L recorded is the realized one plus the unrealized one of the open
+    positions, costed with the configured lot method.
+
+    Every held symbol is priced once through lookup_many, so quotes come from the
+    quote cache and only misses reach the provider, in batches. Returns the number
+    of snapshots written.
+    """
+    now = now or timezone.now()
+    symbols = Holding.objects.filter(shares__gt=0).values_list('stock', flat=True).distinct()
+    prices = {symbol: quote["price"] for symbol, quote in lookup_many(list(symbols)).items() if quote}
+
+    written = 0
+    cash_rows = (Cash.objects.order_by('my_user_id')
+                 .only('id', 'my_user_id', 'in_hand_money', 'net_profit', 'realized_profit'))
+    last_user_id = None
+    while True:
+        batch = cash_rows if last_user_id is None else cash_rows.filter(my_user_id__gt=last_user_id)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return written
+        last_user_id = batch[-1].my_user_id
+
+        positions = position_costs([cash.my_user_id for cash in batch])
+
+        snapshots, changed = [], []
+        for cash in batch:
+            value, unrealized = value_holdings(positions[cash.my_user_id], prices)
+            pnl = cash.realized_profit + unrealized
+            snapshots.append(PortfolioSnapshot(
+                my_user_id=cash.my_user_id, taken_at=now, cash=cash.in_hand_money, holdings_value=value, pnl=pnl,
+            ))
+            if cash.net_profit != pnl:
+                cash.net_profit = pnl
+                changed.append(cash)
+
+        with transaction.atomic():
+            PortfolioSnapshot.objects.bulk_create(snapshots)
+            Cash.objects.bulk_update(changed, ['net_profit'])
+        written += len(snapshots)
+
+
+def history(user, since=None, until=None, points=200):
+    """[(taken_at, cash, holdings_value, pnl)] of the user's snapshots, at most points of them.
+
+    Longer ranges are split into points equal spans of time, each represented
+    by the last snapshot taken within it.
+    """
+    snapshots = user.snapshots.order_by('taken_at')
+    if since is not None:
+        snapshots = snapshots.filter(taken_at__gte=since)
+    if until is not None:
+        snapshots = snapshots.filter(taken_at__lte=until)
+    rows = snapshots.values_list('taken_at', 'cash', 'holdings_value', 'pnl')
+
+    if snapshots.count() <= points:
+        return list(rows)
+
+    bounds = snapshots.aggregate(first=Min('taken_at'), last=Max('taken_at'))
+    first, span = bounds['first'], (bounds['last'] - bounds['first']) / points
+    if not span:
+        return list(rows)[-points:]
+
+    sampled = {}
+    for row in rows.iterator(chunk_size=2000):
+        bucket = min(int((row[0] - first) / span), points - 1)
+        sampled[bucket] = row
+    return [sampled[bucket] for bucket in sorted(sampled)]
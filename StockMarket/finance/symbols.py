@@ -0,0 +1,201 @@
+import csv
+import difflib
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Local directory of the symbols quotes can be asked for, so that typos are
+# rejected without a round trip to the quote provider.
+# The directory is a CSV file of symbol, name and exchange written by manage.py
+# refresh_symbols and held in memory as sorted tuples: validity is one dict
+# lookup, prefix searches are bisections, fuzzy matches only compare symbols
+# sharing the first letter of the query.
+
+DEFAULTS = {
+    # CSV file of the directory, symbols are not checked while it doesn't exist
+    "PATH": None,
+    # Seconds between two checks of the file for a newer version
+    "CHECK_INTERVAL": 60,
+}
+
+FIELDS = ("symbol", "name", "exchange")
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+class SymbolDirectory:
+    """In-memory index of (symbol, name, exchange) rows."""
+
+    def __init__(self, rows):
+        rows = sorted({row[0].upper(): row for row in rows if row[0]}.items())
+        self.symbols = tuple(symbol for symbol, _ in rows)
+        self.names = tuple(row[1] for _, row in rows)
+        self.exchanges = tuple(row[2] for _, row in rows)
+        self._positions = {symbol: position for position, symbol in enumerate(self.symbols)}
+
+        # (word, position) of every word of every name, for word prefix searches
+        self._words = sorted(
+            (word, position) for position, name in enumerate(self.names)
+            for word in set(_WORD.findall(name.lower()))
+        )
+        self._word_keys = [word for word, _ in self._words]
+
+        self._by_initial = defaultdict(list)
+        for symbol in self.symbols:
+            self._by_initial[symbol[0]].append(symbol)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, newline="") as f:
+            return cls((row["symbol"], row.get("name") or "", row.get("exchange") or "") for row in csv.DictReader(f))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol.upper() in self._positions
+
+    def get(self, symbol):
+        position = self._positions.get(symbol.upper())
+        return None if position is None else self.entry(position)
+
+    def entry(self, position):
+        return {"symbol": self.symbols[position], "name": self.names[position], "exchange": self.exchanges[position]}
+
+    def search(self, query, limit=10):
+        """Up to limit entries matching query: the symbol itself, then symbols and name words
+        starting with it, then symbols close to it for typos."""
+        query = query.strip()
+        if not query or limit < 1:
+            return []
+        found = []
+
+        def add(position):
+            if position not in found:
+                found.append(position)
+            return len(found) >= limit
+
+        symbol = query.upper()
+        if symbol in self._positions and add(self._positions[symbol]):
+            return [self.entry(position) for position in found]
+
+        position = bisect_left(self.symbols, symbol)
+        while position < len(self.symbols) and self.symbols[position].startswith(symbol):
+            if add(position):
+                return [self.entry(position) for position in found]
+            position += 1
+
+        for word in _WORD.findall(query.lower())[:1]:
+            index = bisect_left(self._word_keys, word)
+            while index < len(self._words) and self._word_keys[index].startswith(word):
+                if add(self._words[index][1]):
+                    return [self.entry(position) for position in found]
+                index += 1
+
+        for match in difflib.get_close_matches(symbol, self._by_initial.get(symbol[0], ()), n=limit, cutoff=0.6):
+            if add(self._positions[match]):
+                break
+        return [self.entry(position) for position in found]
+
+
+def write_directory(path, rows):
+    """Atomically replace the directory file with [{symbol, name, exchange}] rows, returning how many."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".csv")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for row in sorted(rows, key=lambda row: row["symbol"]):
+                writer.writerow(row)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return len(rows)
+
+
+class DirectoryLoader:
+    """Keeps the directory read from path, reloading it when the file changes."""
+
+    def __init__(self, path, check_interval=60):
+        self.path = path
+        self.check_interval = check_interval
+        self.directory = None
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The current SymbolDirectory, None while there is no file."""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self.directory
+
+        with self._lock:
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                try:
+                    mtime = os.stat(self.path).st_mtime
+                except OSError:
+                    self.directory, self._mtime = None, None
+                else:
+                    if mtime != self._mtime:
+                        self.directory, self._mtime = SymbolDirectory.load(self.path), mtime
+                self._checked_at = now
+        return self.directory
+
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_directory():
+    """Return the symbol directory configured by settings.SYMBOL_DIRECTORY, None when there is none."""
+    global _loader
+    if _loader is None:
+        with _loader_lock:
+            if _loader is None:
+                options = {**DEFAULTS, **getattr(settings, "SYMBOL_DIRECTORY", {})}
+                _loader = DirectoryLoader(options["PATH"], options["CHECK_INTERVAL"]) if options["PATH"] else False
+    return _loader.get() if _loader else None
+
+
+def is_known(symbol):
+    """Whether quotes may be asked for symbol, always True without a directory."""
+    directory = get_directory()
+    return directory is None or symbol in directory
+
+
+def search(query, limit=10):
+    """Autocomplete entries for query, none without a directory."""
+    directory = get_directory()
+    return directory.search(query, limit) if directory is not None else []
+
+
+def split_known(symbols):
+    """Split symbols into ([known ones], [upper cased unknown ones])."""
+    directory = get_directory()
+    if directory is None:
+        return list(symbols), []
+    known, unknown = [], []
+    for symbol in symbols:
+        if symbol in directory:
+            known.append(symbol)
+        else:
+            unknown.append(symbol.upper())
+    return known, unknown
+
+
+@receiver(setting_changed)
+def reset_directory(setting, **kwargs):
+    global _loader
+    if setting == "SYMBOL_DIRECTORY":
+        _loader = None
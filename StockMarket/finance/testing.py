@@ -0,0 +1,69 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import cache, providers
+from .cache import QuoteCache
+from .providers import LocalProvider
+
+# Fixtures shared by the test suite and the benchmarks
+
+# Tests and benchmarks create throwaway users by the hundred, their passwords are
+# hashed with MD5 rather than spending a fraction of a second on PBKDF2 for each
+FAST_PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+# Minimal stand-ins for the finance templates, which aren't part of the repository, so that
+# tests can render the pages and benchmarks measure the views and not the markup
+STUB_TEMPLATES = {
+    "finance/index.html": "{{ cash }} {{ total }}{% for purchase in purchases %} {{ purchase.stock }} {{ purchase.sum }}{% endfor %}",
+    "finance/quote.html": "{{ message }}",
+    "finance/quoted.html": "{{ symbol }} {{ name }} {{ price }}",
+    "finance/buy.html": "{{ message }}",
+    "finance/sell.html": "{{ message }}{% for stock in stocks %} {{ stock }}{% endfor %}",
+    "finance/addBalance.html": "{{ message }}",
+    "finance/login.html": "",
+    "finance/register.html": "",
+}
+
+STUB_TEMPLATES_SETTINGS = [{
+    'BACKEND': 'finance.instrumentation.TimedTemplates',
+    'DIRS': [],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        'loaders': [('django.template.loaders.locmem.Loader', STUB_TEMPLATES)],
+        'context_processors': [
+            'django.template.context_processors.request',
+            'django.contrib.auth.context_processors.auth',
+            'django.contrib.messages.context_processors.messages',
+        ],
+    },
+}]
+
+
+class stub_quotes:
+    """Context manager serving uncached quotes from a LocalProvider with the given latency."""
+
+    def __init__(self, symbols, latency=0.0, price=100.0):
+        self.provider = LocalProvider({symbol: price for symbol in symbols}, latency=latency)
+
+    def __enter__(self):
+        self._saved = providers._provider, cache._quote_cache
+        providers.set_provider(self.provider)
+        cache.set_quote_cache(QuoteCache(ttl=0, stale_ttl=0))
+        return self.provider
+
+    def __exit__(self, *exc_info):
+        providers.set_provider(self._saved[0])
+        cache.set_quote_cache(self._saved[1])
+
+
+class FastHasherTestRunner(DiscoverRunner):
+    """DiscoverRunner hashing passwords with FAST_PASSWORD_HASHERS while the tests run."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._hashers = override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
+        self._hashers.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._hashers.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1384 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import async_views, cache, helpers, instrumentation, ledger, providers, trading
+from .auth import CashModelBackend
+from .benchmarks import ENDPOINTS, compare_results, measure_queries, percentile, run_benchmark
+from .cache import QuoteCache
+from .holdings import find_mismatches, rebuild_holdings
+from .ledger import compact_ledger, find_archive_mismatches, full_ledger
+from .live import LiveRatesApp, TickHub
+from .lots import position_costs, replay_lots, unrealized_pnl
+from .money import MAX_MONEY
+from .models import ApiToken, Cash, Holding, LimitOrder, Lot, PriceAlert, Purchase
+from .orders import place_orders
+from .trading import BalanceTooLarge, BatchRejected, InsufficientFunds, InsufficientShares, PositionTooLarge
+from .providers import (
+    CircuitOpenError, IEXProvider, LocalProvider, QuoteProviderError, ReplayProvider, RetryBudget, SimulatorProvider,
+)
+from .snapshots import history, snapshot_portfolios
+from .ratelimit import CacheBucketStore, MemoryBucketStore, parse_rate, reset_rate_limiter
+from .refresher import QuoteRefresher, ZoneInfo, is_market_open
+from .symbols import SymbolDirectory, write_directory
+from .testing import STUB_TEMPLATES_SETTINGS, stub_quotes
+from .triggers import TriggerBook, TriggerEngine
+
+
+def make_quote(symbol, price=100.0):
+    return {"name": f"{symbol} Inc.", "price": price, "symbol": symbol.upper()}
+
+
+class QuoteCacheTests(SimpleTestCase):
+
+    def test_fresh_quote_is_served_from_cache(self):
+        cache = QuoteCache(ttl=60)
+        calls = []
+
+        def fetch(symbol):
+            calls.append(symbol)
+            return make_quote(symbol)
+
+        self.assertEqual(cache.get("aapl", fetch)["symbol"], "AAPL")
+        self.assertEqual(cache.get("AAPL", fetch)["symbol"], "AAPL")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_stale_quote_is_served_while_revalidating(self):
+        cache = QuoteCache(ttl=1, stale_ttl=60)
+        cache.set("AAPL", make_quote("AAPL", 1.0), fetched_at=time.time() - 5)
+        refreshed = threading.Event()
+
+        def fetch(symbol):
+            refreshed.set()
+            return make_quote(symbol, 2.0)
+
+        self.assertEqual(cache.get("AAPL", fetch)["price"], 1.0)
+        self.assertTrue(refreshed.wait(5))
+        for _ in range(100):
+            if cache.peek("AAPL")[0]["price"] == 2.0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.peek("AAPL")[0]["price"], 2.0)
+        self.assertEqual(cache.stats()["stale_hits"], 1)
+
+    def test_concurrent_misses_are_coalesced(self):
+        cache = QuoteCache(ttl=60)
+        release = threading.Event()
+        calls = []
+
+        def fetch(symbol):
+            calls.append(symbol)
+            release.wait(5)
+            return make_quote(symbol)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("AAPL", fetch))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        while cache.stats()["coalesced"] < 9:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(result["symbol"] == "AAPL" for result in results))
+
+    def test_failed_lookups_are_not_cached(self):
+        cache = QuoteCache(ttl=60)
+        self.assertIsNone(cache.get("NOPE", lambda symbol: None))
+        self.assertIsNone(cache.peek("NOPE")[0])
+        self.assertEqual(cache.stats()["errors"], 1)
+
+
+    def test_get_many_fetches_all_misses_at_once(self):
+        cache = QuoteCache(ttl=60)
+        cache.set("AAPL", make_quote("AAPL"))
+        batches = []
+
+        def fetch_many(symbols):
+            batches.append(symbols)
+            return {symbol: make_quote(symbol) for symbol in symbols if symbol != "NOPE"}
+
+        quotes = cache.get_many(["aapl", "msft", "goog", "MSFT", "nope"], fetch_many)
+
+        self.assertEqual(batches, [["MSFT", "GOOG", "NOPE"]])
+        self.assertEqual(sorted(quotes), ["AAPL", "GOOG", "MSFT", "NOPE"])
+        self.assertIsNone(quotes["NOPE"])
+        self.assertEqual(cache.stats()["fetches"], 1)
+
+
+def api_quote(symbol, price=100.0):
+    return {"companyName": f"{symbol} Inc.", "latestPrice": price, "symbol": symbol}
+
+
+def api_response(data, status_code=200):
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(str(status_code))
+    return response
+
+
+class StubQuotesMixin:
+    """Serves quotes from stub_quotes() until the end of the test."""
+
+    def serve_quotes(self, symbols, price=100.0):
+        quotes = stub_quotes(symbols, price=price)
+        provider = quotes.__enter__()
+        self.addCleanup(quotes.__exit__, None, None, None)
+        return provider
+
+
+class LookupManyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = QuoteCache(ttl=60)
+        self.provider = IEXProvider("https://iex.test/stable", "token", backoff=0)
+        for patcher in (mock.patch.object(helpers, "get_quote_cache", return_value=self.cache),
+                        mock.patch.object(providers, "_provider", self.provider)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_batch_endpoint_is_chunked(self):
+        symbols = [f"S{i}" for i in range(250)]
+
+        def batch(url, params=None, **kwargs):
+            return api_response({symbol: {"quote": api_quote(symbol)} for symbol in params["symbols"].split(",")})
+
+        with mock.patch.object(self.provider.session, "get", side_effect=batch) as get:
+            quotes = helpers.lookup_many(symbols)
+
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(len(quotes), 250)
+        self.assertEqual(quotes["S42"]["symbol"], "S42")
+
+    def test_falls_back_to_single_fetches(self):
+        def single(url, params=None, **kwargs):
+            if "symbols" in params:
+                raise requests.ConnectionError()
+            return api_response(api_quote(url.split("/stock/")[1].split("/")[0], 5.0))
+
+        self.provider.max_retries = 0
+        with mock.patch.object(self.provider.session, "get", side_effect=single) as get:
+            quotes = helpers.lookup_many(["AAPL", "MSFT"])
+
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(quotes["AAPL"]["price"], 5.0)
+        self.assertEqual(quotes["MSFT"]["price"], 5.0)
+
+
+class ProviderTests(SimpleTestCase):
+
+    def test_unknown_symbol_is_none(self):
+        provider = IEXProvider("https://iex.test/stable", "token")
+        with mock.patch.object(provider.session, "get", return_value=api_response(None, 404)):
+            self.assertIsNone(provider.quote("NOPE"))
+        self.assertFalse(provider.breaker.is_open)
+
+    def test_retries_then_opens_circuit(self):
+        provider = IEXProvider("https://iex.test/stable", "token", max_retries=2, backoff=0,
+                               failure_threshold=3, reset_timeout=60)
+        with mock.patch.object(provider.session, "get", side_effect=requests.Timeout()) as get:
+            with self.assertRaises(QuoteProviderError):
+                provider.quote("AAPL")
+            self.assertEqual(get.call_count, 3)
+            self.assertTrue(provider.breaker.is_open)
+
+            # Further calls fail fast without touching the network
+            with self.assertRaises(CircuitOpenError):
+                provider.quote("AAPL")
+            self.assertEqual(get.call_count, 3)
+
+    def test_async_path_goes_through_httpx(self):
+        calls = []
+
+        def handler(request):
+            calls.append((request.url.path, dict(request.url.params)))
+            if request.url.path.endswith("/batch"):
+                return httpx.Response(503)
+            if "NOPE" in request.url.path:
+                return httpx.Response(404)
+            return httpx.Response(200, json=api_quote(request.url.path.split("/")[-2], 12.5))
+
+        provider = IEXProvider("https://iex.test/stable", "token", max_retries=1, backoff=0,
+                               async_transport=httpx.MockTransport(handler))
+        quotes = async_to_sync(provider.aquotes)(["AAPL", "NOPE"])
+
+        self.assertEqual(quotes, {"AAPL": make_quote("AAPL", Decimal("12.5")), "NOPE": None})
+        # The failing batch is retried once, then the symbols are fetched one by one
+        self.assertEqual([path for path, _ in calls].count("/stable/stock/market/batch"), 2)
+        self.assertEqual(calls[0][1], {"symbols": "AAPL,NOPE", "types": "quote", "token": "token"})
+        self.assertFalse(provider.breaker.is_open)
+
+    def test_retry_budget_bounds_retries(self):
+        budget = RetryBudget(ratio=0.5, reserve=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    @override_settings(QUOTE_PROVIDER={
+        "BACKEND": "finance.providers.LocalProvider",
+        "OPTIONS": {"QUOTES": {"AAPL": {"name": "Apple Inc", "price": 150}}},
+    })
+    def test_local_provider_from_settings(self):
+        provider = providers.get_provider()
+        self.assertIsInstance(provider, LocalProvider)
+        self.assertEqual(helpers.fetch_quote("aapl"), {"name": "Apple Inc", "price": 150.0, "symbol": "AAPL"})
+        self.assertIsNone(helpers.fetch_quote("MSFT"))
+
+    def test_simulator_is_deterministic(self):
+        first = SimulatorProvider(symbols=1000, seed=7, tick=0)
+        second = SimulatorProvider(symbols=1000, seed=7, tick=0)
+        first.advance(50)
+        second.quote("ABCD")
+        second.advance(20)
+        second.quote("ABCD")
+        second.advance(30)
+
+        self.assertEqual(first.quotes(["ABCD", "AAAZ"]), second.quotes(["ABCD", "AAAZ"]))
+        self.assertNotEqual(first.quote("ABCD")["price"], Decimal(100))
+        self.assertIsNone(first.quote("ZZZZ"))
+        self.assertEqual(len(first.symbols), 1000)
+
+    def test_simulator_catches_up_without_replaying_every_tick(self):
+        now = [0.0]
+        idle = SimulatorProvider(symbols=10, seed=3, clock=lambda: now[0])
+        stepped = SimulatorProvider(symbols=10, seed=3, tick=0)
+        for _ in range(100):
+            stepped.advance()
+            stepped.quote("AAAB")
+        stepped.advance(86400 - 100)
+
+        now[0] = 86400.0
+        with mock.patch.object(providers._Walk, "normal", autospec=True, side_effect=providers._Walk.normal) as draws:
+            quote = idle.quote("AAAB")
+        self.assertLessEqual(draws.call_count, providers.WALK_LEVELS)
+        self.assertEqual(quote, stepped.quote("AAAB"))
+
+    def test_replay_serves_frames_as_time_passes(self):
+        now = [0.0]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write('{"at": 0, "quotes": {"AAPL": {"name": "Apple Inc", "price": "150.10"}}}\n')
+            f.write('{"at": 5, "quotes": {"MSFT": {"name": "Microsoft", "price": "300"}}}\n')
+            f.write('{"at": 10, "quotes": {"AAPL": {"name": "Apple Inc", "price": "151"}}}\n')
+        self.addCleanup(os.remove, f.name)
+        provider = ReplayProvider(f.name, speed=2, clock=lambda: now[0])
+
+        self.assertEqual(provider.quote("AAPL")["price"], Decimal("150.10"))
+        self.assertIsNone(provider.quote("MSFT"))
+        now[0] = 3
+        self.assertEqual(provider.quotes(["AAPL", "MSFT"])["MSFT"]["price"], Decimal(300))
+        now[0] = 5
+        self.assertEqual(provider.quote("AAPL")["price"], Decimal(151))
+        now[0] = 6
+        self.assertEqual(provider.quote("AAPL")["price"], Decimal("150.10"))
+        self.assertIsNone(provider.quote("MSFT"))
+
+
+class LiveRatesTests(SimpleTestCase):
+
+    def test_one_upstream_poll_fans_out_to_all_subscribers(self):
+        calls = []
+
+        def fetch_many(symbols):
+            calls.append(sorted(symbols))
+            return {symbol: make_quote(symbol, 10.0 + len(calls)) for symbol in symbols}
+
+        async def scenario():
+            hub = TickHub(interval=0.01, fetch_many=fetch_many)
+            subscriptions = [hub.subscribe({"AAPL", "MSFT"}) for _ in range(1000)]
+            ticks = await subscriptions[0].next(timeout=1)
+            for subscription in subscriptions:
+                hub.unsubscribe(subscription)
+            await asyncio.sleep(0.05)
+            return hub, ticks
+
+        hub, ticks = asyncio.run(scenario())
+
+        self.assertEqual(calls[0], ["AAPL", "MSFT"])
+        self.assertEqual({tick["symbol"] for tick in ticks}, {"AAPL", "MSFT"})
+        self.assertFalse(hub.subscribers)
+        self.assertTrue(hub._task.done())
+
+    def test_slow_subscriber_gets_latest_tick_only(self):
+        async def scenario():
+            hub = TickHub(fetch_many=lambda symbols: {})
+            subscription = hub.subscribe({"AAPL"})
+            for price in (1.0, 2.0, 3.0):
+                hub.publish({"AAPL": make_quote("AAPL", price)})
+            ticks = await subscription.next(timeout=1)
+            hub.unsubscribe(subscription)
+            return subscription, ticks
+
+        subscription, ticks = asyncio.run(scenario())
+
+        self.assertEqual([tick["price"] for tick in ticks], [3.0])
+        self.assertEqual(subscription.dropped, 2)
+
+    def test_stream_requires_login(self):
+        sent = []
+
+        async def scenario():
+            app = LiveRatesApp(django_app=None)
+            scope = {"type": "http", "method": "GET", "path": "/live/", "query_string": b"symbols=AAPL", "headers": []}
+
+            async def send(message):
+                sent.append(message)
+
+            await app(scope, None, send)
+
+        asyncio.run(scenario())
+        self.assertEqual(sent[0]["status"], 401)
+
+    def test_wsgi_explains_where_the_stream_is(self):
+        response = self.client.get("/live/?symbols=AAPL")
+        self.assertContains(response, "StockMarket.asgi:application", status_code=501)
+
+
+@override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS)
+class AsyncViewTests(StubQuotesMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("trader", password="secret-password")
+        self.factory = RequestFactory()
+        self.serve_quotes(["AAPL"], price=10.0)
+
+    def post(self, path, data):
+        request = self.factory.post(path, data)
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        return request
+
+    def test_quote(self):
+        response = async_to_sync(async_views.quote)(self.post("/quote/", {"symbol": "aapl"}))
+        self.assertContains(response, "AAPL AAPL $10.00")
+
+    def test_buy_and_sell(self):
+        response = async_to_sync(async_views.buy)(self.post("/buy/", {"symbol": "AAPL", "shares": 3}))
+        self.assertEqual(response.status_code, 302)
+
+        response = async_to_sync(async_views.sell)(self.post("/sell/", {"symbol": "AAPL", "shares": 5}))
+        self.assertContains(response, "Too many shares !!")
+
+        response = async_to_sync(async_views.sell)(self.post("/sell/", {"symbol": "AAPL", "shares": 2}))
+        self.assertEqual(response.status_code, 302)
+
+        self.user.cash.refresh_from_db()
+        self.assertEqual(self.user.cash.in_hand_money, 10000 - 10)
+        self.assertEqual(sum(self.user.purchases.values_list("shares", flat=True)), 1)
+
+    def test_index(self):
+        trading.buy(self.user, "AAPL", 2, Decimal(10))
+        request = self.factory.get("/")
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        response = async_to_sync(async_views.index)(request)
+        self.assertContains(response, "AAPL $20.00")
+        self.assertIn("ETag", response)
+
+    def test_login_required(self):
+        request = self.factory.get("/quote/")
+        request.user = AnonymousUser()
+        response = async_to_sync(async_views.quote)(request)
+        self.assertEqual(response.status_code, 302)
+
+
+class HoldingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("holder", password="secret-password")
+
+    def trade(self, stock, shares, price):
+        if shares > 0:
+            trading.buy(self.user, stock, shares, price)
+        else:
+            trading.sell(self.user, stock, -shares, price)
+
+    def test_holding_follows_ledger_at_average_cost(self):
+        self.trade("AAPL", 10, 10.0)
+        self.trade("AAPL", 10, 20.0)
+        self.trade("AAPL", -5, 50.0)
+        self.trade("MSFT", 1, 100.0)
+
+        holding = self.user.holdings.get(stock="AAPL")
+        self.assertEqual(holding.shares, 15)
+        self.assertEqual(holding.cost_basis, Decimal("225"))
+        self.assertEqual(self.user.holdings.count(), 2)
+        self.assertEqual(find_mismatches(), [])
+
+    def test_basis_that_does_not_divide_evenly(self):
+        self.trade("AAPL", 1, Decimal(4))
+        self.trade("AAPL", 2, Decimal(3))
+        self.trade("AAPL", -1, Decimal(5))
+
+        self.assertEqual(self.user.holdings.get().cost_basis, Decimal("6.6667"))
+        rebuild_holdings([self.user.id])
+        self.assertEqual(self.user.holdings.get().cost_basis, Decimal("6.6667"))
+
+    def test_rebuild_and_check(self):
+        self.trade("AAPL", 10, 10.0)
+        self.trade("AAPL", -4, 12.0)
+        Holding.objects.filter(my_user=self.user).update(shares=99, cost_basis=0)
+        self.assertEqual(find_mismatches(), [(self.user.id, "AAPL", 6, 99)])
+
+        with self.assertRaises(CommandError):
+            call_command("check_holdings", stdout=StringIO())
+        call_command("check_holdings", "--fix", stdout=StringIO())
+
+        holding = self.user.holdings.get(stock="AAPL")
+        self.assertEqual(holding.shares, 6)
+        self.assertEqual(holding.cost_basis, Decimal("60"))
+        self.assertEqual(rebuild_holdings(), 1)
+
+    def test_migration_backfills_users_without_holdings(self):
+        self.trade("AAPL", 2, Decimal(10))
+        other = User.objects.create_user("upgraded", password="secret-password")
+        for shares, unit_price in ((3, Decimal(4)), (6, Decimal(1)), (-3, Decimal(9))):
+            Purchase.objects.create(my_user=other, stock="MSFT", shares=shares, price=unit_price)
+
+        import_module("finance.migrations.0014_backfill_holdings").backfill_holdings(django_apps, None)
+        holding = other.holdings.get()
+        self.assertEqual((holding.stock, holding.shares, holding.cost_basis), ("MSFT", 6, Decimal(12)))
+        self.assertEqual(Holding.objects.count(), 2)
+        self.assertEqual(find_mismatches(), [])
+
+    def test_money_is_exact(self):
+        for _ in range(3):
+            self.trade("AAPL", 1, providers.parse_quote(api_quote("AAPL", 0.1))["price"])
+        self.trade("AAPL", -3, Decimal("0.2"))
+
+        self.user.cash.refresh_from_db()
+        self.assertEqual(self.user.cash.in_hand_money, Decimal("10000.30"))
+        self.assertEqual(self.user.holdings.get(stock="AAPL").cost_basis, Decimal("0"))
+        self.assertEqual(helpers.usd(Decimal("1234.565")), "$1,234.57")
+
+    @override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS)
+    def test_deposits_that_do_not_fit_are_refused(self):
+        self.client.force_login(self.user)
+        response = self.client.post("/add_balance/", {"add_balance": 10 ** 15})
+        self.assertContains(response, "Invalid amount entered !!")
+
+        trading.deposit(self.user, MAX_MONEY - 10000)
+        with self.assertRaises(BalanceTooLarge):
+            trading.deposit(self.user, 1)
+        response = self.client.post("/add_balance/", {"add_balance": 1})
+        self.assertContains(response, "Your wallet can&#x27;t hold that much cash !!")
+
+        self.user.cash.refresh_from_db()
+        self.assertEqual(self.user.cash.in_hand_money, MAX_MONEY)
+
+    def test_positions_as_large_as_the_cash(self):
+        Cash.objects.filter(my_user=self.user).update(in_hand_money=Decimal(10) ** 11)
+        self.trade("AAPL", 2 * 10 ** 9, Decimal(10))
+        self.assertEqual(self.user.holdings.get().cost_basis, Decimal(2 * 10 ** 10))
+
+        trading.deposit(self.user, MAX_MONEY - Decimal(8 * 10 ** 10))
+        with self.assertRaises(PositionTooLarge):
+            self.trade("AAPL", 99 * 10 ** 9, Decimal(10))
+        with self.assertRaises(BalanceTooLarge):
+            self.trade("AAPL", -10 ** 9, Decimal(10))
+        with stub_quotes(["AAPL"], price=10):
+            results = place_orders(self.user, [
+                {"side": "sell", "symbol": "AAPL", "shares": 10 ** 9},
+                {"side": "buy", "symbol": "AAPL", "shares": 99 * 10 ** 9},
+            ], all_or_nothing=False)
+        self.assertEqual([result["error"] for result in results], [
+            "Your wallet can't hold that much cash !!", "This position would be too large to record !!",
+        ])
+
+        self.user.cash.refresh_from_db()
+        self.assertEqual(self.user.cash.in_hand_money, MAX_MONEY)
+        self.assertEqual(self.user.holdings.get().cost_basis, Decimal(2 * 10 ** 10))
+        self.assertEqual(find_mismatches(), [])
+
+
+class LedgerCompactionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("archivist")
+        old = datetime.now(timezone.utc) - timedelta(days=100)
+        for side, stock, shares, unit_price in (
+            ("buy", "AAPL", 10, 10), ("buy", "MSFT", 3, 20), ("buy", "AAPL", 5, 12), ("sell", "MSFT", 3, 25),
+            ("sell", "AAPL", 8, 15), ("buy", "GOOG", 4, 5),
+        ):
+            getattr(trading, side)(self.user, stock, shares, Decimal(unit_price))
+        self.user.purchases.update(bought_at=old)
+        trading.buy(self.user, "AAPL", 2, Decimal(11))
+
+    def state(self):
+        rebuild_holdings([self.user.id])
+        replay_lots([self.user.id])
+        self.user.cash.refresh_from_db()
+        return (
+            sorted(self.user.holdings.values_list("stock", "shares", "cost_basis")),
+            sorted(self.user.lots.values_list("stock", "shares", "price")),
+            self.user.cash.realized_profit,
+        )
+
+    def test_compaction_keeps_holdings_lots_and_pnl(self):
+        before = self.state()
+        trades = list(full_ledger(self.user.id))
+
+        report = compact_ledger(datetime.now(timezone.utc) - timedelta(days=30))
+
+        # AAPL keeps one row per open lot, closed MSFT a row for its P&L, single row GOOG is left alone
+        self.assertEqual(report, {"users": 1, "rows": 5, "checkpoints": 3})
+        self.assertEqual(self.user.purchases.count(), 5)
+        self.assertEqual(self.user.purchases.filter(checkpoint=True).count(), 3)
+        self.assertEqual(self.state(), before)
+        self.assertEqual(find_archive_mismatches(), [])
+        self.assertEqual(list(full_ledger(self.user.id)), trades)
+
+        self.assertEqual(compact_ledger(datetime.now(timezone.utc) - timedelta(days=30))["rows"], 0)
+
+    def test_archives_are_read_lazily_and_in_id_order(self):
+        user = User.objects.create_user("lazy")
+        old = datetime.now(timezone.utc) - timedelta(days=100)
+        trading.buy(user, "AAPL", 2, Decimal(10))
+        trading.buy(user, "MSFT", 2, Decimal(10))
+        trading.sell(user, "AAPL", 2, Decimal(12))
+        user.purchases.update(bought_at=old)
+        compact_ledger(old + timedelta(days=1), [user.id])
+        trading.sell(user, "MSFT", 2, Decimal(12))
+        user.purchases.filter(checkpoint=False).update(bought_at=old + timedelta(days=2))
+        compact_ledger(old + timedelta(days=3), [user.id])
+
+        # MSFT, left alone by the first run, overlaps the AAPL archive
+        self.assertEqual(user.ledger_archives.count(), 2)
+        rows = list(ledger.decode_rows(ledger.encode_rows(full_ledger(user.id)), chunk_size=16))
+        self.assertEqual([row[1:3] for row in rows], [("AAPL", 2), ("MSFT", 2), ("AAPL", -2), ("MSFT", -2)])
+        with self.assertNumQueries(2):
+            self.assertEqual(len(list(ledger.archived_rows(user.id, since=old + timedelta(days=1)))), 2)
+
+    def test_export(self):
+        call_command("compact_ledger", "--days", "30", "--verify", stdout=StringIO())
+        out = StringIO()
+        call_command("export_ledger", "archivist", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "id,symbol,shares,price,at,realized_pnl")
+        self.assertEqual([line.split(",")[1:3] for line in lines[1:]], [
+            ["AAPL", "10"], ["MSFT", "3"], ["AAPL", "5"], ["MSFT", "-3"], ["AAPL", "-8"], ["GOOG", "4"], ["AAPL", "2"],
+        ])
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("exporter", password="secret-password")
+        for stock, shares in (("AAPL", 10), ("MSFT", 5), ("AAPL", 3)):
+            trading.buy(self.user, stock, shares, Decimal(10))
+        purchases = list(self.user.purchases.order_by("id"))
+        for purchase, day in zip(purchases, (1, 15, 28)):
+            self.user.purchases.filter(id=purchase.id).update(bought_at=datetime(2024, 2, day, tzinfo=timezone.utc))
+        self.client.force_login(self.user)
+
+    def test_csv_with_date_range(self):
+        response = self.client.get("/export/", {"since": "2024-02-10", "until": "2024-02-28"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="exporter-trades.csv"', response["Content-Disposition"])
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,symbol,shares,price,at,realized_pnl")
+        self.assertEqual([line.split(",")[1:3] for line in lines[1:]], [["MSFT", "5"]])
+
+    def test_gzipped_json(self):
+        auth = {"HTTP_AUTHORIZATION": "Token " + ApiToken.for_user(self.user).key}
+        response = self.client.get("/api/v1/ledger/export/", {"format": "json", "gzip": "1"}, **auth)
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        data = json.loads(gzip.decompress(b"".join(response.streaming_content)))
+        self.assertEqual([row["symbol"] for row in data["results"]], ["AAPL", "MSFT", "AAPL"])
+        self.assertEqual(data["results"][0]["price"], "10.0000")
+
+        self.assertEqual(self.client.get("/api/v1/ledger/export/", {"format": "xml"}, **auth).status_code, 400)
+        self.assertEqual(self.client.get("/export/", {"since": "yesterday"}).status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("export_ledger", "exporter", "--format", "json", "--since", "2024-02-01", stdout=out)
+        self.assertEqual([row["shares"] for row in json.loads(out.getvalue())["results"]], [10, 5, 3])
+
+
+class LotTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("lots", password="secret-password")
+
+    def trade_history(self):
+        trading.buy(self.user, "AAPL", 10, Decimal(10))
+        trading.buy(self.user, "AAPL", 10, Decimal(20))
+        trading.buy(self.user, "MSFT", 5, Decimal(100))
+        trading.sell(self.user, "AAPL", 15, Decimal(30))
+        trading.sell(self.user, "AAPL", 2, Decimal(5))
+
+    def state(self):
+        self.user.cash.refresh_from_db()
+        return (
+            list(self.user.purchases.order_by("id").values_list("realized_pnl", flat=True)),
+            list(self.user.lots.order_by("id").values_list("stock", "shares", "price")),
+            self.user.cash.realized_profit,
+        )
+
+    def test_fifo(self):
+        self.trade_history()
+
+        realized, lots, total = self.state()
+        # 10 @ 10 and 5 @ 20 sold at 30, then 2 @ 20 sold at 5
+        self.assertEqual(realized, [None, None, None, Decimal(250), Decimal(-30)])
+        self.assertEqual(lots, [("AAPL", 3, Decimal(20)), ("MSFT", 5, Decimal(100))])
+        self.assertEqual(total, Decimal(220))
+
+        pnl, unrealized = unrealized_pnl(position_costs([self.user.id])[self.user.id], {"AAPL": Decimal(25)})
+        self.assertEqual((pnl, unrealized), ({"AAPL": Decimal(15)}, Decimal(15)))
+
+        # Replaying the ledger gives the same lots and P&L
+        Lot.objects.all().delete()
+        Purchase.objects.update(realized_pnl=None)
+        replay_lots()
+        self.assertEqual(self.state(), (realized, lots, total))
+
+    @override_settings(FINANCE_LOT_METHOD="average")
+    def test_average_cost(self):
+        self.trade_history()
+
+        realized, _, total = self.state()
+        # Average cost 15, still 15 for the shares left
+        self.assertEqual(realized, [None, None, None, Decimal(225), Decimal(-20)])
+        self.assertEqual(total, Decimal(205))
+
+        replay_lots()
+        self.assertEqual(self.state()[2], total)
+
+    def test_batch_matches_single_trades(self):
+        self.trade_history()
+        expected = self.state()
+
+        other = User.objects.create_user("basket", password="secret-password")
+        trading.execute_batch(other, [
+            {"side": "buy", "symbol": "AAPL", "shares": 10},
+            {"side": "buy", "symbol": "MSFT", "shares": 5},
+        ], {"AAPL": Decimal(10), "MSFT": Decimal(100)})
+        trading.execute_batch(other, [
+            {"side": "buy", "symbol": "AAPL", "shares": 10},
+            {"side": "sell", "symbol": "AAPL", "shares": 15},
+        ], {"AAPL": Decimal(20)})
+        Purchase.objects.filter(my_user=other, shares=-15).update(price=Decimal(30))
+        trading.execute_batch(other, [{"side": "sell", "symbol": "AAPL", "shares": 2}], {"AAPL": Decimal(5)})
+
+        self.user = other
+        realized, lots, total = self.state()
+        # The first batch sold at 20 rather than 30
+        self.assertEqual(realized, [None, None, None, Decimal(100), Decimal(-30)])
+        self.assertEqual(sorted(lots), expected[1])
+        self.assertEqual(total, Decimal(70))
+
+
+class TradeConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("racer", password="secret-password")
+
+    def race(self, *trades, attempts=40):
+        """Submit trades in turn from many threads at once, return how many went through."""
+        start = threading.Barrier(attempts)
+        outcomes = []
+
+        def submit(trade):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        trade(self.user, "AAPL", 1, 1000)
+                        outcomes.append(True)
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting, try again
+                        time.sleep(0.001)
+                    except (InsufficientFunds, InsufficientShares):
+                        outcomes.append(False)
+                        return
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(trades[n % len(trades)],)) for n in range(attempts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(outcomes), attempts)
+        return sum(outcomes)
+
+    def assertInvariants(self, cash, shares):
+        self.assertEqual(Cash.objects.get(my_user=self.user).in_hand_money, cash)
+        self.assertEqual(Holding.objects.get(my_user=self.user, stock="AAPL").shares, shares)
+        self.assertEqual(sum(Purchase.objects.filter(my_user=self.user).values_list("shares", flat=True)), shares)
+
+    def test_parallel_buys_and_sells_never_overspend_or_oversell(self):
+        # 10000 of cash only pays for 10 shares at 1000
+        self.assertEqual(self.race(trading.buy), 10)
+        self.assertInvariants(cash=0, shares=10)
+
+        self.assertEqual(self.race(trading.sell), 10)
+        self.assertInvariants(cash=10000, shares=0)
+
+    def test_parallel_buys_and_sells_together(self):
+        trading.buy(self.user, "AAPL", 5, 1000)
+        self.race(trading.buy, trading.sell)
+
+        shares = Holding.objects.get(my_user=self.user, stock="AAPL").shares
+        self.assertTrue(0 <= shares <= 10)
+        self.assertInvariants(cash=10000 - 1000 * shares, shares=shares)
+
+
+@override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS)
+class QueryBudgetTests(StubQuotesMixin, TestCase):
+    """Pin the number of queries the finance views make so N+1s fail the build."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("budget", password="secret-password")
+        self.client.force_login(self.user)
+        symbols = ["S%d" % i for i in range(20)]
+        self.serve_quotes(symbols, price=10)
+        for symbol in symbols:
+            trading.buy(self.user, symbol, 2, Decimal(10))
+
+    def test_index(self):
+        with self.assertNumQueries(4):
+            response = self.client.get("/")
+        self.assertContains(response, "S19")
+
+    def test_buy(self):
+        with self.assertNumQueries(8):
+            response = self.client.post("/buy/", {"symbol": "S3", "shares": 1})
+        self.assertEqual(response.status_code, 302)
+
+    def test_sell(self):
+        # Cash and the holding are locked, in that order, before they are changed
+        with self.assertNumQueries(12):
+            response = self.client.post("/sell/", {"symbol": "S3", "shares": 1})
+        self.assertEqual(response.status_code, 302)
+
+    def test_ledger_queries_use_indexes(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("Query plans are checked on SQLite only")
+        plan = self.user.purchases.filter(stock="S3").explain()
+        self.assertIn("purchase_user_stock_idx", plan)
+        plan = self.user.holdings.filter(stock="S3").explain()
+        self.assertIn("INDEX", plan)
+
+
+@override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS)
+class PortfolioPageTests(TestCase):
+
+    def setUp(self):
+        caches["default"].clear()
+        self.user = User.objects.create_user("pages", password="secret-password")
+        self.client.force_login(self.user)
+        saved = providers._provider, cache._quote_cache
+        self.addCleanup(lambda: (providers.set_provider(saved[0]), cache.set_quote_cache(saved[1])))
+        providers.set_provider(LocalProvider({"AAPL": 10.0, "MSFT": 20.0}))
+        # One price epoch for the whole test
+        cache.set_quote_cache(QuoteCache(ttl=10 ** 9))
+        trading.buy(self.user, "AAPL", 2, Decimal(10))
+
+    def test_repeat_views_are_served_from_the_cache(self):
+        first = self.client.get("/")
+        self.assertContains(first, "AAPL $20.00")
+        self.assertIn("private", first["Cache-Control"])
+
+        # Session and user only, no holdings, cash nor rendering
+        with self.assertNumQueries(2):
+            second = self.client.get("/")
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_other_sessions_get_their_own_page(self):
+        self.client.get("/")
+        other = Client()
+        other.force_login(self.user)
+        with self.assertNumQueries(4):
+            other.get("/")
+        self.assertNotEqual(other.cookies["csrftoken"].value, self.client.cookies["csrftoken"].value)
+
+    def test_trades_and_deposits_invalidate_the_page(self):
+        etag = self.client.get("/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/buy/", {"symbol": "MSFT", "shares": 1})
+        # The flash message is shown once and not cached
+        self.assertContains(self.client.get("/"), "MSFT $20.00")
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            trading.deposit(self.user, 5)
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "$10,005.00")
+
+    @override_settings(PORTFOLIO_CACHE={"ENABLED": False})
+    def test_disabled(self):
+        etag = self.client.get("/")["ETag"]
+        with self.assertNumQueries(4):
+            response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+DIRECTORY_ROWS = [
+    {"symbol": "AAPL", "name": "Apple Inc.", "exchange": "NASDAQ"},
+    {"symbol": "AAP", "name": "Advance Auto Parts Inc.", "exchange": "NYSE"},
+    {"symbol": "MSFT", "name": "Microsoft Corporation", "exchange": "NASDAQ"},
+    {"symbol": "AMZN", "name": "Amazon.com Inc.", "exchange": "NASDAQ"},
+]
+
+
+class SymbolDirectoryTests(StubQuotesMixin, TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "symbols.csv")
+        write_directory(self.path, DIRECTORY_ROWS)
+
+        settings = override_settings(SYMBOL_DIRECTORY={"PATH": self.path}, TEMPLATES=STUB_TEMPLATES_SETTINGS)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.provider = self.serve_quotes(["AAPL", "MSFT", "XYZ"], price=10)
+
+    def test_search(self):
+        directory = SymbolDirectory.load(self.path)
+        self.assertEqual(len(directory), 4)
+        self.assertIn("msft", directory)
+        self.assertNotIn("XYZ", directory)
+        self.assertEqual([entry["symbol"] for entry in directory.search("aap")], ["AAP", "AAPL"])
+        self.assertEqual([entry["symbol"] for entry in directory.search("a", limit=2)], ["AAP", "AAPL"])
+        self.assertEqual(directory.search("micro"), [DIRECTORY_ROWS[2]])
+        # Typos still find the symbol
+        self.assertEqual([entry["symbol"] for entry in directory.search("MSTF")], ["MSFT"])
+        self.assertEqual(directory.search(" "), [])
+
+    def test_unknown_symbols_never_reach_the_provider(self):
+        with mock.patch.object(self.provider, "quote", wraps=self.provider.quote) as quote, \
+                mock.patch.object(self.provider, "quotes", wraps=self.provider.quotes) as quotes:
+            self.assertIsNone(helpers.lookup("XYZ"))
+            self.assertEqual(helpers.lookup_many(["xyz", "MSFT"]), {"XYZ": None, "MSFT": mock.ANY})
+        quote.assert_not_called()
+        quotes.assert_called_once_with(["MSFT"])
+
+        user = User.objects.create_user("symbols", password="secret-password")
+        self.client.force_login(user)
+        with self.assertNumQueries(2):
+            response = self.client.post("/sell/", {"symbol": "XYZ", "shares": 1})
+        self.assertContains(response, "Invalid Symbol !!")
+
+    def test_autocomplete(self):
+        user = User.objects.create_user("symbols", password="secret-password")
+        self.client.force_login(user)
+        response = self.client.get("/symbols/", {"q": "amaz"})
+        self.assertEqual(response.json(), {"symbols": [DIRECTORY_ROWS[3]]})
+
+        token = ApiToken.for_user(user).key
+        response = self.client.get("/api/v1/symbols/", {"q": "a", "limit": 1}, HTTP_AUTHORIZATION=f"Token {token}")
+        self.assertEqual(response.json(), {"symbols": [DIRECTORY_ROWS[1]]})
+
+    def test_refresh_symbols(self):
+        out = StringIO()
+        call_command("refresh_symbols", stdout=out)
+        self.assertIn("Wrote 3 symbols", out.getvalue())
+        self.assertEqual(SymbolDirectory.load(self.path).symbols, ("AAPL", "MSFT", "XYZ"))
+
+        with self.assertRaises(CommandError):
+            call_command("refresh_symbols", "--from", self.path + ".missing")
+
+
+@override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS, FINANCE_RATE_LIMITS={
+    "RATES": {"quote": "1/m", "buy": "1/m"}, "USER_RATES": {"vip": {"quote": None}}, "UPSTREAM_RATE": "3/m",
+})
+class RateLimitTests(StubQuotesMixin, TestCase):
+
+    def setUp(self):
+        # Fresh buckets for every test
+        reset_rate_limiter("FINANCE_RATE_LIMITS")
+        self.user = User.objects.create_user("limited", password="secret-password")
+        self.client.force_login(self.user)
+        self.provider = self.serve_quotes(["AAPL", "MSFT", "GOOG", "AMZN"], price=10)
+
+    def test_token_bucket(self):
+        self.assertEqual(parse_rate("30/m"), (30, 60))
+        with self.assertRaises(ValueError):
+            parse_rate("30 a minute")
+
+        store = MemoryBucketStore()
+        self.assertEqual([store.take("key", 3, 60) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(store.take("key", 3, 60), 20, delta=1)
+        self.assertEqual(store.take("other", 3, 60), 0)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                               "limits": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "limits"}})
+    def test_buckets_are_shared_through_the_cache(self):
+        first, second = CacheBucketStore("limits"), CacheBucketStore("limits")
+        self.assertEqual(first.take("key", 2, 60), 0)
+        self.assertEqual(second.take("key", 2, 60), 0)
+        self.assertGreater(first.take("key", 2, 60), 0)
+
+    def test_limited_requests_are_served_cached_quotes(self):
+        with mock.patch.object(self.provider, "quote", wraps=self.provider.quote) as quote:
+            self.assertContains(self.client.post("/quote/", {"symbol": "AAPL"}), "$10.00")
+            # Over the limit, the quote cached by the first request is served
+            self.assertContains(self.client.post("/quote/", {"symbol": "AAPL"}), "$10.00")
+            self.assertEqual(quote.call_count, 1)
+
+            response = self.client.post("/quote/", {"symbol": "MSFT"})
+            self.assertEqual(response.status_code, 429)
+            self.assertGreater(int(response["Retry-After"]), 0)
+            self.assertEqual(quote.call_count, 1)
+
+        # Other scopes and users have their own buckets
+        self.assertEqual(self.client.post("/buy/", {"symbol": "MSFT", "shares": 1}).status_code, 302)
+        self.client.force_login(User.objects.create_user("vip"))
+        for _ in range(3):
+            self.assertContains(self.client.post("/quote/", {"symbol": "GOOG"}), "$10.00")
+
+    def test_api(self):
+        headers = {"HTTP_AUTHORIZATION": f"Token {ApiToken.for_user(self.user).key}"}
+        self.assertEqual(self.client.get("/api/v1/quote/AAPL/", **headers).status_code, 200)
+        response = self.client.get("/api/v1/quote/MSFT/", **headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()["error"], "Too many requests")
+
+    def test_upstream_quota(self):
+        self.assertIsNotNone(helpers.lookup("AAPL"))
+        self.assertEqual(set(helpers.lookup_many(["MSFT", "GOOG"])), {"MSFT", "GOOG"})
+        # Out of quota, the provider isn't asked and the last price is served while there is one
+        with mock.patch.object(self.provider, "quote", wraps=self.provider.quote) as quote:
+            self.assertIsNone(helpers.lookup("AMZN"))
+            self.assertEqual(helpers.lookup("AAPL")["price"], 10)
+        quote.assert_not_called()
+
+
+class ApiTests(StubQuotesMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("api", password="secret-password")
+        self.serve_quotes(["AAPL", "MSFT"], price=10)
+
+        response = self.client.post("/api/v1/token/", {"username": "api", "password": "secret-password"},
+                                    content_type="application/json")
+        self.auth = {"HTTP_AUTHORIZATION": "Token " + response.json()["token"]}
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get("/api/v1/portfolio/").status_code, 401)
+        self.assertEqual(self.client.get("/api/v1/portfolio/", HTTP_AUTHORIZATION="Token nope").status_code, 401)
+
+    def test_trade_and_portfolio(self):
+        response = self.client.post("/api/v1/buy/", {"symbol": "AAPL", "shares": 3},
+                                    content_type="application/json", **self.auth)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["cash"], "9970.00")
+
+        response = self.client.post("/api/v1/sell/", {"symbol": "AAPL", "shares": 5}, **self.auth)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["error"], "Too many shares !!")
+
+        response = self.client.post("/api/v1/balance/", {"amount": 30}, content_type="application/json", **self.auth)
+        self.assertEqual(response.json(), {"cash": "10000.00"})
+        response = self.client.post("/api/v1/balance/", {"amount": 10 ** 15}, content_type="application/json",
+                                    **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/api/v1/portfolio/", **self.auth)
+        self.assertEqual(response.json()["total"], "10030.0000")
+        self.assertEqual(response.json()["holdings"][0]["shares"], 3)
+
+        # Unchanged portfolio is not sent again
+        response = self.client.get("/api/v1/portfolio/", HTTP_IF_NONE_MATCH=response["ETag"], **self.auth)
+        self.assertEqual(response.status_code, 304)
+
+    def test_quotes(self):
+        response = self.client.get("/api/v1/quotes/?symbols=aapl,NOPE", **self.auth)
+        self.assertEqual(response.json()["quotes"]["AAPL"]["price"], "10.0000")
+        self.assertIsNone(response.json()["quotes"]["NOPE"])
+        self.assertEqual(self.client.get("/api/v1/quote/NOPE/", **self.auth).status_code, 404)
+
+    def test_ledger_pagination(self):
+        for _ in range(5):
+            trading.buy(self.user, "MSFT", 1, Decimal(10))
+
+        first = self.client.get("/api/v1/ledger/?limit=3", **self.auth).json()
+        self.assertEqual(len(first["results"]), 3)
+        second = self.client.get(f"/api/v1/ledger/?limit=3&cursor={first['next']}", **self.auth).json()
+        self.assertEqual(len(second["results"]), 2)
+        self.assertIsNone(second["next"])
+
+
+class QuoteRefresherTests(TestCase):
+
+    def test_refreshes_held_symbols_in_batches(self):
+        for name, symbols in (("one", ["AAPL", "MSFT"]), ("two", ["MSFT", "GOOG"])):
+            user = User.objects.create_user(name)
+            for symbol in symbols:
+                trading.buy(user, symbol, 1, Decimal(1))
+        trading.sell(user, "GOOG", 1, Decimal(1))
+
+        cache = QuoteCache(ttl=60)
+        cache.set("AAPL", make_quote("AAPL", 1.0), fetched_at=time.time() - 30)
+        batches = []
+
+        def fetch_many(symbols):
+            batches.append(symbols)
+            return {symbol: make_quote(symbol, 2.0) for symbol in symbols}
+
+        report = QuoteRefresher(batch_size=1, cache=cache, fetch_many=fetch_many).refresh()
+
+        self.assertEqual(batches, [["AAPL"], ["MSFT"]])
+        self.assertEqual(report["batches"], [1, 1])
+        self.assertGreaterEqual(report["lag"], 30)
+        self.assertEqual(cache.get("AAPL", None)["price"], 2.0)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_market_hours(self):
+        new_york = ZoneInfo("America/New_York")
+        self.assertTrue(is_market_open(datetime(2026, 10, 19, 10, 0, tzinfo=new_york)))
+        self.assertFalse(is_market_open(datetime(2026, 10, 19, 16, 0, tzinfo=new_york)))
+        self.assertFalse(is_market_open(datetime(2026, 10, 18, 12, 0, tzinfo=new_york)))
+
+    @override_settings(CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "quotes": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "quotes"},
+    })
+    def test_web_workers_see_quotes_refreshed_elsewhere(self):
+        web, worker = QuoteCache(ttl=5, backend="quotes"), QuoteCache(ttl=5, backend="quotes")
+        web.set("AAPL", make_quote("AAPL", 1.0), fetched_at=time.time() - 10)
+        worker.set("AAPL", make_quote("AAPL", 2.0))
+        web._entries["AAPL"] = (make_quote("AAPL", 1.0), time.time() - 10)
+
+        self.assertEqual(web.get("AAPL", None)["price"], 2.0)
+
+
+class BatchOrderTests(StubQuotesMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("desk", password="secret-password")
+        trading.buy(self.user, "AAPL", 10, Decimal(10))
+        self.serve_quotes(["AAPL", "MSFT"], price=20)
+
+    def test_orders_run_in_sequence(self):
+        results = place_orders(self.user, [
+            {"side": "sell", "symbol": "aapl", "shares": 4},
+            {"side": "buy", "symbol": "MSFT", "shares": "2"},
+            {"side": "buy", "symbol": "AAPL", "shares": 1},
+        ])
+
+        self.assertEqual([result["status"] for result in results], ["filled"] * 3)
+        self.assertEqual(Cash.objects.get(my_user=self.user).in_hand_money, Decimal(9900 + 80 - 40 - 20))
+        holding = self.user.holdings.get(stock="AAPL")
+        self.assertEqual((holding.shares, holding.cost_basis), (7, Decimal(80)))
+        self.assertEqual(find_mismatches(), [])
+
+    def test_all_or_nothing(self):
+        orders = [
+            {"side": "buy", "symbol": "MSFT", "shares": 1},
+            {"side": "sell", "symbol": "AAPL", "shares": 11},
+            {"side": "buy", "symbol": "NOPE", "shares": 1},
+        ]
+        with self.assertRaises(BatchRejected) as rejected:
+            place_orders(self.user, orders)
+        self.assertEqual(
+            [result["error"] for result in rejected.exception.results],
+            [None, "Too many shares !!", "Invalid Symbol !!"],
+        )
+        self.assertEqual(self.user.purchases.count(), 1)
+
+        results = place_orders(self.user, orders + [{"side": "hold", "symbol": "AAPL", "shares": 1}], all_or_nothing=False)
+        self.assertEqual([result["status"] for result in results], ["filled", "rejected", "rejected", "rejected"])
+        self.assertEqual(self.user.purchases.count(), 2)
+        self.assertEqual(find_mismatches(), [])
+
+    def test_symbols_are_stored_upper_case(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post("/buy/", {"symbol": "msft", "shares": 2}).status_code, 302)
+        self.assertEqual(self.user.holdings.get(stock="MSFT").shares, 2)
+        self.assertEqual(self.user.lots.get(stock="MSFT").shares, 2)
+
+        results = place_orders(self.user, [{"side": "sell", "symbol": "MSFT", "shares": 2}])
+        self.assertEqual(results[0]["status"], "filled")
+
+        # Rows written in lower case before trades were normalized are merged by the migration
+        Purchase.objects.create(my_user=self.user, stock="aapl", shares=1, price=Decimal(10))
+        Holding.objects.create(my_user=self.user, stock="aapl", shares=1, cost_basis=Decimal(10))
+        import_module("finance.migrations.0013_upper_case_symbols").upper_case_symbols(django_apps, None)
+        self.assertEqual(list(self.user.holdings.order_by("stock").values_list("stock", "shares")), [("AAPL", 11), ("MSFT", 0)])
+        self.assertEqual(find_mismatches(), [])
+
+    def test_api_and_csv_import(self):
+        self.client.force_login(self.user)
+        auth = {"HTTP_AUTHORIZATION": "Token " + ApiToken.for_user(self.user).key}
+        response = self.client.post("/api/v1/orders/", {
+            "orders": [{"side": "buy", "symbol": "MSFT", "shares": 1}, {"side": "sell", "symbol": "MSFT", "shares": 5}],
+        }, content_type="application/json", **auth)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["results"][1]["error"], "Too many shares !!")
+
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write("Side,Symbol,Shares\n" + "buy,MSFT,1\n" * 50 + "sell,AAPL,3\n")
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        with self.assertNumQueries(12):
+            call_command("import_orders", "desk", f.name, stdout=out)
+        self.assertIn("Filled 51 of 51 orders", out.getvalue())
+        self.assertEqual(self.user.holdings.get(stock="MSFT").shares, 50)
+
+
+class TriggerTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("limits", password="secret-password")
+        self.provider = LocalProvider({"AAPL": 100, "MSFT": 100})
+        self.engine = TriggerEngine(fetch_many=self.provider.quotes)
+
+    def order(self, side, shares, limit_price, stock="AAPL"):
+        return LimitOrder.objects.create(my_user=self.user, side=side, stock=stock, shares=shares, limit_price=limit_price)
+
+    def test_book_pops_crossed_triggers_only(self):
+        book = TriggerBook()
+        book.extend([
+            ("AAPL", Decimal(90), False, "order", 1),
+            ("AAPL", Decimal(95), False, "order", 2),
+            ("AAPL", Decimal(110), True, "order", 3),
+        ])
+        book.add("AAPL", Decimal(105), True, "alert", 4)
+
+        self.assertEqual(book.crossed("AAPL", Decimal(100)), [])
+        self.assertEqual(book.crossed("AAPL", Decimal(94)), [("order", 2)])
+        self.assertEqual(book.crossed("AAPL", Decimal(120)), [("alert", 4), ("order", 3)])
+        self.assertEqual(book.crossed("MSFT", Decimal(1)), [])
+        self.assertEqual(len(book), 1)
+
+    def test_engine_fills_through_trading(self):
+        buy = self.order("buy", 10, Decimal(95))
+        sell = self.order("sell", 5, Decimal(120), stock="MSFT")
+        cancelled = self.order("buy", 1, Decimal(99))
+        alert = PriceAlert.objects.create(my_user=self.user, stock="AAPL", direction="below", price=Decimal(96))
+
+        self.assertEqual(self.engine.cycle(), {"orders": [], "alerts": []})
+        LimitOrder.objects.filter(id=cancelled.id).update(status=LimitOrder.CANCELLED)
+
+        self.provider.set_price("AAPL", 94)
+        self.provider.set_price("MSFT", 130)
+        fired = self.engine.cycle()
+
+        self.assertEqual([order.id for order in fired["orders"]], [buy.id, sell.id])
+        self.assertEqual(fired["alerts"], [alert.id])
+        buy.refresh_from_db()
+        sell.refresh_from_db()
+        self.assertEqual((buy.status, buy.purchase.price, buy.purchase.shares), ("filled", Decimal(94), 10))
+        self.assertEqual((sell.status, sell.error), ("rejected", "You don't have this stock !!"))
+        self.assertEqual(self.user.lots.get().shares, 10)
+        self.assertEqual(PriceAlert.objects.get().triggered_price, Decimal(94))
+        self.assertEqual(LimitOrder.objects.get(id=cancelled.id).status, "cancelled")
+        self.assertEqual(len(self.engine.book), 0)
+
+    def test_sells_holdings_bought_in_lower_case(self):
+        self.client.force_login(self.user)
+        with stub_quotes(["MSFT"]):
+            self.client.post("/buy/", {"symbol": "msft", "shares": 5})
+            response = self.client.post("/api/v1/limit-orders/", {
+                "side": "sell", "symbol": "msft", "shares": 5, "limit_price": "120",
+            }, content_type="application/json", HTTP_AUTHORIZATION="Token " + ApiToken.for_user(self.user).key)
+        self.assertEqual(response.status_code, 201)
+
+        self.provider.set_price("MSFT", 130)
+        self.engine.cycle()
+        order = LimitOrder.objects.get()
+        self.assertEqual((order.status, order.error, order.purchase.price), ("filled", "", Decimal(130)))
+        self.assertEqual(self.user.holdings.get(stock="MSFT").shares, 0)
+
+    def test_sync_catches_late_commits_and_drops_closed_triggers(self):
+        engine = TriggerEngine(fetch_many=self.provider.quotes, reload_interval=3600)
+        first = self.order("buy", 1, Decimal(90))
+        self.assertEqual(engine.sync(), 1)
+
+        # Created before the last sync but committed after it
+        late = self.order("buy", 1, Decimal(91))
+        LimitOrder.objects.filter(id=late.id).update(created_at=datetime.now(timezone.utc) - timedelta(seconds=30))
+        self.assertEqual(engine.sync(), 1)
+        self.assertEqual(engine.sync(), 0)
+
+        PriceAlert.objects.create(my_user=self.user, stock="AAPL", direction="below", price=Decimal(95))
+        engine.sync()
+        PriceAlert.objects.all().delete()
+        self.assertEqual(engine.on_tick({"AAPL": {"price": Decimal(94)}}), {"orders": [], "alerts": []})
+
+        LimitOrder.objects.filter(id=first.id).update(status=LimitOrder.CANCELLED)
+        self.assertEqual(engine.reload(), 1)
+        self.assertEqual(len(engine.book), 1)
+
+    def test_command(self):
+        order = self.order("buy", 2, Decimal(150))
+        PriceAlert.objects.create(my_user=self.user, stock="AAPL", direction="above", price=Decimal(50))
+        out = StringIO()
+        with stub_quotes(["AAPL"]):
+            call_command("run_triggers", "--once", stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [f"order {order.id} filled: buy 2 AAPL", "1 alerts fired"])
+
+    def test_api(self):
+        auth = {"HTTP_AUTHORIZATION": "Token " + ApiToken.for_user(self.user).key}
+        with stub_quotes(["AAPL"]):
+            response = self.client.post("/api/v1/limit-orders/", {
+                "side": "buy", "symbol": "aapl", "shares": 2, "limit_price": "90.5",
+            }, content_type="application/json", **auth)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()["limit_price"], "90.5000")
+
+            response = self.client.post("/api/v1/alerts/", {"symbol": "NOPE", "direction": "above", "price": 1},
+                                        content_type="application/json", **auth)
+            self.assertEqual(response.status_code, 404)
+
+        order_id = LimitOrder.objects.get().id
+        self.assertEqual(self.client.delete(f"/api/v1/limit-orders/{order_id}/", **auth).json()["status"], "cancelled")
+        self.assertEqual(self.client.delete(f"/api/v1/limit-orders/{order_id}/", **auth).status_code, 404)
+        self.assertEqual(self.client.get("/api/v1/limit-orders/", **auth).json(), {"results": []})
+
+
+class SnapshotTests(StubQuotesMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("charted", password="secret-password")
+        self.idle = User.objects.create_user("idle", password="secret-password")
+        trading.buy(self.user, "AAPL", 10, Decimal(10))
+        trading.buy(self.user, "GONE", 1, Decimal(50))
+        self.serve_quotes(["AAPL"], price=12)
+
+    def test_snapshot_values_every_portfolio(self):
+        # Every batch of users costs the same handful of queries however many holdings they have
+        with self.assertNumQueries(8):
+            self.assertEqual(snapshot_portfolios(), 2)
+
+        snapshot = self.user.snapshots.get()
+        self.assertEqual((snapshot.cash, snapshot.holdings_value, snapshot.pnl), (Decimal(9850), Decimal(170), Decimal(20)))
+        self.assertEqual(snapshot.total, Decimal(10020))
+        self.assertEqual(Cash.objects.get(my_user=self.user).net_profit, Decimal(20))
+        self.assertEqual(self.idle.snapshots.get().total, Decimal(10000))
+
+    def test_history_is_downsampled(self):
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        for minute in range(100):
+            snapshot_portfolios(now=start + timedelta(minutes=minute))
+
+        self.assertEqual(len(history(self.user)), 100)
+        sampled = history(self.user, points=10)
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual(sampled[0][0], start + timedelta(minutes=9))
+        self.assertEqual(sampled[-1][0], start + timedelta(minutes=99))
+
+        auth = {"HTTP_AUTHORIZATION": "Token " + ApiToken.for_user(self.user).key}
+        response = self.client.get("/api/v1/portfolio/history/", {"since": "2026-01-01T01:30:00", "points": 5}, **auth)
+        self.assertEqual(len(response.json()["history"]), 5)
+        self.assertEqual(response.json()["history"][-1]["total"], "10020.00")
+        self.assertEqual(self.client.get("/api/v1/portfolio/history/?since=yesterday", **auth).status_code, 400)
+
+
+@override_settings(TEMPLATES=STUB_TEMPLATES_SETTINGS, FINANCE_INSTRUMENTATION={"ENABLED": True})
+class InstrumentationTests(StubQuotesMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("timed", password="secret-password")
+        self.client.force_login(self.user)
+        self.serve_quotes(["AAPL", "MSFT"], price=10)
+        trading.buy(self.user, "AAPL", 2, Decimal(10))
+        trading.buy(self.user, "MSFT", 1, Decimal(10))
+        instrumentation.metrics.reset()
+
+    def test_server_timing_breakdown(self):
+        response = self.client.get("/")
+
+        timing = response["Server-Timing"]
+        self.assertIn('desc="1 calls, 0% cached"', timing)
+        self.assertIn('desc="4 queries"', timing)
+        self.assertRegex(timing, r"render;dur=\d+\.\d+")
+
+        scraped = self.client.get("/metrics/").content.decode()
+        self.assertIn('finance_requests_total{view="index",method="GET",status="200"} 1', scraped)
+        self.assertIn('finance_upstream_calls_total{view="index"} 1', scraped)
+        self.assertIn('finance_db_queries_total{view="index"} 4', scraped)
+        self.assertIn('finance_request_duration_seconds_count{view="index"} 1', scraped)
+        # Process wide quote cache counters, the stub quote cache never keeping anything fresh
+        self.assertIn('finance_quote_cache_results_total{result="miss"} 2', scraped)
+        self.assertIn('finance_quote_cache_fetches_total 1', scraped)
+        self.assertIn('finance_quote_cache_entries 2', scraped)
+
+    def test_metrics_are_local_only(self):
+        self.assertEqual(self.client.get("/metrics/", REMOTE_ADDR="10.0.0.1").status_code, 404)
+
+    @override_settings(FINANCE_INSTRUMENTATION={"ENABLED": False})
+    def test_disabled(self):
+        response = Client().get("/login/")
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.client.get("/metrics/").status_code, 404)
+
+
+class CashModelBackendTests(TestCase):
+
+    def test_user_comes_with_cash(self):
+        user = User.objects.create_user("saver", password="secret-password")
+
+        with self.assertNumQueries(1):
+            self.assertEqual(CashModelBackend().get_user(user.pk).cash.in_hand_money, user.cash.in_hand_money)
+        self.assertIsNone(CashModelBackend().get_user(user.pk + 1))
+
+
+class BenchmarkTests(TestCase):
+
+    def test_benchmark_reports_every_endpoint(self):
+        results = run_benchmark(users=3, rows=5, symbols=4, requests=6, concurrency=1, probes=2)
+
+        self.assertEqual(set(results["endpoints"]), set(ENDPOINTS))
+        self.assertEqual(Purchase.objects.filter(my_user__username="bench0").count(), 5 + 3 + 3)
+        for endpoint, result in results["endpoints"].items():
+            self.assertEqual(result["errors"], 0, endpoint)
+            self.assertGreater(result["requests_per_second"], 0)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+        self.assertEqual(results["endpoints"]["index"]["queries"], 4)
+
+        slower = {"endpoints": {"index": {**results["endpoints"]["index"], "queries": 8}}}
+        self.assertEqual(compare_results(results, slower)["index"]["queries"], 1.0)
+
+    def test_performance_profile_saves_session_and_cash_queries(self):
+        results = measure_queries(users=2, rows=3, symbols=4, probes=2, endpoints=("index", "add_balance"))
+
+        self.assertEqual(results["index"], {"current": 4, "profile": 2})
+        self.assertEqual(results["add_balance"]["profile"], results["add_balance"]["current"] - 1)
+
+    def test_percentile(self):
+        self.assertEqual(percentile(list(range(1, 101)), 0.95), 95)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
@@ -0,0 +1,230 @@
+from collections import defaultdict, deque
+
+from django.db import transaction
+from django.db.models import F
+
+from .lots import AVERAGE, close_lots, lot_method, realized, take
+from .models import Cash, Holding, Lot, Purchase
+from .money import MAX_MONEY, money, price
+from .pages import invalidate_portfolio
+
+# Trade execution shared by the views.
+# Every trade runs in one transaction and checks cash or shares with conditional
+# UPDATEs, so parallel submissions for the same user can't overspend or oversell.
+# Purchases open a lot and sales consume lots, recording the P&L they realize.
+# Symbols are stored upper case whatever the case they were submitted in.
+# Once committed, a trade drops the user's cached portfolio page.
+
+
+class TradeError(Exception):
+    """A trade that can't be executed, the message is meant for the user."""
+
+
+class InsufficientFunds(TradeError):
+    pass
+
+
+class InsufficientShares(TradeError):
+    pass
+
+
+class BalanceTooLarge(TradeError):
+    pass
+
+
+class PositionTooLarge(TradeError):
+    pass
+
+
+def buy(user, stock, shares, price):
+    """Buy shares of stock at price, paying for them from the user's cash."""
+    stock = stock.upper()
+    total_cost = money(shares * price)
+    purchase = Purchase(my_user=user, stock=stock, shares=shares, price=price)
+
+    with transaction.atomic():
+        # Ensure user has enough cash, checking and paying in one statement
+        paid = Cash.objects.filter(my_user=user, in_hand_money__gte=total_cost).update(
+            in_hand_money=F('in_hand_money') - total_cost
+        )
+        if not paid:
+            raise InsufficientFunds("Sorry you don't have enough cash !!")
+
+        # Ensure the cost basis of the position still fits its column, rolling the payment back otherwise
+        if not Holding.apply(purchase):
+            raise PositionTooLarge("This position would be too large to record !!")
+        Lot.objects.create(my_user=user, stock=stock, shares=shares, price=price)
+        purchase.save()
+        transaction.on_commit(lambda: invalidate_portfolio(user.pk))
+
+    return purchase
+
+
+def deposit(user, amount):
+    """Add amount to the user's cash, as long as the balance still fits its column."""
+    amount = money(amount)
+    cash = Cash.objects.filter(my_user=user, in_hand_money__lte=MAX_MONEY - amount)
+    if amount > MAX_MONEY or not cash.update(in_hand_money=F('in_hand_money') + amount):
+        raise BalanceTooLarge("Your wallet can't hold that much cash !!")
+    transaction.on_commit(lambda: invalidate_portfolio(user.pk))
+
+
+def sell(user, stock, shares, price):
+    """Sell shares of stock at price, crediting the user's cash."""
+    stock = stock.upper()
+    purchase = Purchase(my_user=user, stock=stock, shares=-shares, price=price)
+
+    with transaction.atomic():
+        # Credit the cash first, locking its row as buy() and execute_batch() do, so that
+        # trades of the same user can't deadlock. A failed sale rolls the credit back.
+        proceeds = money(shares * price)
+        cash = Cash.objects.filter(my_user=user)
+        if not cash.filter(in_hand_money__lte=MAX_MONEY - proceeds).update(in_hand_money=F('in_hand_money') + proceeds):
+            raise BalanceTooLarge("Your wallet can't hold that much cash !!")
+
+        # Ensure user has enough shares, checking and removing them under the holding's lock
+        released = Holding.release(purchase)
+        if released is None:
+            if not Holding.objects.filter(my_user=user, stock=stock).exists():
+                raise InsufficientShares("You don't have this stock !!")
+            raise InsufficientShares("Too many shares !!")
+
+        cost = close_lots(user, stock, shares, price)
+        if lot_method() == AVERAGE:
+            cost = released
+        purchase.realized_pnl = realized(shares, price, cost)
+        purchase.save()
+        cash.update(realized_profit=F('realized_profit') + purchase.realized_pnl)
+        transaction.on_commit(lambda: invalidate_portfolio(user.pk))
+
+    return purchase
+
+
+class BatchRejected(TradeError):
+    """An all-or-nothing batch with at least one order that can't be executed."""
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+
+BUY, SELL = "buy", "sell"
+
+
+def execute_batch(user, orders, prices, all_or_nothing=True, batch_size=1000):
+    """Execute [{side, symbol, shares}] orders at prices {symbol: price} in one transaction.
+
+    Orders are checked in sequence against the cash and holdings they leave behind,
+    so a sale early in the batch pays for a later purchase. Returns one
+    {index, status, error, purchase} result per order, status being "filled" or
+    "rejected". Unless all_or_nothing is False, a single rejected order rejects
+    the whole batch with BatchRejected and nothing is written.
+    """
+    with transaction.atomic():
+        cash_row = Cash.objects.select_for_update().get(my_user=user)
+        symbols = {order["symbol"] for order in orders}
+        holdings = {
+            holding.stock: holding
+            for holding in Holding.objects.select_for_update().filter(my_user=user, stock__in=symbols)
+        }
+
+        # Open lots of the positions sold from, oldest first
+        average = lot_method() == AVERAGE
+        sold = {order["symbol"] for order in orders if order["side"] == SELL}
+        lots = defaultdict(deque)
+        for lot in Lot.objects.select_for_update().filter(my_user=user, stock__in=sold).order_by('id'):
+            lots[lot.stock].append(lot)
+        # id(lot) -> (lot, its shares before the batch) of every lot a sale took shares from
+        consumed = {}
+
+        cash, gains = cash_row.in_hand_money, 0
+        results, purchases, changed = [], [], set()
+        for index, order in enumerate(orders):
+            stock, shares, unit_price = order["symbol"], order["shares"], prices.get(order["symbol"])
+            holding = holdings.get(stock)
+
+            if unit_price is None:
+                error = "Invalid Symbol !!"
+            elif order["side"] == BUY and money(shares * unit_price) > cash:
+                error = "Sorry you don't have enough cash !!"
+            elif order["side"] == BUY and holding is not None and holding.cost_basis + shares * unit_price > MAX_MONEY:
+                error = "This position would be too large to record !!"
+            elif order["side"] == SELL and holding is None:
+                error = "You don't have this stock !!"
+            elif order["side"] == SELL and shares > holding.shares:
+                error = "Too many shares !!"
+            elif order["side"] == SELL and cash + money(shares * unit_price) > MAX_MONEY:
+                error = "Your wallet can't hold that much cash !!"
+            else:
+                error = None
+            if error:
+                results.append({"index": index, "status": "rejected", "error": error, "purchase": None})
+                continue
+
+            if holding is None:
+                holding = holdings[stock] = Holding(my_user=user, stock=stock)
+            if order["side"] == BUY:
+                cash -= money(shares * unit_price)
+                holding.cost_basis += shares * unit_price
+                holding.shares += shares
+                lots[stock].append(Lot(my_user=user, stock=stock, shares=shares, price=unit_price))
+                gain = None
+            else:
+                cash += money(shares * unit_price)
+                position, remaining = lots[stock], shares
+                for lot in position:
+                    if not remaining:
+                        break
+                    consumed.setdefault(id(lot), (lot, lot.shares))
+                    remaining -= min(remaining, lot.shares)
+                cost = take(position, shares, unit_price)
+                while position and not position[0].shares:
+                    position.popleft()
+                # Selling releases the average cost of the shares sold
+                released = holding.cost_basis * shares / holding.shares
+                holding.cost_basis -= released
+                holding.shares -= shares
+                gain = realized(shares, unit_price, released if average else cost)
+                gains += gain
+                shares = -shares
+            changed.add(stock)
+
+            purchase = Purchase(my_user=user, stock=stock, shares=shares, price=unit_price, realized_pnl=gain)
+            purchases.append(purchase)
+            results.append({"index": index, "status": "filled", "error": None, "purchase": purchase})
+
+        rejected = sum(result["status"] == "rejected" for result in results)
+        if rejected and all_or_nothing:
+            for result in results:
+                result["purchase"] = None
+            raise BatchRejected(f"{rejected} of {len(orders)} orders can't be executed", results)
+
+        for stock in changed:
+            holdings[stock].cost_basis = price(holdings[stock].cost_basis)
+        Holding.objects.bulk_update(
+            [holdings[stock] for stock in changed if holdings[stock].pk is not None],
+            ["shares", "cost_basis"], batch_size=batch_size,
+        )
+        Holding.objects.bulk_create(
+            [holdings[stock] for stock in changed if holdings[stock].pk is None], batch_size=batch_size,
+        )
+        Purchase.objects.bulk_create(purchases, batch_size=batch_size)
+
+        # Lots read from the table were consumed or kept, new ones are created unless already sold
+        consumed = [(lot, shares) for lot, shares in consumed.values() if lot.pk is not None]
+        Lot.objects.filter(id__in=[lot.id for lot, _ in consumed if not lot.shares]).delete()
+        Lot.objects.bulk_update(
+            [lot for lot, shares in consumed if 0 < lot.shares != shares],
+            ["shares"], batch_size=batch_size,
+        )
+        Lot.objects.bulk_create(
+            [lot for position in lots.values() for lot in position if lot.pk is None and lot.shares],
+            batch_size=batch_size,
+        )
+        if purchases:
+            Cash.objects.filter(pk=cash_row.pk).update(
+                in_hand_money=cash, realized_profit=F('realized_profit') + gains,
+            )
+            transaction.on_commit(lambda: invalidate_portfolio(user.pk))
+
+    return results
@@ -0,0 +1,221 @@
+import heapq
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from itertools import count
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import trading
+from .helpers import lookup_many
+from .models import LimitOrder, PriceAlert
+from .trading import TradeError
+
+logger = logging.getLogger(__name__)
+
+# Limit orders and price alerts, evaluated against every tick by an in-memory index.
+# Each symbol keeps a heap of the triggers firing when the price falls to them and one
+# of those firing when it rises to them, so a tick only pops what it crosses.
+
+ORDER, ALERT = "order", "alert"
+
+# Seconds of creation times every sync reads again, for triggers committed after newer ones were read
+SYNC_OVERLAP = 60
+
+# Seconds between two rebuilds of the book from the open triggers, which drop cancelled and deleted ones
+RELOAD_INTERVAL = 300
+
+
+class TriggerBook:
+    """Open triggers indexed per symbol by the price they fire at."""
+
+    def __init__(self):
+        # symbol -> max-heap of (-price, seq, kind, id) firing at or below price
+        self.falling = defaultdict(list)
+        # symbol -> min-heap of (price, seq, kind, id) firing at or above price
+        self.rising = defaultdict(list)
+        self._seq = count()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def symbols(self):
+        return sorted(symbol for symbol in set(self.falling) | set(self.rising)
+                      if self.falling.get(symbol) or self.rising.get(symbol))
+
+    def add(self, symbol, price, rising, kind, id):
+        """Fire (kind, id) once symbol trades at or above price when rising is set, at or below otherwise."""
+        if rising:
+            heapq.heappush(self.rising[symbol], (price, next(self._seq), kind, id))
+        else:
+            heapq.heappush(self.falling[symbol], (-price, next(self._seq), kind, id))
+        self._size += 1
+
+    def extend(self, triggers):
+        """Add many (symbol, price, rising, kind, id) at once, heapifying each symbol once."""
+        touched = set()
+        for symbol, price, rising, kind, id in triggers:
+            if rising:
+                self.rising[symbol].append((price, next(self._seq), kind, id))
+            else:
+                self.falling[symbol].append((-price, next(self._seq), kind, id))
+            touched.add((symbol, rising))
+            self._size += 1
+        for symbol, rising in touched:
+            heapq.heapify(self.rising[symbol] if rising else self.falling[symbol])
+
+    def crossed(self, symbol, price):
+        """Remove and return [(kind, id)] of the triggers of symbol firing at price."""
+        fired = []
+        falling = self.falling.get(symbol)
+        while falling and -falling[0][0] >= price:
+            _, _, kind, id = heapq.heappop(falling)
+            fired.append((kind, id))
+        rising = self.rising.get(symbol)
+        while rising and rising[0][0] <= price:
+            _, _, kind, id = heapq.heappop(rising)
+            fired.append((kind, id))
+        self._size -= len(fired)
+        return fired
+
+
+def order_trigger(order_id, side, stock, limit_price):
+    # Buying fires once the price falls to the limit, selling once it rises to it
+    return stock, limit_price, side == LimitOrder.SELL, ORDER, order_id
+
+
+def alert_trigger(alert_id, direction, stock, price):
+    return stock, price, direction == PriceAlert.ABOVE, ALERT, alert_id
+
+
+def fill_order(order_id, unit_price):
+    """Execute an open limit order at unit_price through finance.trading.
+
+    Returns the order, filled or rejected, or None when it is no longer open,
+    e.g. because it was cancelled after the engine loaded it.
+    """
+    with transaction.atomic():
+        order = (LimitOrder.objects.select_for_update().select_related('my_user')
+                 .filter(id=order_id, status=LimitOrder.OPEN).first())
+        if order is None:
+            return None
+
+        execute = trading.buy if order.side == LimitOrder.BUY else trading.sell
+        try:
+            with transaction.atomic():
+                order.purchase = execute(order.my_user, order.stock, order.shares, unit_price)
+            order.status = LimitOrder.FILLED
+        except TradeError as e:
+            order.status, order.error = LimitOrder.REJECTED, str(e)
+        order.closed_at = timezone.now()
+        order.save(update_fields=['purchase', 'status', 'error', 'closed_at'])
+    return order
+
+
+class TriggerEngine:
+    """Loads open orders and alerts into a TriggerBook and fires them on incoming ticks."""
+
+    def __init__(self, fetch_many=lookup_many, interval=1.0, batch_size=100, reload_interval=RELOAD_INTERVAL):
+        self.fetch_many = fetch_many
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reload_interval = reload_interval
+        self.book = TriggerBook()
+        # (kind, id) of every trigger in the book
+        self._loaded = set()
+        self._synced_at = None
+        self._reloaded_at = None
+
+    @staticmethod
+    def open_triggers(since=None):
+        """Yield the triggers of the open orders and alerts, only those created from since when it is set."""
+        orders = LimitOrder.objects.filter(status=LimitOrder.OPEN)
+        alerts = PriceAlert.objects.filter(triggered_at=None)
+        if since is not None:
+            orders, alerts = orders.filter(created_at__gte=since), alerts.filter(created_at__gte=since)
+        for row in orders.order_by('id').values_list('id', 'side', 'stock', 'limit_price').iterator(chunk_size=5000):
+            yield order_trigger(*row)
+        for row in alerts.order_by('id').values_list('id', 'direction', 'stock', 'price').iterator(chunk_size=5000):
+            yield alert_trigger(*row)
+
+    def sync(self):
+        """Add orders and alerts created since the last sync, returning how many.
+
+        Creation times overlap the previous sync by SYNC_OVERLAP seconds, as a
+        trigger may commit after newer ones were read, and every reload_interval
+        the book is rebuilt instead, which also catches any trigger committed
+        later than that.
+        """
+        if self._reloaded_at is None or time.monotonic() - self._reloaded_at >= self.reload_interval:
+            return self.reload()
+
+        since, self._synced_at = self._synced_at - timedelta(seconds=SYNC_OVERLAP), timezone.now()
+        triggers = [trigger for trigger in self.open_triggers(since) if trigger[3:] not in self._loaded]
+        self._loaded.update(trigger[3:] for trigger in triggers)
+        self.book.extend(triggers)
+        return len(triggers)
+
+    def reload(self):
+        """Rebuild the book from every open order and alert, returning how many."""
+        self._synced_at, self._reloaded_at = timezone.now(), time.monotonic()
+        triggers = list(self.open_triggers())
+        self.book = TriggerBook()
+        self.book.extend(triggers)
+        self._loaded = {trigger[3:] for trigger in triggers}
+        return len(triggers)
+
+    def on_tick(self, quotes):
+        """Fire every trigger crossed by quotes {SYMBOL: quote}, returning {"orders": [...], "alerts": [...]}."""
+        fired = {"orders": [], "alerts": []}
+        alerts = defaultdict(list)
+        for symbol, quote in quotes.items():
+            if quote is None:
+                continue
+            for kind, id in self.book.crossed(symbol, quote["price"]):
+                self._loaded.discard((kind, id))
+                if kind == ALERT:
+                    alerts[quote["price"]].append(id)
+                else:
+                    order = fill_order(id, quote["price"])
+                    if order is not None:
+                        fired["orders"].append(order)
+
+        # One UPDATE per distinct price for every alert crossed by this tick and still open,
+        # alerts deleted or fired elsewhere since the book was loaded aren't reported
+        now = timezone.now()
+        for unit_price, ids in alerts.items():
+            with transaction.atomic():
+                ids = list(PriceAlert.objects.select_for_update().filter(id__in=ids, triggered_at=None)
+                           .values_list('id', flat=True))
+                PriceAlert.objects.filter(id__in=ids).update(triggered_at=now, triggered_price=unit_price)
+            fired["alerts"] += ids
+        return fired
+
+    def cycle(self):
+        """Pick up new triggers, fetch quotes of every symbol with open ones and fire what they cross."""
+        self.sync()
+        symbols = self.book.symbols()
+        fired = {"orders": [], "alerts": []}
+        for start in range(0, len(symbols), self.batch_size):
+            result = self.on_tick(self.fetch_many(symbols[start:start + self.batch_size]))
+            fired["orders"] += result["orders"]
+            fired["alerts"] += result["alerts"]
+        return fired
+
+    def run(self, cycles=None, report=None):
+        """Run cycles every interval seconds, forever when cycles is None."""
+        done = 0
+        while cycles is None or done < cycles:
+            started = time.monotonic()
+            fired = self.cycle()
+            done += 1
+            if fired["orders"] or fired["alerts"]:
+                logger.info("Fired %d orders and %d alerts, %d triggers open",
+                            len(fired["orders"]), len(fired["alerts"]), len(self.book))
+            if report is not None:
+                report(fired, len(self.book))
+            if cycles is None or done < cycles:
+                time.sleep(max(0, self.interval - (time.monotonic() - started)))
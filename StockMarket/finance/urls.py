@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.urls import path
+
+from . import async_views, instrumentation, views
+from .live import live_options
+
+# Quote bound views run as coroutines when served by StockMarket.asgi
+quote_views = async_views if settings.FINANCE_ASYNC_VIEWS else views
+
+urlpatterns = [
+    path('', quote_views.index, name='index'),
+    path('login/', views.login_view, name='login'),
+    path('logout/', views.logout_view, name='logout'),
+    path('register/', views.register, name='register'),
+    path('quote/', quote_views.quote, name='quote'),
+    path('buy/', quote_views.buy, name='buy'),
+    path('sell/', quote_views.sell, name='sell'),
+    path('add_balance/', views.add_balance, name='add_balance'),
+    path('symbols/', views.symbols, name='symbols'),
+    path('export/', views.export, name='export'),
+    path('metrics/', instrumentation.metrics_view, name='metrics'),
+    # Only reached under WSGI, StockMarket.asgi streams the live rates before Django sees the request
+    path(live_options()["PATH"].lstrip("/"), views.live_rates, name='live'),
+]
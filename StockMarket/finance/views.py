@@ -1,17 +1,26 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.contrib import messages
 
-from django.contrib.auth.forms import UserCreationForm, QuoteForm, BuyForm, AddBalanceForm
-from .forms import CreateUserForm
+from .forms import CreateUserForm, QuoteForm, BuyForm, AddBalanceForm
 
-from .helpers import lookup, usd
-from .models import Cash, Purchase
-from django.db.models import Sum
+from .exports import export_options, export_response
+from .helpers import lookup, lookup_many, usd
+from .pages import cached_response, conditional, get_portfolio_pages
+from .portfolio import page_context, positions
+from .ratelimit import rate_limited
+from . import symbols as symbol_directory
+from .symbols import is_known
+from . import trading
+from .trading import TradeError
 
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+# Entries returned by the symbol autocompletion
+SYMBOL_SUGGESTIONS = 10
 
 # Create your views here.
 
@@ -63,6 +72,7 @@ def register(request):
         })
 
 @login_required(login_url='login')
+@rate_limited("quote", methods=("POST",))
 def quote(request):
     """Get stock information and its live rates"""
     if request.method == "POST":
@@ -95,6 +105,7 @@ def quote(request):
         })
 
 @login_required(login_url='login')
+@rate_limited("buy", methods=("POST",))
 def buy(request):
     """Buy shares of stock"""
     if request.method == "POST":
@@ -102,7 +113,7 @@ def buy(request):
 
         if form.is_valid():
 
-            stock_symbol = form.cleaned_data["symbol"]
+            stock_symbol = form.cleaned_data["symbol"].upper()
             total_shares = form.cleaned_data["shares"]
             
             # Calling API to get stock information
@@ -115,24 +126,16 @@ def buy(request):
                     "message": "Invalid Symbol !!"
                 })
 
-            # Ensure user has enough cash to purchase shares
-            stock_price = stock_data["price"]
-            total_cost = float(stock_price) * int(total_shares)
-
-            if float(request.user.cash.in_hand_money) < total_cost:
+            # Commit a transaction for the user, paying for the shares and recording the purchase
+            # Ensures user has enough cash to purchase shares
+            try:
+                trading.buy(request.user, stock_symbol, total_shares, stock_data["price"])
+            except TradeError as e:
                 return render(request, "finance/buy.html", {
                     "form": form,
-                    "message": "Sorry you don't have enough cash !!"
+                    "message": str(e)
                 })
 
-            # Commit a transaction for the user and insert data in Purchase table/model
-            transaction = Purchase(my_user=request.user, stock=stock_symbol, shares=total_shares, price=stock_price)
-            transaction.save()
-
-            # Update in_hand_money for cash table for the given user
-            request.user.cash.in_hand_money -= total_cost
-            request.user.cash.save()
-
             messages.success(request, str(total_shares) + " shares of " + stock_symbol + " was bought !!")
             return HttpResponseRedirect(reverse("index"))
 
@@ -143,11 +146,12 @@ def buy(request):
 
 
 @login_required(login_url='login')
+@rate_limited("sell", methods=("POST",))
 def sell(request):
     """Sell shares of stock"""
 
     if request.method == "POST":
-        stock_symbol = request.POST.get("symbol")
+        stock_symbol = request.POST.get("symbol", "").upper()
         total_shares = request.POST.get("shares")
 
         # Ensure quote symbol was submitted
@@ -174,44 +178,50 @@ def sell(request):
                     "message": "Invalid Input !!"
                 })
 
-        # Grouping all the purchases done by user for given stock as per the total number of shares
-        purchases = request.user.purchases.all()
-        grouped_purchases = purchases.filter(stock=stock_symbol).annotate(total_shares=Sum('shares'))
+        # Ensure it is a listed symbol before querying the ledger with it
+        if not is_known(stock_symbol):
+            return render(request, "finance/sell.html", {
+                    "message": "Invalid Symbol !!"
+                })
+
+        # Current holding of the user for given stock, kept up to date with every purchase
+        holding = request.user.holdings.filter(stock=stock_symbol).first()
 
         total_shares = int(total_shares)
 
         # Ensure user has the given stock
-        if len(grouped_purchases) == 0:
+        if holding is None:
             return render(request, "finance/sell.html", {
                     "message": "You don't have this stock !!"
                 })
 
         # Ensure user has enough shares for the given stock to sell
-        if total_shares > grouped_purchases[0].total_shares:
+        if total_shares > holding.shares:
             return render(request, "finance/sell.html", {
                     "message": "Too many shares !!"
                 })
 
         # Lookup for stock & know its current val and then sell it
         stock_data = lookup(stock_symbol)
+        if not stock_data:
+            return render(request, "finance/sell.html", {
+                    "message": "Invalid Symbol !!"
+                })
 
-        # Update shares column in purchase table
-        transaction = Purchase(my_user=request.user, stock=stock_symbol, shares=-total_shares, price=stock_data["price"])
-        transaction.save()
-
-        # Update in_hand_money for cash table for the given user
-        request.user.cash.in_hand_money += stock_data["price"]*total_shares
-        request.user.cash.save()
+        # Commit a transaction for the user, removing the shares and crediting the cash
+        # Shares are checked again as they could have been sold since the check above
+        try:
+            trading.sell(request.user, stock_symbol, total_shares, stock_data["price"])
+        except TradeError as e:
+            return render(request, "finance/sell.html", {
+                    "message": str(e)
+                })
 
         messages.success(request, str(total_shares) + " shares of " + stock_symbol + " was sold !!")
         return HttpResponseRedirect(reverse("index"))
     else:
-        # Allowing users to see all their purchases so that they can make informed decision about selling
-        purchases = request.user.purchases.all()
-        stocks = set()
-        for purchase in purchases:
-            stock = purchase.stock
-            stocks.add(stock)
+        # Allowing users to see all the stocks they hold so that they can make informed decision about selling
+        stocks = request.user.holdings.filter(shares__gt=0).values_list('stock', flat=True)
         return render(request, "finance/sell.html", {
             "stocks": stocks
         })
@@ -221,28 +231,21 @@ def sell(request):
 # It will display user's total cash in hand, list of all the purchases done and its total cost
 @login_required(login_url='login')
 def index(request):
-    cash = request.user.cash.in_hand_money
-    
+    # Serve the page rendered earlier when neither holdings nor prices changed since
+    pages = get_portfolio_pages()
+    slot, page = pages.lookup(request)
+    if page is not None:
+        return cached_response(request, page)
+
     # SQL Query to be executed:
-    # SELECT stock, SUM(shares) FROM purchase WHERE id = user_id GROUP BY stock ORDER BY stock
-    purchases = request.user.purchases.all()
-    grouped_purchases = purchases.values('stock').annotate(total_shares=Sum('shares')).order_by('stock')
+    # SELECT stock, shares FROM holding WHERE user_id = user_id AND shares > 0 ORDER BY stock
+    cash, holdings = positions(request.user)
 
-    total = cash
-    # Modifying list of purchases and adding new key-values to each purchase obj
-    for purchase in grouped_purchases:
-        stock_data = lookup(purchase["stock"])
-        purchase["stock"] = stock_data["symbol"]
-        purchase["price"] = usd(stock_data["price"])
-        purchase["name"] = stock_data["name"]
-        purchase["sum"] = usd(purchase["total_shares"] * stock_data["price"])
-        total = float(total) + float(purchase["total_shares"] * stock_data["price"])
+    # Fetching quotes of all the stocks at once rather than one API call per stock
+    quotes = lookup_many([holding["stock"] for holding in holdings])
 
-    return render(request, "finance/index.html", {
-        "total": usd(total),
-        "cash": usd(cash),
-        "purchases": grouped_purchases
-    })
+    response = render(request, "finance/index.html", page_context(cash, holdings, quotes))
+    return conditional(request, response, pages.store(slot, response.content))
 
 
 
@@ -263,11 +266,47 @@ def add_balance(request):
                     "message": "Invalid amount entered !!"
                 })
 
-            # Update in_hand_money for cash table for the given user and add balance 
-            request.user.cash.in_hand_money += add_balance
-            request.user.cash.save()
+            # Update in_hand_money for cash table for the given user and add balance
+            try:
+                trading.deposit(request.user, add_balance)
+            except TradeError as e:
+                return render(request, "finance/addBalance.html", {
+                    "form": form,
+                    "message": str(e)
+                })
 
             messages.success(request, str(add_balance) + " balance was added to your wallet !!")
             return HttpResponseRedirect(reverse("index"))
+
+        return render(request, "finance/addBalance.html", {
+            "form": form,
+            "message": "Invalid amount entered !!"
+        })
     else:
         return render(request, "finance/addBalance.html")
+
+
+@login_required(login_url='login')
+@require_GET
+def symbols(request):
+    """Symbols and companies matching ?q= for the autocompletion of symbol fields"""
+    return JsonResponse({"symbols": symbol_directory.search(request.GET.get("q", ""), SYMBOL_SUGGESTIONS)})
+
+
+@login_required(login_url='login')
+@require_GET
+def export(request):
+    """Download the user's trades as ?format=csv|json, from ?since= to ?until=, gzipped with ?gzip=1"""
+    try:
+        options = export_options(request.GET)
+    except ValueError:
+        return HttpResponse("Invalid Input !!", status=400)
+    return export_response(request.user, **options)
+
+
+def live_rates(request):
+    """Live rates are streamed by the ASGI app only, say so rather than answering 404"""
+    return HttpResponse(
+        "Live rates are only streamed by the ASGI server, e.g. uvicorn StockMarket.asgi:application\n",
+        status=501, content_type="text/plain",
+    )